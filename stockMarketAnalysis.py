@@ -1,72 +1,175 @@
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-from io import BytesIO
+from html import escape
+from io import BytesIO, StringIO
 import base64
-import pandas as pd
-import seaborn as sns
-import boto3
 import sys
 import logging
 import os
 import math
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
-from botocore.exceptions import ClientError
+import time
+import random
+import threading
+import struct
+import hashlib
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from operator import itemgetter
+from email.utils import formatdate, make_msgid
+import gzip
+import zipfile
+import uuid
+import shutil
+import tempfile
+import json
+import resource
+from contextlib import contextmanager
+from functools import lru_cache
 import warnings
 import numpy as np
-from scipy import stats
 warnings.filterwarnings("ignore")
 
 # Set the MPLCONFIGDIR to use the /tmp directory
 os.environ['MPLCONFIGDIR'] = '/tmp'
 
+# matplotlib, pandas, PIL, Jinja2 and boto3 are imported where they are first used
+# and AWS clients are created on first use, so a cold start only pays for what the
+# invocation needs. All of them are cached for warm invocations.
+
 api_key = 'demo'
 aws_region = 'us-east-1'
 table_name = "EmailCredentials"
 
-# Initialize a DynamoDB resource
-dynamodb = boto3.resource('dynamodb')
+# Point DynamoDB at a local stand-in (e.g. DynamoDB Local at http://localhost:8000)
+DYNAMODB_ENDPOINT = os.environ.get('DYNAMODB_ENDPOINT') or None
+# Sender and recipients are read from DynamoDB at most once per this many seconds per container
+RECIPIENT_CACHE_TTL = float(os.environ.get('RECIPIENT_CACHE_TTL', 300))
+# Recipients are items whose emailID starts with RECIPIENT_PREFIX. With RECIPIENT_INDEX set they are
+# read by querying that index for RECIPIENT_INDEX_KEY = RECIPIENT_PREFIX instead of scanning the table.
+# A recipient's optional `watchlist` attribute (list, string set or comma-separated string of
+# tickers) limits their report to those tickers.
+RECIPIENT_PREFIX = os.environ.get('RECIPIENT_PREFIX', 'recipient')
+RECIPIENT_INDEX = os.environ.get('RECIPIENT_INDEX', '')
+RECIPIENT_INDEX_KEY = os.environ.get('RECIPIENT_INDEX_KEY', 'emailType')
 
-# Boto3 SES client
-ses_client = boto3.client('ses', region_name=aws_region)
+_dynamodb = None
+_dynamodb_client = None
+_ses_client = None
+# (monotonic expiry, sender, {recipient: watchlist or None}) of the last lookup
+_email_credentials_cache = None
 
-def get_email_credentials():
-    table = dynamodb.Table(table_name)
+def get_dynamodb():
+    """Return the DynamoDB resource, creating it on first use."""
+    global _dynamodb
+    if _dynamodb is None:
+        import boto3
+        _dynamodb = boto3.resource('dynamodb', endpoint_url=DYNAMODB_ENDPOINT)
+    return _dynamodb
 
-    try:
-        # Fetch the data from DynamoDB
-        response = table.scan()
+def get_dynamodb_client():
+    """Return the low-level DynamoDB client, creating it on first use."""
+    global _dynamodb_client
+    if _dynamodb_client is None:
+        import boto3
+        _dynamodb_client = boto3.client('dynamodb', endpoint_url=DYNAMODB_ENDPOINT)
+    return _dynamodb_client
 
-        if 'Items' in response:
-            # Initialize variables
-            sender = None
-            recipients = []  # Initialize a list for recipients
+def get_ses_client():
+    """Return the SES client, creating it on first use."""
+    global _ses_client
+    if _ses_client is None:
+        import boto3
+        _ses_client = boto3.client('ses', region_name=aws_region)
+    return _ses_client
 
-            # Loop through items and extract email addresses
-            for item in response['Items']:
-                if item['emailID'] == 'sender':
-                    sender = item['emailAddress']
-                elif item['emailID'].startswith('recipient'):  # Dynamically handle recipients
-                    recipients.append(item['emailAddress'])
+def get_sender_email(client):
+    """Read the sender address with a single GetItem."""
+    response = client.get_item(
+        TableName=table_name, Key={'emailID': {'S': 'sender'}}, ProjectionExpression='emailAddress'
+    )
+    item = response.get('Item')
+    return item['emailAddress']['S'] if item else None
 
-            # Ensure sender and recipients are valid
-            if not sender:
-                raise ValueError("Sender email not defined in DynamoDB")
-            if not recipients:
-                raise ValueError("No recipient emails found in DynamoDB")
+def parse_watchlist(attribute):
+    """Tickers of a DynamoDB `watchlist` attribute value (L, SS or comma-separated S), or None if there are none."""
+    if not attribute:
+        return None
+    if 'L' in attribute:
+        values = [value['S'] for value in attribute['L'] if 'S' in value]
+    elif 'SS' in attribute:
+        values = attribute['SS']
+    else:
+        values = attribute.get('S', '').split(',')
+    watchlist = tuple(dict.fromkeys(value.strip().upper() for value in values if value.strip()))
+    return watchlist or None
 
-            return sender, recipients
+def iter_recipients(client):
+    """
+    Yield (address, watchlist or None) for every recipient, following LastEvaluatedKey across pages.
 
-        else:
-            raise ValueError("No email credentials found in DynamoDB")
+    Only emailID, emailAddress and watchlist are read. Uses a query on RECIPIENT_INDEX
+    when it is set, otherwise a scan filtered on the emailID prefix.
+    """
+    if RECIPIENT_INDEX:
+        pages = client.get_paginator('query').paginate(
+            TableName=table_name,
+            IndexName=RECIPIENT_INDEX,
+            KeyConditionExpression='#type = :prefix',
+            ProjectionExpression='emailID, emailAddress, watchlist',
+            ExpressionAttributeNames={'#type': RECIPIENT_INDEX_KEY},
+            ExpressionAttributeValues={':prefix': {'S': RECIPIENT_PREFIX}},
+        )
+    else:
+        pages = client.get_paginator('scan').paginate(
+            TableName=table_name,
+            ProjectionExpression='emailID, emailAddress, watchlist',
+            FilterExpression='begins_with(emailID, :prefix)',
+            ExpressionAttributeValues={':prefix': {'S': RECIPIENT_PREFIX}},
+        )
+    for page in pages:
+        for item in page['Items']:
+            if 'emailAddress' in item:
+                yield item['emailAddress']['S'], parse_watchlist(item.get('watchlist'))
 
+def get_subscriptions(refresh=False):
+    """
+    Return (sender, {recipient: watchlist or None}) from DynamoDB, cached for RECIPIENT_CACHE_TTL seconds.
+
+    :param refresh: Ignore the cached result
+    """
+    from botocore.exceptions import ClientError
+
+    global _email_credentials_cache
+    if not refresh and _email_credentials_cache and _email_credentials_cache[0] > time.monotonic():
+        return _email_credentials_cache[1], dict(_email_credentials_cache[2])
+
+    client = get_dynamodb_client()
+    try:
+        sender = get_sender_email(client)
+        # Keyed by address: duplicates would receive the report twice
+        subscriptions = dict(iter_recipients(client))
     except ClientError as e:
         print(f"Error fetching email credentials: {e}")
         raise
 
+    # Ensure sender and recipients are valid
+    if not sender:
+        raise ValueError("Sender email not defined in DynamoDB")
+    if not subscriptions:
+        raise ValueError("No recipient emails found in DynamoDB")
+
+    logger.info(f"Loaded {len(subscriptions):,} recipients from DynamoDB")
+    _email_credentials_cache = (time.monotonic() + RECIPIENT_CACHE_TTL, sender, subscriptions)
+    return sender, dict(subscriptions)
+
+def get_email_credentials(refresh=False):
+    """Return (sender, recipients) from DynamoDB; see get_subscriptions."""
+    sender, subscriptions = get_subscriptions(refresh)
+    return sender, list(subscriptions)
+
 # Configuration
 tickers = {
     'AAPL': 'Apple Inc. - Technology company known for iPhones and Macs.',
@@ -91,354 +194,1869 @@ tickers = {
     'CSCO': 'Cisco Systems, Inc. - Networking hardware and telecommunications equipment.'
 }
 
+# Timeframes reported for every ticker: (key, label, time_range)
+TIMEFRAMES = [
+    ('7_days', '7 Days', 7),
+    ('30_days', '30 Days', 30),
+    ('6_months', '6 Months', 180),
+    ('1_year', '1 Year', 365),
+    ('ytd', 'Year-to-Date', 'ytd'),
+    ('5_years', '5 Years', '5y'),
+]
+
+# One row per trading day, kept sorted by date
+BAR_DTYPE = np.dtype([
+    ('Date', 'datetime64[D]'),
+    ('Open', 'f8'),
+    ('High', 'f8'),
+    ('Low', 'f8'),
+    ('Close', 'f8'),
+    ('Volume', 'i8'),
+])
+
+def get_window_start(time_range, current_date=None):
+    """
+    Return the first trading day included in a time range.
+
+    :param time_range: Can be 'ytd' for year-to-date, '5y' for 5 years, or an integer for number of days
+    :param current_date: Reference time, defaults to now
+    :return: numpy datetime64[D]
+    """
+    current_date = current_date or datetime.now()
+
+    if time_range == 'ytd':
+        start_date = datetime(current_date.year, 1, 1)
+    elif time_range == '5y':
+        start_date = current_date - timedelta(days=5*365)
+    elif isinstance(time_range, int):
+        start_date = current_date - timedelta(days=time_range)
+    else:
+        raise ValueError("Invalid time_range. Use 'ytd', '5y', or an integer for days.")
+
+    # Bars are dated at midnight, so a start part-way through a day excludes that day
+    first_day = np.datetime64(start_date.date(), 'D')
+    if start_date != datetime(start_date.year, start_date.month, start_date.day):
+        first_day += 1
+    return first_day
+
+# Value keys of each 'Time Series (Daily)' entry, in BAR_DTYPE column order
+BAR_FIELDS = ('1. open', '2. high', '3. low', '4. close', '5. volume')
+
+def parse_time_series(time_series):
+    """
+    Convert the 'Time Series (Daily)' payload into a date-sorted BAR_DTYPE array.
+
+    Dates and values are converted column by column by NumPy rather than with a
+    strptime/float call per row.
+    """
+    if not time_series:
+        return np.empty(0, dtype=BAR_DTYPE)
+
+    dates = np.array(list(time_series), dtype='datetime64[D]')
+    values = np.array(list(map(itemgetter(*BAR_FIELDS), time_series.values())))
+
+    bars = np.empty(len(dates), dtype=BAR_DTYPE)
+    bars['Date'] = dates
+    for column, name in enumerate(('Open', 'High', 'Low', 'Close')):
+        bars[name] = values[:, column].astype(np.float64)
+    bars['Volume'] = values[:, 4].astype(np.int64)
+
+    return sort_bars(bars)
+
+def sort_bars(bars):
+    """Return bars sorted by date; Alpha Vantage lists the newest day first."""
+    dates = bars['Date']
+    if len(bars) > 1 and dates[0] > dates[-1] and np.all(dates[:-1] > dates[1:]):
+        return bars[::-1].copy()
+    return bars[np.argsort(dates, kind='stable')]
+
+def history_start():
+    """First day any timeframe needs; older bars are never used."""
+    return min(get_window_start(time_range) for _, _, time_range in TIMEFRAMES)
+
+def parse_csv_rows(rows):
+    """Convert datatype=csv data rows (bytes, without the header) into a date-sorted BAR_DTYPE array."""
+    if not rows:
+        return np.empty(0, dtype=BAR_DTYPE)
+    # The columns are timestamp,open,high,low,close,volume: BAR_DTYPE's order, so NumPy's C parser fills it directly
+    text = b'\n'.join(rows).decode('ascii')
+    return sort_bars(np.loadtxt(StringIO(text), delimiter=',', dtype=BAR_DTYPE, ndmin=1))
+
+# Per-symbol history kept between runs; set to an empty string to disable
+PRICE_STORE_DIR = os.environ.get('PRICE_STORE_DIR', '/tmp/price_store')
+
+# A compact response holds the last 100 trading days (about 140 calendar days).
+# Stored histories older than this are refreshed with a full download instead.
+COMPACT_MAX_GAP_DAYS = 120
+
+# Download format: 'csv' streams the response and stops at the oldest bar any timeframe
+# needs; 'json' downloads and decodes the whole document
+FETCH_FORMAT = os.environ.get('FETCH_FORMAT', 'csv')
+# Bytes read from the socket at a time when streaming CSV
+CSV_CHUNK_BYTES = 16 * 1024
+
+# Fetch layer: one pooled session, concurrent downloads and Alpha Vantage quota limits
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 4))
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', 30))
+FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES', 4))
+FETCH_BACKOFF_BASE = 2.0
+FETCH_BACKOFF_CAP = 60.0
+AV_REQUESTS_PER_MINUTE = int(os.environ.get('AV_REQUESTS_PER_MINUTE', 5))
+AV_REQUESTS_PER_DAY = int(os.environ.get('AV_REQUESTS_PER_DAY', 25))
+
+class QuotaExceededError(requests.exceptions.RequestException):
+    """The daily Alpha Vantage request quota has been used up."""
+
+class TokenBucket:
+    """Thread-safe token bucket holding `capacity` tokens, refilled evenly over `period` seconds."""
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self, count=1):
+        """Take `count` tokens if they are available; otherwise return the seconds until they will be."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.period)
+            self.updated = now
+            if self.tokens >= count:
+                self.tokens -= count
+                return 0.0
+            return (count - self.tokens) * self.period / self.capacity
+
+    def acquire(self, max_wait=None, count=1):
+        """Block until `count` tokens (at most `capacity`) are taken. Returns False if that would take longer than max_wait."""
+        while True:
+            wait = self.try_acquire(count)
+            if not wait:
+                return True
+            if max_wait is not None and wait > max_wait:
+                return False
+            time.sleep(wait)
+
+# Shared across warm invocations so quotas are respected between runs of the same container
+minute_quota = TokenBucket(AV_REQUESTS_PER_MINUTE, 60)
+day_quota = TokenBucket(AV_REQUESTS_PER_DAY, 24 * 60 * 60)
+
+_http_session = None
+
+def get_http_session():
+    """Return the pooled HTTP session, creating it on first use."""
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(FETCH_WORKERS, 1))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _http_session = session
+    return _http_session
+
+def read_json(response):
+    """Decode a JSON response; returns (document, throttle message or None)."""
+    metrics.count('BytesDownloaded', len(response.content))
+    data = response.json()
+    return data, data.get('Note') or data.get('Information')
+
+def read_csv_bars(response, since=None):
+    """
+    Parse a datatype=csv TIME_SERIES_DAILY response into BAR_DTYPE bars while it streams in.
+
+    Rows come newest first, so reading stops at the first row dated before `since`
+    and the rest of the body is never downloaded.
+
+    :param response: Response of a request made with stream=True
+    :param since: numpy datetime64[D]; None reads every row
+    :return: (bars, throttle message or None)
+    """
+    size = 0
+    try:
+        lines = response.iter_lines(chunk_size=CSV_CHUNK_BYTES)
+        header = next(lines, b'')
+        size += len(header) + 1
+        if header.lstrip().startswith(b'{'):
+            # Errors and throttle notes are JSON whatever the datatype
+            body = b'\n'.join([header, *lines])
+            size += len(body) - len(header)
+            data = json.loads(body)
+            return np.empty(0, dtype=BAR_DTYPE), data.get('Note') or data.get('Information')
+        if header and not header.startswith(b'timestamp,'):
+            raise ValueError(f"Unexpected CSV header: {header[:80]!r}")
+
+        cutoff = str(since).encode() if since is not None else None
+        rows = []
+        for line in lines:
+            size += len(line) + 1
+            # ISO dates compare like the dates they are
+            if cutoff and line[:10] < cutoff:
+                break
+            if line:
+                rows.append(line)
+    finally:
+        response.close()
+        metrics.count('BytesDownloaded', size)
+    return parse_csv_rows(rows), None
+
+def call_api(symbol, params, read=read_json, stream=False):
+    """
+    Call the Alpha Vantage API and return what `read` makes of the response.
+
+    Requests are rate limited against the per-minute and per-day quotas. 429/5xx
+    responses, connection errors and "Note"/"Information" throttle replies are
+    retried with jittered exponential backoff.
+
+    :param read: Function of the response returning (result, throttle message or None)
+    :param stream: Leave the body unread for `read` to stream
+    """
+    session = get_http_session()
+    params = dict(params, symbol=symbol, apikey=api_key)
+    reason = None
+    for attempt in range(FETCH_RETRIES + 1):
+        if attempt:
+            delay = random.uniform(0, min(FETCH_BACKOFF_CAP, FETCH_BACKOFF_BASE * 2 ** attempt))
+            logger.warning(f"Retrying {symbol} in {delay:.1f}s ({reason})")
+            time.sleep(delay)
+
+        if not day_quota.acquire(max_wait=0):
+            raise QuotaExceededError(f"Daily Alpha Vantage quota of {AV_REQUESTS_PER_DAY} requests reached")
+        minute_quota.acquire()
+
+        try:
+            response = session.get('https://www.alphavantage.co/query', params=params, timeout=FETCH_TIMEOUT, stream=stream)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            reason = str(e)
+            continue
+        if response.status_code == 429 or response.status_code >= 500:
+            reason = f"HTTP {response.status_code}"
+            response.close()
+            continue
+        response.raise_for_status()
+
+        try:
+            result, throttled = read(response)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            # A streamed body can fail part-way through
+            reason = str(e)
+            continue
+        if not throttled:
+            return result
+        reason = throttled
+
+    raise requests.exceptions.RetryError(f"Giving up on {symbol} after {FETCH_RETRIES + 1} attempts: {reason}")
+
+def fetch_time_series(symbol, outputsize='full'):
+    """Download the raw 'Time Series (Daily)' dict for a symbol (empty if the API has none)."""
+    data = call_api(symbol, {'function': 'TIME_SERIES_DAILY', 'outputsize': outputsize})
+    return data.get('Time Series (Daily)', {})
+
+def fetch_bars(symbol, outputsize='full', since=None):
+    """
+    Download a symbol's daily bars in FETCH_FORMAT (empty if the API has none).
+
+    CSV downloads stop at `since` (default history_start()), JSON ones hold the whole series.
+    """
+    if FETCH_FORMAT == 'csv':
+        since = history_start() if since is None else since
+        params = {'function': 'TIME_SERIES_DAILY', 'outputsize': outputsize, 'datatype': 'csv'}
+        return call_api(symbol, params, read=lambda response: read_csv_bars(response, since), stream=True)
+    return parse_time_series(fetch_time_series(symbol, outputsize))
+
+def merge_bars(stored, new):
+    """Overlay freshly downloaded bars on stored ones; new bars win on overlapping dates."""
+    if not len(new):
+        return stored
+    cut = np.searchsorted(stored['Date'], new['Date'][0], side='left')
+    return np.concatenate([stored[:cut], new])
+
+def trim_bars(bars):
+    """Drop bars older than the longest timeframe."""
+    return bars[np.searchsorted(bars['Date'], history_start(), side='left'):]
+
+class PriceStore:
+    """On-disk price history: one memory-mapped .npy file of BAR_DTYPE rows per symbol."""
+
+    def __init__(self, directory=PRICE_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, symbol):
+        return os.path.join(self.directory, f'{symbol}.npy')
+
+    def load(self, symbol):
+        """Return the stored bars for a symbol, or None if there are none."""
+        try:
+            bars = np.load(self.path(symbol), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if bars.dtype != BAR_DTYPE:
+            return None
+        return bars
+
+    def is_fresh(self, symbol):
+        """True if the symbol was already refreshed today."""
+        try:
+            modified = datetime.fromtimestamp(os.path.getmtime(self.path(symbol)))
+        except OSError:
+            return False
+        return modified.date() == datetime.now().date()
+
+    def save(self, symbol, bars):
+        # Write then rename so a concurrent reader never sees a partial file
+        tmp_path = self.path(symbol) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(bars))
+        os.replace(tmp_path, self.path(symbol))
+
+class StockHistory:
+    """Full daily history of a symbol, downloaded and parsed once per run."""
+
+    def __init__(self, symbol, bars):
+        self.symbol = symbol
+        self.bars = bars
+
+    @classmethod
+    def fetch(cls, symbol, store=None, since=None):
+        """
+        Load the daily series for a symbol. Errors yield an empty history.
+
+        With a PriceStore, only the last 100 bars are downloaded and merged into the
+        stored history; a full download happens when nothing usable is stored.
+
+        :param since: Oldest day needed (default history_start()); CSV downloads stop there
+        """
+        if since is not None and since < history_start():
+            # The store only keeps history_start() onward
+            store = None
+        stored = store.load(symbol) if store else None
+        if stored is not None and not len(stored):
+            stored = None
+        if stored is not None and store.is_fresh(symbol):
+            return cls(symbol, stored)
+
+        try:
+            bars = None
+            if stored is not None:
+                gap = (np.datetime64(datetime.now().date(), 'D') - stored['Date'][-1]).astype(int)
+                if gap <= COMPACT_MAX_GAP_DAYS:
+                    recent = fetch_bars(symbol, 'compact')
+                    # Only merge when the compact window reaches back to the stored data
+                    if len(recent) and recent['Date'][0] <= stored['Date'][-1]:
+                        bars = merge_bars(stored, recent)
+
+            if bars is None:
+                bars = fetch_bars(symbol, 'full', since)
+                if not len(bars):
+                    print(f"No data found for symbol: {symbol}")
+                    return cls(symbol, bars)
+
+            if store:
+                bars = trim_bars(bars)
+                store.save(symbol, bars)
+            return cls(symbol, bars)
+        except requests.exceptions.RequestException as e:
+            print(f"Request error for symbol {symbol}: {e}")
+        except ValueError as e:
+            print(f"Value error processing data for symbol {symbol}: {e}")
+
+        if stored is not None:
+            print(f"Using stored history for symbol {symbol}")
+            return cls(symbol, stored)
+        return cls(symbol, np.empty(0, dtype=BAR_DTYPE))
+
+    def __len__(self):
+        return len(self.bars)
+
+    def window(self, time_range):
+        """Return the bars for a time range as a view into the full history."""
+        start = np.searchsorted(self.bars['Date'], get_window_start(time_range), side='left')
+        return self.bars[start:]
+
+    def windows(self):
+        """Return a view for every entry in TIMEFRAMES, keyed like data_dict."""
+        return {key: self.window(time_range) for key, _, time_range in TIMEFRAMES}
+
 def get_stock_data(symbol, time_range='ytd'):
     """
     Fetch stock data for a given symbol and time range.
-    
+
+    Prefer StockHistory.fetch when several ranges of the same symbol are needed.
+
     :param symbol: Stock symbol
     :param time_range: Can be 'ytd' for year-to-date, '5y' for 5 years, or an integer for number of days
-    :return: List of daily stock data
+    :return: BAR_DTYPE array of daily stock data, oldest first
     """
-    url = f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={symbol}&outputsize=full&apikey={api_key}'
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        time_series = data.get('Time Series (Daily)', {})
-        if not time_series:
-            print(f"No data found for symbol: {symbol}")
-            return []
-
-        current_date = datetime.now()
-        
-        if time_range == 'ytd':
-            start_date = datetime(current_date.year, 1, 1)
-        elif time_range == '5y':
-            start_date = current_date - timedelta(days=5*365)
-        elif isinstance(time_range, int):
-            start_date = current_date - timedelta(days=time_range)
-        else:
-            raise ValueError("Invalid time_range. Use 'ytd', '5y', or an integer for days.")
-
-        filtered_data = [
-            [date_str, float(day_data['1. open']) or 0, float(day_data['2. high']) or 0,
-            float(day_data['3. low']) or 0, float(day_data['4. close']) or 0,
-            int(day_data['5. volume']) or 0]
-            for date_str, day_data in time_series.items()
-            if datetime.strptime(date_str, '%Y-%m-%d') >= start_date
-        ]        
-        return filtered_data
-    except requests.exceptions.RequestException as e:
-        print(f"Request error for symbol {symbol}: {e}")
-        return []
+        start = get_window_start(time_range)
+        return StockHistory.fetch(symbol, since=min(start, history_start())).window(time_range)
     except ValueError as e:
         print(f"Value error processing data for symbol {symbol}: {e}")
-        return []
+        return np.empty(0, dtype=BAR_DTYPE)
+
+# Longest lookback of the latest-value indicators (200-day MA); EMA-based indicators use it as warm-up
+INDICATOR_LOOKBACK = 200
+
+# Indicator registry: name -> Indicator. compute(frame) returns {output name: series like the frame's rows}
+Indicator = namedtuple('Indicator', 'name inputs lookback compute')
+INDICATORS = {}
+
+def register_indicator(name, inputs=('close',), lookback=INDICATOR_LOOKBACK):
+    """
+    Decorator adding an indicator to INDICATORS.
+
+    :param inputs: IndicatorFrame inputs the indicator reads ('close', 'high', 'low', 'volume')
+    :param lookback: Trailing bars its latest value depends on
+    """
+    def decorator(compute):
+        INDICATORS[name] = Indicator(name, tuple(inputs), lookback, compute)
+        return compute
+    return decorator
+
+@lru_cache(maxsize=32)
+def _ema_weights(alpha, block):
+    """EMA weights within a block (weights[k, j]: column k in the average at column j) and of the carried average."""
+    decay = 1 - alpha
+    steps = np.arange(block)
+    lag = steps[None, :] - steps[:, None]
+    return np.where(lag >= 0, alpha * decay ** np.maximum(lag, 0), 0.0), decay ** (steps + 1)
+
+def _ema(values, alpha, block=128):
+    """
+    Exponential moving average of every row, seeded with the row's first valid value.
+
+    Rows are right-aligned series with NaN padding on the left. The recursion is
+    evaluated a block of columns at a time as one matrix product, so there is no
+    Python loop over bars.
+    """
+    rows, size = values.shape
+    valid = ~np.isnan(values)
+    start = np.where(valid.any(axis=1), valid.argmax(axis=1), size)
+    values = np.where(valid, values, 0.0)
+    steps = np.arange(block)
+    weights, carry_weights = _ema_weights(alpha, block)
+
+    result = np.empty_like(values)
+    carry = np.zeros(rows)
+    for begin in range(0, size, block):
+        chunk = values[:, begin:begin + block]
+        width = chunk.shape[1]
+        averages = chunk @ weights[:width, :width] + carry[:, None] * carry_weights[:width]
+        # The seed value carries weight 1 instead of alpha
+        local = start - begin
+        seeded = (local >= 0) & (local < width)
+        if seeded.any():
+            since = steps[None, :width] - local[seeded, None]
+            seed = values[seeded, start[seeded]]
+            averages[seeded] += np.where(since >= 0, seed[:, None] * carry_weights[np.maximum(since, 0)], 0.0)
+        result[:, begin:begin + width] = averages
+        carry = averages[:, -1]
+    result[np.arange(size)[None, :] < start[:, None]] = np.nan
+    return result
+
+class IndicatorFrame:
+    """
+    OHLCV rows for the indicator engine and the intermediates the indicators share.
+
+    Every row is right-aligned with NaN padding on the left, so column -1 holds the
+    latest bar. Intermediates (differences, rolling windows, EMAs and any derived
+    series) are computed on first use and cached, so indicators reading the same one
+    share a single pass over the data.
+    """
+
+    def __init__(self, inputs, lengths=None):
+        """
+        :param inputs: dict of 2-D arrays keyed close, high, low and/or volume
+        :param lengths: Number of valid values in each row (default: all columns)
+        """
+        self.inputs = inputs
+        shape = next(iter(inputs.values())).shape
+        self.lengths = np.full(shape[0], shape[1], dtype=np.intp) if lengths is None else lengths
+        self._cache = {}
+
+    @classmethod
+    def from_rows(cls, inputs, lengths, size):
+        """Build a frame from the last `size` values of left-aligned rows (NaN padding after `lengths`)."""
+        return cls({name: _tail(values, lengths, size) for name, values in inputs.items()}, lengths)
+
+    def has(self, names):
+        return all(name in self.inputs for name in names)
+
+    def cached(self, key, compute):
+        """Return the intermediate stored under `key`, computing it on first use."""
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = compute()
+            return value
+
+    def __getitem__(self, name):
+        """An input or a derived series added through cached()."""
+        return self.inputs[name] if name in self.inputs else self._cache[name]
+
+    def count(self):
+        """Number of valid closes up to and including each column."""
+        return self.cached(('count',), lambda: np.cumsum(~np.isnan(self['close']), axis=1))
+
+    def shift(self, name, periods=1):
+        def compute():
+            values = self[name]
+            shifted = np.full(values.shape, np.nan)
+            shifted[:, periods:] = values[:, :-periods]
+            return shifted
+        return self.cached(('shift', name, periods), compute)
+
+    def diff(self, name='close'):
+        return self.cached(('diff', name), lambda: self[name] - self.shift(name))
+
+    def rolling(self, name, window, how='mean'):
+        """Rolling mean, std (ddof=1), min, max or sum; NaN until a full window of valid values."""
+        def compute():
+            from numpy.lib.stride_tricks import sliding_window_view
+
+            values = self[name]
+            result = np.full(values.shape, np.nan)
+            if values.shape[1] >= window:
+                windows = sliding_window_view(values, window, axis=1)
+                kwargs = {'ddof': 1} if how == 'std' else {}
+                result[:, window - 1:] = getattr(windows, how)(axis=-1, **kwargs)
+            return result
+        return self.cached(('rolling', name, window, how), compute)
+
+    def ema(self, name, span=None, alpha=None):
+        """EMA with alpha = 2 / (span + 1), or the given alpha (1 / n for Wilder's smoothing)."""
+        alpha = alpha or 2 / (span + 1)
+        return self.cached(('ema', name, alpha), lambda: _ema(self[name], alpha))
+
+@register_indicator('moving_averages')
+def moving_average_indicator(frame):
+    return {'ma50': frame.rolling('close', 50), 'ma200': frame.rolling('close', 200)}
+
+@register_indicator('rsi', lookback=15)
+def rsi_indicator(frame, period=14):
+    delta = frame.diff()
+    # A leading NaN difference counts as no change, so a series of exactly `period` values has an RSI
+    frame.cached('gain', lambda: np.where(delta > 0, delta, 0))
+    frame.cached('loss', lambda: np.where(delta < 0, -delta, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = frame.rolling('gain', period) / frame.rolling('loss', period)
+        rsi = np.where(rs == np.inf, 50, 100 - (100 / (1 + rs)))
+    rsi[frame.count() < period] = np.nan
+    return {'rsi': rsi}
+
+@register_indicator('bollinger', lookback=20)
+def bollinger_indicator(frame, period=20):
+    middle = frame.rolling('close', period)
+    std = frame.rolling('close', period, 'std')
+    return {'upper_bb': middle + std * 2, 'middle_bb': middle, 'lower_bb': middle - std * 2}
+
+@register_indicator('macd')
+def macd_indicator(frame, fast=12, slow=26, signal=9):
+    macd = frame.cached('macd', lambda: frame.ema('close', fast) - frame.ema('close', slow))
+    macd_signal = frame.ema('macd', signal)
+    # The EMAs start at the first bar, so mask values until the slow and then the signal average are seeded
+    count = frame.count()
+    macd_signal = np.where(count < slow + signal - 1, np.nan, macd_signal)
+    return {'macd': np.where(count < slow, np.nan, macd), 'macd_signal': macd_signal,
+            'macd_hist': macd - macd_signal}
+
+@register_indicator('atr', inputs=('high', 'low', 'close'))
+def atr_indicator(frame, period=14):
+    """Average True Range with Wilder's smoothing."""
+    def true_range():
+        previous = frame.shift('close')
+        # fmax skips the missing previous close of the first bar
+        return np.fmax(frame['high'] - frame['low'],
+                       np.fmax(np.abs(frame['high'] - previous), np.abs(frame['low'] - previous)))
+    frame.cached('true_range', true_range)
+    return {'atr': np.where(frame.count() < period, np.nan, frame.ema('true_range', alpha=1 / period))}
+
+@register_indicator('obv', inputs=('close', 'volume'), lookback=21)
+def obv_indicator(frame, period=20):
+    """On-Balance Volume from the first bar of the frame, and its change over `period` bars."""
+    def obv():
+        flow = np.nan_to_num(np.sign(frame.diff()) * frame['volume'], nan=0.0).cumsum(axis=1)
+        flow[np.isnan(frame['close'])] = np.nan
+        return flow
+    frame.cached('obv', obv)
+    return {'obv': frame['obv'], 'obv_change': frame['obv'] - frame.shift('obv', period)}
+
+@register_indicator('stochastic', inputs=('high', 'low', 'close'), lookback=16)
+def stochastic_indicator(frame, period=14, smoothing=3):
+    def percent_k():
+        lowest = frame.rolling('low', period, 'min')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (frame['close'] - lowest) / (frame.rolling('high', period, 'max') - lowest) * 100
+    frame.cached('stoch_k', percent_k)
+    return {'stoch_k': frame['stoch_k'], 'stoch_d': frame.rolling('stoch_k', smoothing)}
+
+def compute_indicators(frame, names=None):
+    """
+    Run registered indicators over one frame, sharing its intermediates.
+
+    :param names: INDICATORS to run (default: every one whose inputs the frame has)
+    :return: dict of series keyed by indicator output name
+    """
+    series = {}
+    for name in names or INDICATORS:
+        indicator = INDICATORS[name]
+        if frame.has(indicator.inputs):
+            series.update(indicator.compute(frame))
+    return series
+
+def _as_close_matrix(closes):
+    """Return closes as a 2-D float array with NaN replaced by 0, plus the row lengths."""
+    closes = np.array(closes, dtype=np.float64, ndmin=2)
+    closes[np.isnan(closes)] = 0
+    return closes, np.full(len(closes), closes.shape[1], dtype=np.intp)
+
+def trend_statistics(closes, lengths):
+    """
+    Linear-regression slope and r-value of each row, from closed-form sums.
+
+    :param closes: 2-D array, one left-aligned series per row, NaN padding after `lengths`
+    :param lengths: Number of valid values in each row
+    :return: (slope, r_value) arrays; r_value is 0 for constant or single-value rows, like linregress
+    """
+    n = lengths.astype(np.float64)
+    x_dev = np.arange(closes.shape[1]) - (n[:, None] - 1) / 2
+    y_dev = closes - np.nanmean(closes, axis=1)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sxx = n * (n * n - 1) / 12
+        sxy = np.nansum(x_dev * y_dev, axis=1)
+        syy = np.nansum(y_dev * y_dev, axis=1)
+        denominator = sxx * syy
+        return sxy / sxx, np.where(denominator == 0, 0.0, sxy / np.sqrt(denominator))
+
+def latest_indicators(closes, lengths, highs=None, lows=None, volumes=None, names=None):
+    """
+    Latest value of every registered indicator for each row.
+
+    Only the last values of every row that the longest selected lookback needs are
+    read, so the cost does not depend on how long the series are. Indicators whose
+    inputs are not given are skipped; rows too short for an indicator get NaN.
+
+    :param closes: 2-D array, one left-aligned series per row, NaN padding after `lengths`
+    :param lengths: Number of valid values in each row
+    :param highs: Optional highs laid out like closes, likewise lows and volumes
+    :param names: INDICATORS to compute (default: all that the inputs allow)
+    :return: dict of arrays keyed by output, e.g. ma50, ma200, rsi, upper_bb, middle_bb, lower_bb, macd
+    """
+    inputs = {'close': closes, 'high': highs, 'low': lows, 'volume': volumes}
+    inputs = {name: values for name, values in inputs.items() if values is not None}
+    names = [name for name in names or INDICATORS if set(INDICATORS[name].inputs) <= inputs.keys()]
+    frame = IndicatorFrame.from_rows(inputs, lengths, max(INDICATORS[name].lookback for name in names))
+    return {output: values[:, -1] for output, values in compute_indicators(frame, names).items()}
+
+def _tail(closes, lengths, size):
+    """Gather the last `size` values of every row into a right-aligned block, NaN-padded on the left."""
+    index = lengths[:, None] - size + np.arange(size)
+    tail = np.take_along_axis(closes, np.clip(index, 0, None), axis=1)
+    tail[index < 0] = np.nan
+    return tail
 
 def calculate_trend(closes):
     """Calculate the trend using linear regression."""
-    closes = [0 if math.isnan(x) else x for x in closes]
-    x = np.arange(len(closes))
-    slope, intercept, r_value, p_value, std_err = stats.linregress(x, closes)
-    trend = 'Upward' if slope > 0 else 'Downward'
-    strength = abs(r_value)
+    slope, r_value = trend_statistics(*_as_close_matrix(closes))
+    trend = 'Upward' if slope[0] > 0 else 'Downward'
+    strength = abs(r_value[0])
     return trend, strength
 
 def calculate_moving_averages(closes):
     """Calculate 50-day and 200-day moving averages."""
-    closes = [0 if math.isnan(x) else x for x in closes]
-    df = pd.Series(closes)
-    ma50 = df.rolling(window=50).mean().iloc[-1] or 0
-    ma200 = df.rolling(window=200).mean().iloc[-1] or 0
-    return ma50, ma200
+    indicators = latest_indicators(*_as_close_matrix(closes), names=['moving_averages'])
+    return indicators['ma50'][0] or 0, indicators['ma200'][0] or 0
 
 def calculate_rsi(closes, period=14):
     """Calculate Relative Strength Index."""
-    closes = [0 if math.isnan(x) else x for x in closes]
-    delta = pd.Series(closes).diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    rs = gain / loss
-    return 100 - (100 / (1 + rs.iloc[-1])) if rs.iloc[-1] != np.inf else 50
+    closes, lengths = _as_close_matrix(closes)
+    frame = IndicatorFrame.from_rows({'close': closes}, lengths, period + 1)
+    return rsi_indicator(frame, period)['rsi'][0, -1]
 
 def calculate_bollinger_bands(closes, period=20):
     """Calculate Bollinger Bands."""
-    closes = [0 if math.isnan(x) else x for x in closes]
-    df = pd.Series(closes)
-    ma = df.rolling(window=period).mean().iloc[-1] or 0
-    std = df.rolling(window=period).std().iloc[-1] or 0
-    upper = ma + (std * 2)
-    lower = ma - (std * 2)
-    return upper, ma, lower
-
-def classify_stock(df):
-    """Classify stock as bullish, bearish, or stable based on price change."""
-    if df.empty or 'Close' not in df.columns:
-        return 'Stable'
-    
-    first_close = df['Close'].iloc[0]
-    last_close = df['Close'].iloc[-1]
-    price_change_percent = ((last_close - first_close) / first_close) * 100
-    
-    if price_change_percent > 5:
-        return 'Bullish'
-    elif price_change_percent < -5:
-        return 'Bearish'
-    else:
-        return 'Stable'
+    closes, lengths = _as_close_matrix(closes)
+    frame = IndicatorFrame.from_rows({'close': closes}, lengths, period)
+    bands = bollinger_indicator(frame, period)
+    return bands['upper_bb'][0, -1], bands['middle_bb'][0, -1], bands['lower_bb'][0, -1]
+
+class StreamingIndicators:
+    """
+    Running indicator state for one symbol, updated one bar at a time.
+
+    Keeps rolling sums for MA50, MA200 and the 20-day Bollinger Bands, rolling
+    gain/loss sums for the 14-day RSI, regression co-moments for the trend and
+    running close/volume aggregates, so each update is O(1). latest() matches
+    calculate_moving_averages, calculate_rsi, calculate_bollinger_bands and
+    calculate_trend run over every close seen so far.
+
+    The last INDICATOR_LOOKBACK closes are kept in a ring buffer because the
+    rolling windows need the values that drop out of them; with the scalars that
+    makes a serialized state of about 1.7 KB (see to_bytes).
+    """
+
+    VERSION = 1
+    RSI_PERIOD = 14
+    BB_PERIOD = 20
+    # Rolling sums are rebuilt from the ring buffer this often to stop float drift
+    RESYNC_INTERVAL = 4096
+    _HEADER = struct.Struct('<Bqq11d3q')
+
+    def __init__(self):
+        self.count = 0
+        self.last_date = None
+        self.ring = np.zeros(INDICATOR_LOOKBACK)
+        self.sum20 = self.sumsq20 = self.sum50 = self.sum200 = 0.0
+        self.gain_sum = self.loss_sum = 0.0
+        self.mean_close = self.comoment = self.m2_close = 0.0
+        self.highest_close = -np.inf
+        self.lowest_close = np.inf
+        self.total_volume = 0
+        self.max_volume = np.iinfo(np.int64).min
+        self.min_volume = np.iinfo(np.int64).max
+
+    @classmethod
+    def from_bars(cls, bars):
+        """Build the state by replaying a BAR_DTYPE array."""
+        state = cls()
+        for date, close, volume in zip(bars['Date'], bars['Close'], bars['Volume']):
+            state.update(close, volume, date)
+        return state
+
+    def _back(self, steps):
+        """Close `steps` bars before the newest one."""
+        return self.ring[(self.count - 1 - steps) % INDICATOR_LOOKBACK]
+
+    def _leaving(self, window):
+        """Close that drops out of a `window`-bar rolling window when the next bar is added."""
+        return self.ring[(self.count - window) % INDICATOR_LOOKBACK] if self.count >= window else 0.0
+
+    def update(self, close, volume, date=None):
+        """Add one bar. Bars dated on or before the last one seen are ignored."""
+        if date is not None:
+            date = np.datetime64(date, 'D')
+            if self.last_date is not None and date <= self.last_date:
+                return
+            self.last_date = date
+
+        close = 0.0 if math.isnan(close) else float(close)
+        n = self.count
+
+        # Rolling window sums: add the new close, drop the one leaving each window
+        leaving20 = self._leaving(self.BB_PERIOD)
+        self.sum20 += close - leaving20
+        self.sumsq20 += close * close - leaving20 * leaving20
+        self.sum50 += close - self._leaving(50)
+        self.sum200 += close - self._leaving(200)
+
+        # RSI gains/losses over the last 14 differences; the first bar's difference counts as 0
+        delta = close - self.ring[(n - 1) % INDICATOR_LOOKBACK] if n else 0.0
+        self.gain_sum += max(delta, 0.0)
+        self.loss_sum += max(-delta, 0.0)
+        if n >= self.RSI_PERIOD:
+            first = n - self.RSI_PERIOD
+            old_delta = self.ring[first % INDICATOR_LOOKBACK] - self.ring[(first - 1) % INDICATOR_LOOKBACK] if first else 0.0
+            self.gain_sum -= max(old_delta, 0.0)
+            self.loss_sum -= max(-old_delta, 0.0)
+
+        # Co-moments of (bar index, close) for the regression trend
+        index_delta = n - (n - 1) / 2 if n else 0.0
+        close_delta = close - self.mean_close
+        self.mean_close += close_delta / (n + 1)
+        self.comoment += index_delta * (close - self.mean_close)
+        self.m2_close += close_delta * (close - self.mean_close)
+
+        self.highest_close = max(self.highest_close, close)
+        self.lowest_close = min(self.lowest_close, close)
+        volume = int(volume)
+        self.total_volume += volume
+        self.max_volume = max(self.max_volume, volume)
+        self.min_volume = min(self.min_volume, volume)
+
+        self.ring[n % INDICATOR_LOOKBACK] = close
+        self.count = n + 1
+        if self.count % self.RESYNC_INTERVAL == 0:
+            self._resync()
+
+    def _resync(self):
+        recent = np.array([self._back(k) for k in range(min(self.count, INDICATOR_LOOKBACK))])[::-1]
+        self.sum20 = recent[-self.BB_PERIOD:].sum()
+        self.sumsq20 = (recent[-self.BB_PERIOD:] ** 2).sum()
+        self.sum50 = recent[-50:].sum()
+        self.sum200 = recent.sum()
+        deltas = np.diff(recent[-(self.RSI_PERIOD + 1):])
+        self.gain_sum = deltas[deltas > 0].sum()
+        self.loss_sum = -deltas[deltas < 0].sum()
+
+    def latest(self):
+        """Current indicator values, keyed like the insights dict."""
+        n = self.count
+        ma50 = self.sum50 / 50 if n >= 50 else np.nan
+        ma200 = self.sum200 / 200 if n >= 200 else np.nan
+
+        if n >= self.RSI_PERIOD:
+            gain, loss = max(self.gain_sum, 0.0), max(self.loss_sum, 0.0)
+            if loss:
+                rsi = 100 - (100 / (1 + gain / loss))
+            else:
+                rsi = 50.0 if gain else np.nan
+        else:
+            rsi = np.nan
+
+        if n >= self.BB_PERIOD:
+            middle = self.sum20 / self.BB_PERIOD
+            variance = (self.sumsq20 - self.sum20 * middle) / (self.BB_PERIOD - 1)
+            std = math.sqrt(max(variance, 0.0))
+            upper, lower = middle + std * 2, middle - std * 2
+        else:
+            middle = upper = lower = np.nan
+
+        # Sum of squared index deviations has a closed form for 0..n-1
+        index_m2 = n * (n * n - 1) / 12
+        slope = self.comoment / index_m2 if index_m2 else np.nan
+        denominator = math.sqrt(index_m2 * self.m2_close)
+        r_value = self.comoment / denominator if denominator else 0.0
+
+        return {
+            'ma50': ma50,
+            'ma200': ma200,
+            'rsi': rsi,
+            'upper_bb': upper,
+            'middle_bb': middle,
+            'lower_bb': lower,
+            'trend': 'Upward' if slope > 0 else 'Downward',
+            'trend_strength': abs(r_value),
+            'highest_close': self.highest_close if n else np.nan,
+            'lowest_close': self.lowest_close if n else np.nan,
+            'total_volume': self.total_volume,
+            'range_volume': self.max_volume - self.min_volume if n else 0,
+            'end_date': str(self.last_date) if self.last_date is not None else None,
+        }
+
+    def to_bytes(self):
+        """Serialize the state to a compact binary record."""
+        no_date = np.iinfo(np.int64).min
+        header = self._HEADER.pack(
+            self.VERSION, self.count,
+            int(self.last_date.astype(np.int64)) if self.last_date is not None else no_date,
+            self.sum20, self.sumsq20, self.sum50, self.sum200, self.gain_sum, self.loss_sum,
+            self.mean_close, self.comoment, self.m2_close, self.highest_close, self.lowest_close,
+            self.total_volume, self.max_volume, self.min_volume,
+        )
+        return header + self.ring.astype('<f8').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Restore a state produced by to_bytes."""
+        fields = cls._HEADER.unpack_from(data)
+        if fields[0] != cls.VERSION:
+            raise ValueError(f"Unsupported StreamingIndicators version: {fields[0]}")
+        state = cls()
+        (_, state.count, last_date,
+         state.sum20, state.sumsq20, state.sum50, state.sum200, state.gain_sum, state.loss_sum,
+         state.mean_close, state.comoment, state.m2_close, state.highest_close, state.lowest_close,
+         state.total_volume, state.max_volume, state.min_volume) = fields
+        if last_date != np.iinfo(np.int64).min:
+            state.last_date = np.datetime64(last_date, 'D')
+        state.ring = np.frombuffer(data, dtype='<f8', count=INDICATOR_LOOKBACK, offset=cls._HEADER.size).copy()
+        return state
+
+# One result row per (ticker, timeframe) cell of the batch insights engine
+INSIGHT_DTYPE = np.dtype([
+    ('highest_close', 'f8'),
+    ('lowest_close', 'f8'),
+    ('average_close', 'f8'),
+    ('median_close', 'f8'),
+    ('std_dev_close', 'f8'),
+    ('range_close', 'f8'),
+    ('total_volume', 'i8'),
+    ('median_volume', 'f8'),
+    ('std_dev_volume', 'f8'),
+    ('range_volume', 'i8'),
+    ('max_volume_date', 'datetime64[D]'),
+    ('min_volume_date', 'datetime64[D]'),
+    ('classification', 'U7'),
+    ('start_date', 'datetime64[D]'),
+    ('end_date', 'datetime64[D]'),
+    ('start_price', 'f8'),
+    ('end_price', 'f8'),
+    ('price_change', 'f8'),
+    ('price_change_percent', 'f8'),
+    ('max_daily_gain', 'f8'),
+    ('max_daily_loss', 'f8'),
+    ('volatility', 'f8'),
+    ('trend', 'U8'),
+    ('trend_strength', 'f8'),
+    ('ma50', 'f8'),
+    ('ma200', 'f8'),
+    ('rsi', 'f8'),
+    ('upper_bb', 'f8'),
+    ('middle_bb', 'f8'),
+    ('lower_bb', 'f8'),
+    ('macd', 'f8'),
+    ('macd_signal', 'f8'),
+    ('macd_hist', 'f8'),
+    ('stoch_k', 'f8'),
+    ('stoch_d', 'f8'),
+    ('atr', 'f8'),
+    ('obv_change', 'f8'),
+    ('timeframe', 'U12'),
+])
+
+def compute_insights_batch(windows, timeframes=None):
+    """
+    Calculate insights for many windows of bars at once.
+
+    The windows (any mix of tickers and timeframes) are laid out as rows of
+    NaN-padded OHLCV/date matrices and every statistic is a single NumPy
+    reduction along the rows; the indicators come from latest_indicators.
+
+    The rows are the insight records the HTML generators read: a fixed-size
+    structured row takes about 400 bytes, against a few KB for a dict of boxed values.
+
+    generate_report calls it once per ticker with that ticker's six timeframes, as
+    each history arrives from the fetch pool, rather than once across every ticker:
+    insights and rendering then overlap the remaining downloads, and the padded
+    matrices stay the size of one ticker's longest window.
+
+    :param windows: Sequence of non-empty BAR_DTYPE arrays, oldest bar first
+    :param timeframes: Optional timeframe label of each window
+    :return: INSIGHT_DTYPE array with one row per window
+    """
+    lengths = np.array([len(window) for window in windows], dtype=np.intp)
+    if not len(lengths) or not lengths.min():
+        raise ValueError("Cannot calculate insights for an empty window")
+
+    rows = np.arange(len(windows))
+    last = lengths - 1
+    closes = np.full((len(windows), lengths.max()), np.nan)
+    highs = np.full(closes.shape, np.nan)
+    lows = np.full(closes.shape, np.nan)
+    volumes = np.full(closes.shape, np.nan)
+    dates = np.full(closes.shape, np.datetime64('NaT'), dtype='datetime64[D]')
+    for row, window in enumerate(windows):
+        # Missing prices count as 0, padding stays NaN and is skipped by the nan-reductions
+        closes[row, :len(window)] = np.nan_to_num(window['Close'], nan=0.0, posinf=np.inf, neginf=-np.inf)
+        highs[row, :len(window)] = np.nan_to_num(window['High'], nan=0.0, posinf=np.inf, neginf=-np.inf)
+        lows[row, :len(window)] = np.nan_to_num(window['Low'], nan=0.0, posinf=np.inf, neginf=-np.inf)
+        volumes[row, :len(window)] = window['Volume']
+        dates[row, :len(window)] = window['Date']
+
+    result = np.zeros(len(windows), dtype=INSIGHT_DTYPE)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['highest_close'] = np.nanmax(closes, axis=1)
+        result['lowest_close'] = np.nanmin(closes, axis=1)
+        result['average_close'] = np.nanmean(closes, axis=1)
+        result['median_close'] = np.nanmedian(closes, axis=1)
+        result['std_dev_close'] = np.nan_to_num(np.nanstd(closes, axis=1, ddof=1), nan=0.0)
+        result['range_close'] = result['highest_close'] - result['lowest_close']
+
+        max_volume = np.nanmax(volumes, axis=1)
+        min_volume = np.nanmin(volumes, axis=1)
+        result['total_volume'] = np.nansum(volumes, axis=1)
+        result['median_volume'] = np.nanmedian(volumes, axis=1)
+        result['std_dev_volume'] = np.nan_to_num(np.nanstd(volumes, axis=1, ddof=1), nan=0.0)
+        result['range_volume'] = max_volume - min_volume
+        result['max_volume_date'] = dates[rows, np.nanargmax(volumes, axis=1)]
+        result['min_volume_date'] = dates[rows, np.nanargmin(volumes, axis=1)]
+
+        result['start_date'] = dates[:, 0]
+        result['end_date'] = dates[rows, last]
+        first_close = closes[:, 0]
+        last_close = closes[rows, last]
+        result['start_price'] = first_close
+        result['end_price'] = last_close
+        result['price_change'] = last_close - first_close
+        result['price_change_percent'] = (last_close - first_close) / first_close * 100
+        result['classification'] = np.select(
+            [result['price_change_percent'] > 5, result['price_change_percent'] < -5],
+            ['Bullish', 'Bearish'],
+            'Stable',
+        )
+
+        # Daily returns; padding and 0/0 days are NaN and skipped like pandas does
+        daily_returns = closes[:, 1:] / closes[:, :-1] - 1
+        if daily_returns.shape[1]:
+            result['max_daily_gain'] = np.nanmax(daily_returns, axis=1) * 100
+            result['max_daily_loss'] = np.nanmin(daily_returns, axis=1) * 100
+            result['volatility'] = np.nanstd(daily_returns, axis=1, ddof=1) * 100
+        else:
+            result['max_daily_gain'] = result['max_daily_loss'] = result['volatility'] = np.nan
+
+    slope, r_value = trend_statistics(closes, lengths)
+    result['trend'] = np.where(slope > 0, 'Upward', 'Downward')
+    result['trend_strength'] = np.abs(r_value)
+    for name, values in latest_indicators(closes, lengths, highs, lows, volumes).items():
+        if name in INSIGHT_DTYPE.names:
+            result[name] = values
+    if timeframes is not None:
+        result['timeframe'] = timeframes
+
+    return result
+
+# INSIGHT_DTYPE row as Python values, which the templates read faster than NumPy scalars
+InsightRecord = namedtuple('InsightRecord', INSIGHT_DTYPE.names)
+
+def insight_record(insights):
+    """Return an INSIGHT_DTYPE row as an InsightRecord for rendering; other mappings pass through."""
+    return InsightRecord._make(insights.item()) if isinstance(insights, np.void) else insights
+
+def insights_to_dict(record, timeframe=None):
+    """Convert one INSIGHT_DTYPE row into a dict of plain Python values, e.g. for JSON."""
+    insights = {name: record[name].item() for name in INSIGHT_DTYPE.names}
+    for name in ('max_volume_date', 'min_volume_date', 'start_date', 'end_date'):
+        insights[name] = str(record[name])
+    if timeframe is not None:
+        insights['timeframe'] = timeframe
+    return insights
 
 def get_insights(data, timeframe):
-    """Calculate various insights from the data based on the timeframe."""
-    df = pd.DataFrame(data, columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
-    df['Date'] = pd.to_datetime(df['Date'])
-    df.set_index('Date', inplace=True)
-    df.sort_index(inplace=True)
-
-    # Replace 'nan' values with 0
-    df = df.fillna(0)
-
-    first_close = df['Close'].iloc[0]
-    last_close = df['Close'].iloc[-1]
-    price_change = last_close - first_close
-    price_change_percent = (price_change / first_close) * 100
-    
-    closes = df['Close'].values
-    
-    trend, trend_strength = calculate_trend(closes)
-    ma50, ma200 = calculate_moving_averages(closes)
-    rsi = calculate_rsi(closes)
-    upper_bb, middle_bb, lower_bb = calculate_bollinger_bands(closes)
-
-    classification = classify_stock(df)
-
-    insights = {
-        'highest_close': df['Close'].max() if not math.isnan(df['Close'].max()) else 0,
-        'lowest_close': df['Close'].min() if not math.isnan(df['Close'].min()) else 0,
-        'average_close': df['Close'].mean() if not math.isnan(df['Close'].mean()) else 0,
-        'median_close': df['Close'].median() if not math.isnan(df['Close'].median()) else 0,
-        'std_dev_close': df['Close'].std() if not math.isnan(df['Close'].std()) else 0,
-        'range_close': df['Close'].max() - df['Close'].min() if not math.isnan(df['Close'].max()) and not math.isnan(df['Close'].min()) else 0,
-        'total_volume': df['Volume'].sum() if not math.isnan(df['Volume'].sum()) else 0,
-        'median_volume': df['Volume'].median() if not math.isnan(df['Volume'].median()) else 0,
-        'std_dev_volume': df['Volume'].std() if not math.isnan(df['Volume'].std()) else 0,
-        'range_volume': df['Volume'].max() - df['Volume'].min() if not math.isnan(df['Volume'].max()) and not math.isnan(df['Volume'].min()) else 0,
-        'max_volume_date': df['Volume'].idxmax().strftime('%Y-%m-%d'),
-        'min_volume_date': df['Volume'].idxmin().strftime('%Y-%m-%d'),
-        'classification': classification,
-        'start_date': df.index.min().strftime('%Y-%m-%d'),
-        'end_date': df.index.max().strftime('%Y-%m-%d'),
-        'start_price': first_close,
-        'end_price': last_close,
-        'price_change': price_change,
-        'price_change_percent': price_change_percent,
-        'max_daily_gain': df['Close'].pct_change().max() * 100,
-        'max_daily_loss': df['Close'].pct_change().min() * 100,
-        'volatility': df['Close'].pct_change().std() * 100,
-        'timeframe': timeframe,
-        'trend': trend,
-        'trend_strength': trend_strength,
-        'ma50': ma50,
-        'ma200': ma200,
-        'rsi': rsi,
-        'upper_bb': upper_bb,
-        'middle_bb': middle_bb,
-        'lower_bb': lower_bb
+    """Calculate various insights from the data based on the timeframe; returns an INSIGHT_DTYPE record."""
+    return compute_insights_batch([data], [timeframe])[0]
+
+# Cross-sectional screener at the top of the report; SCREENER=0 leaves it out
+SCREENER = os.environ.get('SCREENER', '1') != '0'
+# TIMEFRAMES key whose return ranks the screener table
+SCREENER_RANK_BY = os.environ.get('SCREENER_RANK_BY', '1_year')
+
+# The part of a ticker's history the screener panel keeps
+PANEL_DTYPE = np.dtype([
+    ('Date', 'datetime64[D]'),
+    ('Close', 'f8'),
+    ('Volume', 'f8'),
+])
+
+# Checkpoint holding the screener rows of a run (one per shard in a fanned-out run)
+SCREENER_CHECKPOINT = '~screener'
+
+def panel_series(bars):
+    """
+    Copy the dates, closes and volumes of the longest timeframe out of a ticker's bars.
+
+    The copy is small and does not keep the full history alive until the panel is built.
+    """
+    window = bars[np.searchsorted(bars['Date'], history_start(), side='left'):]
+    series = np.empty(len(window), dtype=PANEL_DTYPE)
+    for name in PANEL_DTYPE.names:
+        series[name] = window[name]
+    return series
+
+def build_price_panel(series):
+    """
+    Stack the tickers' series into date-by-ticker close and volume panels.
+
+    :param series: dict of ticker -> PANEL_DTYPE (or BAR_DTYPE) array, oldest first
+    :return: (tickers, dates, closes, volumes); a ticker without a bar on a date has NaN there
+    """
+    names = list(series)
+    dates = np.unique(np.concatenate([series[name]['Date'] for name in names]))
+    closes = np.full((len(dates), len(names)), np.nan)
+    volumes = np.full(closes.shape, np.nan)
+    for column, name in enumerate(names):
+        rows = np.searchsorted(dates, series[name]['Date'])
+        closes[rows, column] = series[name]['Close']
+        volumes[rows, column] = series[name]['Volume']
+    return names, dates, closes, volumes
+
+def screen_panel(dates, closes, volumes):
+    """
+    Screener metrics of every ticker (panel column) at once.
+
+    Per timeframe: return and volatility of daily returns in percent, like the insights, and
+    the z-score of the latest volume against the timeframe. Latest values: close, RSI, MA50,
+    MA200 and %B, the close's position between the lower (0) and upper (1) Bollinger Band.
+
+    :param dates: Panel dates, sorted
+    :param closes: Date-by-ticker closes, NaN where a ticker has no bar
+    :param volumes: Date-by-ticker volumes, NaN where a ticker has no bar
+    :return: dict of arrays with one value per ticker, keyed close, rsi, ma50, ma200,
+             percent_b and return_<key>, volatility_<key>, volume_z_<key> per TIMEFRAMES key
+    """
+    columns = np.arange(closes.shape[1])
+    present = ~np.isnan(closes)
+    # Each ticker's closes without its gaps, left-aligned, for the latest-value indicators
+    order = np.argsort(~present.T, axis=1, kind='stable')
+    aligned = np.take_along_axis(closes.T, order, axis=1)
+    lengths = present.sum(axis=0)
+    latest = latest_indicators(aligned, lengths, names=['moving_averages', 'rsi', 'bollinger'])
+    last_close = aligned[columns, np.maximum(lengths - 1, 0)]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = {
+            'close': last_close,
+            'rsi': latest['rsi'],
+            'ma50': latest['ma50'],
+            'ma200': latest['ma200'],
+            'percent_b': (last_close - latest['lower_bb']) / (latest['upper_bb'] - latest['lower_bb']),
+        }
+        for key, _, time_range in TIMEFRAMES:
+            start = np.searchsorted(dates, get_window_start(time_range), side='left')
+            window, window_volumes, valid = closes[start:], volumes[start:], present[start:]
+            if not len(window):
+                for name in ('return', 'volatility', 'volume_z'):
+                    result[f'{name}_{key}'] = np.full(len(columns), np.nan)
+                continue
+            first = np.argmax(valid, axis=0)
+            last = len(window) - 1 - np.argmax(valid[::-1], axis=0)
+            found = valid.any(axis=0)
+            result[f'return_{key}'] = np.where(found, (window[last, columns] / window[first, columns] - 1) * 100, np.nan)
+            result[f'volatility_{key}'] = np.nanstd(window[1:] / window[:-1] - 1, axis=0, ddof=1) * 100
+            result[f'volume_z_{key}'] = np.where(
+                found,
+                (window_volumes[last, columns] - np.nanmean(window_volumes, axis=0)) / np.nanstd(window_volumes, axis=0, ddof=1),
+                np.nan,
+            )
+    return result
+
+def screener_rows(series):
+    """
+    Screen a set of tickers; returns {ticker: {metric: float}} with the metrics of screen_panel.
+
+    :param series: dict of ticker -> PANEL_DTYPE (or BAR_DTYPE) array, oldest first
+    """
+    if not series:
+        return {}
+    names, dates, closes, volumes = build_price_panel(series)
+    screened = screen_panel(dates, closes, volumes)
+    return {
+        name: {metric: float(values[column]) for metric, values in screened.items()}
+        for column, name in enumerate(names)
     }
-    
-    return insights
 
-def plot_and_encode(data_dict):
-    """Generate and encode enhanced plots to base64 for different timeframes."""
-    images = {}
-    for period, data in data_dict.items():
-        dates = [datetime.strptime(row[0], '%Y-%m-%d') for row in data]
-        closes = [row[4] for row in data]
-        volumes = [row[5] for row in data]
-        
+# Worker processes for chart rendering; 0 renders in the handler process
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() if (os.cpu_count() or 1) > 1 else 0))
+
+# Long series are thinned to about this many points per line before plotting; 0 plots every bar
+CHART_MAX_POINTS = int(os.environ.get('CHART_MAX_POINTS', 600))
+
+# Image backend for charts: 'png', 'png8' (palette-quantized PNG), 'webp' or 'svg' (inline sparkline)
+CHART_FORMAT = os.environ.get('CHART_FORMAT', 'png')
+CHART_FORMATS = ('png', 'png8', 'webp', 'svg')
+PNG8_COLORS = 64
+# SVG sparklines are always thinned to at most this many points
+SVG_MAX_POINTS = 240
+# Set to 1 to add MACD, stochastic and ATR/OBV panels to the image charts; they make each image 9 inches taller
+CHART_INDICATOR_PANELS = os.environ.get('CHART_INDICATOR_PANELS', '0') != '0'
+
+def chart_job(period, data, max_points=None, chart_format=None, indicator_panels=None):
+    """Pack the columns a chart needs into a small picklable job (defaults: CHART_MAX_POINTS, CHART_FORMAT, CHART_INDICATOR_PANELS)."""
+    if max_points is None:
+        max_points = CHART_MAX_POINTS
+    if indicator_panels is None:
+        indicator_panels = CHART_INDICATOR_PANELS
+    chart_format = chart_format or CHART_FORMAT
+    if chart_format not in CHART_FORMATS:
+        raise ValueError(f"Invalid chart format {chart_format!r}. Use one of {', '.join(CHART_FORMATS)}.")
+    return {
+        'period': period,
+        'dates': np.ascontiguousarray(data['Date']),
         # Replace 'nan' with 0
-        closes = [0 if math.isnan(x) else x for x in closes]
-        volumes = [0 if math.isnan(x) else x for x in volumes]
-        
-        fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(12, 15), gridspec_kw={'height_ratios': [3, 3, 3]})
-        
-        # Plot 1: Closing prices and volume
-        ax1.set_title(f'Closing Prices and Volume - {period}')
-        ax1.set_ylabel('Price ($)', color='b')
-        line1 = ax1.plot(dates, closes, color='b', label='Close Price')
-        ax1.tick_params(axis='y', labelcolor='b')
-        
-        ax1_volume = ax1.twinx()
-        ax1_volume.set_ylabel('Volume', color='r')
-        ax1_volume.bar(dates, volumes, alpha=0.3, color='r', label='Volume')
-        ax1_volume.tick_params(axis='y', labelcolor='r')
-        
-        lines = line1
-        lines += [plt.Rectangle((0,0),1,1,fc="r", alpha=0.3)]
-        labels = [l.get_label() for l in lines]
-        ax1.legend(lines, labels, loc='upper left')
-        
-        # Plot 2: Moving Averages
-        ax2.set_title('Moving Averages')
-        ax2.plot(dates, closes, color='b', label='Close Price')
-        ma50 = pd.Series(closes).rolling(window=50).mean()
-        ma200 = pd.Series(closes).rolling(window=200).mean()
-        ax2.plot(dates, ma50, color='r', label='50-day MA')
-        ax2.plot(dates, ma200, color='g', label='200-day MA')
-        ax2.set_ylabel('Price ($)')
-        ax2.legend(loc='upper left')
-        
-        # Plot 3: Bollinger Bands
-        ax3.set_title('Bollinger Bands')
-        ax3.plot(dates, closes, color='b', label='Close Price')
-        df = pd.Series(closes)
-        ma20 = df.rolling(window=20).mean()
-        std20 = df.rolling(window=20).std()
-        upper_bb = ma20 + (std20 * 2)
-        lower_bb = ma20 - (std20 * 2)
-        ax3.plot(dates, ma20, color='r', label='20-day MA')
-        ax3.plot(dates, upper_bb, color='g', linestyle='--', label='Upper BB')
-        ax3.plot(dates, lower_bb, color='g', linestyle='--', label='Lower BB')
-        ax3.fill_between(dates, upper_bb, lower_bb, alpha=0.1, color='gray')
-        ax3.set_ylabel('Price ($)')
-        ax3.legend(loc='upper left')
-        
-        fig.autofmt_xdate()  # Rotate and align the tick labels
-        fig.tight_layout()
-        
-        # Save the plot
-        img_stream = BytesIO()
-        plt.savefig(img_stream, format='png')
-        plt.close()
-        img_stream.seek(0)
-        images[f'stock_analysis_{period}'] = base64.b64encode(img_stream.read()).decode()
-    
-    return images
+        'closes': np.nan_to_num(data['Close'], nan=0.0, posinf=np.inf, neginf=-np.inf),
+        'highs': np.nan_to_num(data['High'], nan=0.0, posinf=np.inf, neginf=-np.inf),
+        'lows': np.nan_to_num(data['Low'], nan=0.0, posinf=np.inf, neginf=-np.inf),
+        'volumes': np.ascontiguousarray(data['Volume']),
+        'max_points': max_points,
+        'format': chart_format,
+        'indicator_panels': indicator_panels,
+    }
 
-def generate_graph_description(insights):
-    def format_value(value):
-        if isinstance(value, float) and math.isnan(value):
-            return '0'
-        elif isinstance(value, float):
-            return f'{value:.2f}'
-        return str(value)
-
-    return f"""
-    <h4>Graph Analysis ({insights['timeframe']}):</h4>
+def downsample_indices(values, max_points):
+    """
+    Indices of the points to plot when thinning a line to about max_points.
+
+    The series is cut into max_points/2 buckets and the lowest and highest value
+    of each bucket is kept (plus the first and last point), so peaks and troughs
+    survive.
+    """
+    n = len(values)
+    if not max_points or n <= max_points:
+        return np.arange(n)
+    bucket_size = -(-n // max(max_points // 2, 1))
+    buckets = -(-n // bucket_size)
+    padded = np.full(buckets * bucket_size, np.nan)
+    padded[:n] = values
+    blocks = padded.reshape(buckets, bucket_size)
+    offsets = np.arange(buckets) * bucket_size
+    keep = np.concatenate([[0, n - 1], offsets + np.nanargmin(blocks, axis=1), offsets + np.nanargmax(blocks, axis=1)])
+    return np.unique(keep)
+
+def aggregate_volume(dates, volumes, max_bars):
+    """
+    Sum daily volume into weekly, or failing that monthly, bars when there are more than max_bars days.
+
+    :return: (bar dates, bar volumes, bar width in days, label)
+    """
+    if not max_bars or len(dates) <= max_bars:
+        return dates, volumes, 0.8, 'Volume'
+    for unit, days, label in (('W', 7, 'Weekly Volume'), ('M', 30, 'Monthly Volume')):
+        periods = dates.astype(f'datetime64[{unit}]')
+        starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+        if len(starts) <= max_bars:
+            break
+    return dates[starts], np.add.reduceat(volumes, starts), days * 0.8, label
+
+def chart_series(job, max_points):
+    """
+    Compute the chart lines at full resolution, then thin them together to about max_points.
+
+    :return: dict of line dates, closes, ma20 and the indicator outputs the job draws (ma50, ma200,
+             upper_bb, lower_bb, macd, stoch_k, atr, obv, ...) and the (possibly
+             aggregated) volume_dates, volumes, volume_width, volume_label
+    """
+    dates, closes, volumes = job['dates'], job['closes'], job['volumes']
+    frame = IndicatorFrame({
+        'close': closes[None, :],
+        'high': job['highs'][None, :],
+        'low': job['lows'][None, :],
+        'volume': volumes.astype(np.float64)[None, :],
+    })
+    # The three price panels need only the moving averages and bands
+    names = None if job.get('indicator_panels') or job.get('format') == 'svg' else ('moving_averages', 'bollinger')
+    lines = {name: values[0] for name, values in compute_indicators(frame, names).items()}
+    lines['closes'] = closes
+    lines['ma20'] = lines['middle_bb']
+
+    keep = downsample_indices(closes, max_points)
+    series = {name: values[keep] for name, values in lines.items()}
+    series['dates'] = dates[keep]
+    (series['volume_dates'], series['volumes'],
+     series['volume_width'], series['volume_label']) = aggregate_volume(dates, volumes, max_points // 4)
+    return series
+
+def draw_chart(job):
+    """Draw the three-panel analysis chart for one timeframe on a new Figure, six panels with indicator_panels."""
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Rectangle
+
+    period = job['period']
+    series = chart_series(job, job.get('max_points', 0))
+    line_dates, closes = series['dates'], series['closes']
+    ma50, ma200, ma20 = series['ma50'], series['ma200'], series['ma20']
+    upper_bb, lower_bb = series['upper_bb'], series['lower_bb']
+    volume_dates, volumes = series['volume_dates'], series['volumes']
+    volume_width, volume_label = series['volume_width'], series['volume_label']
+
+    # The object-oriented API keeps no global pyplot state, so this is safe in any process
+    if job.get('indicator_panels'):
+        fig = Figure(figsize=(12, 24))
+        ax1, ax2, ax3, ax4, ax5, ax6 = fig.subplots(6, 1, gridspec_kw={'height_ratios': [3, 3, 3, 2, 2, 2]})
+    else:
+        fig = Figure(figsize=(12, 15))
+        ax1, ax2, ax3 = fig.subplots(3, 1, gridspec_kw={'height_ratios': [3, 3, 3]})
+
+    # Plot 1: Closing prices and volume
+    ax1.set_title(f'Closing Prices and Volume - {period}')
+    ax1.set_ylabel('Price ($)', color='b')
+    line1 = ax1.plot(line_dates, closes, color='b', label='Close Price')
+    ax1.tick_params(axis='y', labelcolor='b')
+
+    ax1_volume = ax1.twinx()
+    ax1_volume.set_ylabel(volume_label, color='r')
+    ax1_volume.bar(volume_dates, volumes, width=volume_width, alpha=0.3, color='r', label=volume_label)
+    ax1_volume.tick_params(axis='y', labelcolor='r')
+
+    lines = line1
+    lines += [Rectangle((0,0),1,1,fc="r", alpha=0.3, label=volume_label)]
+    labels = [l.get_label() for l in lines]
+    ax1.legend(lines, labels, loc='upper left')
+
+    # Plot 2: Moving Averages
+    ax2.set_title('Moving Averages')
+    ax2.plot(line_dates, closes, color='b', label='Close Price')
+    ax2.plot(line_dates, ma50, color='r', label='50-day MA')
+    ax2.plot(line_dates, ma200, color='g', label='200-day MA')
+    ax2.set_ylabel('Price ($)')
+    ax2.legend(loc='upper left')
+
+    # Plot 3: Bollinger Bands
+    ax3.set_title('Bollinger Bands')
+    ax3.plot(line_dates, closes, color='b', label='Close Price')
+    ax3.plot(line_dates, ma20, color='r', label='20-day MA')
+    ax3.plot(line_dates, upper_bb, color='g', linestyle='--', label='Upper BB')
+    ax3.plot(line_dates, lower_bb, color='g', linestyle='--', label='Lower BB')
+    ax3.fill_between(line_dates, upper_bb, lower_bb, alpha=0.1, color='gray')
+    ax3.set_ylabel('Price ($)')
+    ax3.legend(loc='upper left')
+
+    if job.get('indicator_panels'):
+        draw_indicator_panels(series, ax4, ax5, ax6)
+
+    fig.autofmt_xdate()  # Rotate and align the tick labels
+    fig.tight_layout()
+    return fig
+
+def draw_indicator_panels(series, ax4, ax5, ax6):
+    """Draw the MACD, stochastic and ATR/OBV panels of a chart_series."""
+    line_dates = series['dates']
+
+    # Plot 4: MACD
+    ax4.set_title('MACD (12, 26, 9)')
+    ax4.fill_between(line_dates, series['macd_hist'], 0, color='gray', alpha=0.4, label='Histogram')
+    ax4.plot(line_dates, series['macd'], color='b', label='MACD')
+    ax4.plot(line_dates, series['macd_signal'], color='orange', label='Signal')
+    ax4.axhline(0, color='black', linewidth=0.5)
+    ax4.legend(loc='upper left')
+
+    # Plot 5: Stochastic Oscillator
+    ax5.set_title('Stochastic Oscillator (14, 3)')
+    ax5.plot(line_dates, series['stoch_k'], color='b', label='%K')
+    ax5.plot(line_dates, series['stoch_d'], color='r', label='%D')
+    ax5.axhline(80, color='gray', linestyle='--', linewidth=0.8)
+    ax5.axhline(20, color='gray', linestyle='--', linewidth=0.8)
+    ax5.set_ylim(0, 100)
+    ax5.legend(loc='upper left')
+
+    # Plot 6: Average True Range and On-Balance Volume
+    ax6.set_title('Average True Range (14) and On-Balance Volume')
+    ax6.set_ylabel('ATR ($)', color='purple')
+    line6 = ax6.plot(line_dates, series['atr'], color='purple', label='ATR')
+    ax6.tick_params(axis='y', labelcolor='purple')
+    ax6_obv = ax6.twinx()
+    ax6_obv.set_ylabel('OBV (shares)', color='g')
+    line6 += ax6_obv.plot(line_dates, series['obv'], color='g', label='OBV')
+    ax6_obv.tick_params(axis='y', labelcolor='g')
+    ax6.legend(line6, [l.get_label() for l in line6], loc='upper left')
+
+def render_chart(job):
+    """Draw the chart for one timeframe and return it as PNG bytes."""
+    img_stream = BytesIO()
+    draw_chart(job).savefig(img_stream, format='png')
+    return img_stream.getvalue()
+
+def render_chart_image(job, image_format):
+    """Draw the chart and encode it through Pillow ('png8' or 'webp'); returns the image bytes."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from PIL import Image
+
+    canvas = FigureCanvasAgg(draw_chart(job))
+    canvas.draw()
+    image = Image.frombuffer('RGBA', canvas.get_width_height(), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).convert('RGB')
+    img_stream = BytesIO()
+    if image_format == 'png8':
+        image.quantize(colors=PNG8_COLORS).save(img_stream, format='PNG', optimize=True)
+    else:
+        # Lossless keeps axis text sharp and is about the size of lossy quality 90 for charts
+        image.save(img_stream, format='WEBP', lossless=True)
+    return img_stream.getvalue()
+
+def _svg_points(xs, ys):
+    """Format finite (x, y) pairs as an SVG points/path string with one decimal."""
+    finite = np.isfinite(ys)
+    return ' '.join(f'{x:.1f},{y:.1f}' for x, y in zip(xs[finite], ys[finite]))
+
+def render_svg_chart(job, width=720, height=300):
+    """
+    Draw a compact inline SVG sparkline of one timeframe.
+
+    Shows the close with its 50/200-day moving averages and Bollinger Band, a MACD
+    strip below it and the volume as bars along the bottom, from at most
+    SVG_MAX_POINTS points.
+    """
+    max_points = min(job.get('max_points') or SVG_MAX_POINTS, SVG_MAX_POINTS)
+    series = chart_series(job, max_points)
+    dates = series['dates'].astype(np.int64)
+    if not len(dates):
+        return f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}"></svg>'
+
+    top, price_bottom, bottom, left, right = 22, height - 120, height - 16, 48, width - 6
+    macd_top, macd_bottom = price_bottom + 8, price_bottom + 56
+    start, span = dates[0], max(dates[-1] - dates[0], 1)
+    scale_x = lambda days: left + (days - start) * (right - left) / span
+
+    prices = np.concatenate([series['closes'], series['upper_bb'], series['lower_bb'], series['ma50'], series['ma200']])
+    prices = prices[np.isfinite(prices)]
+    low, high = prices.min(), prices.max()
+    scale_y = lambda values: price_bottom - (values - low) * (price_bottom - top) / ((high - low) or 1)
+
+    xs = scale_x(dates)
+    band_x = np.concatenate([xs, xs[::-1]])
+    band_y = scale_y(np.concatenate([series['upper_bb'], series['lower_bb'][::-1]]))
+
+    volume_x = scale_x(series['volume_dates'].astype(np.int64))
+    volume_h = series['volumes'] / (series['volumes'].max() or 1) * (bottom - macd_bottom - 8)
+    bar_width = max((right - left) / max(len(volume_x), 1) * 0.8, 0.5)
+    bars = ''.join(f'M{x:.1f} {bottom}v-{h:.1f}' for x, h in zip(volume_x, volume_h))
+
+    macd = np.concatenate([series['macd'], series['macd_signal']])
+    macd_scale = np.nanmax(np.abs(macd)) if np.isfinite(macd).any() else 0
+    macd_zero = (macd_top + macd_bottom) / 2
+    scale_macd = lambda values: macd_zero - values * (macd_bottom - macd_top) / 2 / (macd_scale or 1)
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" font-family="sans-serif" font-size="11">'
+        f'<text x="{left}" y="14" font-weight="bold">{escape(job["period"])}: Close, 50/200-day MA, Bollinger Bands, MACD, {escape(series["volume_label"])}</text>'
+        f'<text x="2" y="{top + 4}">{high:.2f}</text><text x="2" y="{price_bottom}">{low:.2f}</text>'
+        f'<text x="{left}" y="{height - 2}">{series["dates"][0]}</text>'
+        f'<text x="{right}" y="{height - 2}" text-anchor="end">{series["dates"][-1]}</text>'
+        f'<polygon points="{_svg_points(band_x, band_y)}" fill="gray" fill-opacity="0.15"/>'
+        f'<path d="{bars}" stroke="red" stroke-opacity="0.3" stroke-width="{bar_width:.1f}"/>'
+        f'<g fill="none" stroke-width="1.2">'
+        f'<polyline points="{_svg_points(xs, scale_y(series["ma200"]))}" stroke="green"/>'
+        f'<polyline points="{_svg_points(xs, scale_y(series["ma50"]))}" stroke="red"/>'
+        f'<polyline points="{_svg_points(xs, scale_y(series["closes"]))}" stroke="blue"/>'
+        f'<path d="M{left} {macd_zero:.1f}H{right}" stroke="gray" stroke-width="0.5"/>'
+        f'<polyline points="{_svg_points(xs, scale_macd(series["macd_signal"]))}" stroke="orange"/>'
+        f'<polyline points="{_svg_points(xs, scale_macd(series["macd"]))}" stroke="blue"/>'
+        f'</g><text x="2" y="{macd_zero + 4:.1f}">MACD</text></svg>'
+    )
+
+def encode_chart(job):
+    """
+    Render a chart job in its configured format.
+
+    :return: A data: URI for raster formats, or the <svg> markup for 'svg'
+    """
+    image_format = job.get('format', 'png')
+    if image_format == 'svg':
+        return render_svg_chart(job)
+    if image_format == 'png':
+        return 'data:image/png;base64,' + base64.b64encode(render_chart(job)).decode()
+    mime = 'image/png' if image_format == 'png8' else 'image/webp'
+    return f'data:{mime};base64,' + base64.b64encode(render_chart_image(job, image_format)).decode()
+
+def chart_image_html(encoded, alt_text):
+    """HTML element for a chart produced by encode_chart."""
+    if encoded.startswith('<svg'):
+        return encoded.replace('<svg ', f'<svg role="img" aria-label="{escape(alt_text)}" ', 1)
+    return f'<img src="{encoded}" alt="{escape(alt_text)}">'
+
+# Rendered charts kept between runs; set to an empty string to disable
+CHART_CACHE_DIR = os.environ.get('CHART_CACHE_DIR', '/tmp/chart_cache')
+CHART_CACHE_MAX_BYTES = int(os.environ.get('CHART_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Bump whenever render_chart output changes so stale images are not served from the cache
+CHART_STYLE_VERSION = 6
+
+def chart_cache_key(job):
+    """Content hash of everything that determines a chart image."""
+    digest = hashlib.sha256(f'{CHART_STYLE_VERSION}:{job["period"]}:{job.get("max_points", 0)}:{job.get("format", "png")}:{bool(job.get("indicator_panels"))}'.encode())
+    for name in ('dates', 'closes', 'highs', 'lows', 'volumes'):
+        digest.update(np.ascontiguousarray(job[name]).tobytes())
+    return digest.hexdigest()
+
+class ChartCache:
+    """Size-capped, least-recently-used disk cache of encoded charts keyed by chart_cache_key."""
+
+    def __init__(self, directory=CHART_CACHE_DIR, max_bytes=CHART_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.b64')
+
+    def get(self, key):
+        """Return the cached chart for a key, or None."""
+        try:
+            with open(self.path(key)) as f:
+                encoded = f.read()
+            # The modification time doubles as the last-used time for eviction
+            os.utime(self.path(key))
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return encoded
+
+    def put(self, key, encoded):
+        path = self.path(key)
+        try:
+            # An overwritten entry no longer counts towards the size
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(encoded)
+        os.replace(tmp_path, path)
+        self.size += len(encoded) - replaced
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache is back under max_bytes."""
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.directory) if entry.is_file()
+        )
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+def _timed_encode(job):
+    """
+    Run encode_chart(job) and measure it.
+
+    :return: (encoded or None, error, wall seconds, CPU seconds, peak RSS growth of the rendering process)
+    """
+    wall, cpu, rss = time.perf_counter(), time.thread_time(), mark_rss()
+    try:
+        encoded, error = encode_chart(job), None
+    except Exception as e:
+        encoded, error = None, str(e)
+    return encoded, error, time.perf_counter() - wall, time.thread_time() - cpu, rss_growth(rss)
+
+def _render_worker(conn):
+    """Worker process loop: receive (key, job), send back (key, *_timed_encode(job))."""
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        key, job = message
+        conn.send((key, *_timed_encode(job)))
+    conn.close()
+
+class ChartRenderPool:
+    """
+    Renders chart jobs in worker processes and returns them base64-encoded.
+
+    Lambda has no /dev/shm, so multiprocessing.Pool and ProcessPoolExecutor cannot
+    create their queues there; workers are plain Processes talking over Pipes.
+    Each worker holds at most one job so neither side blocks on a full pipe.
+    Create the pool before starting threads, since workers are forked.
+
+    With a ChartCache, jobs whose image is cached are answered without rendering.
+    Wall seconds, CPU seconds and peak RSS of every rendered job are kept in render_times by key.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, cache=None):
+        self.cache = cache
+        self.cache_keys = {}
+        self.render_times = {}
+        self.backlog = deque()
+        self.finished = []
+        self.busy = {}
+        self.processes = []
+        for _ in range(workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_render_worker, args=(child_conn,), daemon=True)
+            process.start()
+            child_conn.close()
+            self.processes.append(process)
+            self.busy[parent_conn] = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        """Number of submitted jobs whose results have not been collected yet."""
+        return len(self.backlog) + len(self.finished) + sum(self.busy.values())
+
+    def submit(self, key, job, render=True):
+        """Queue a chart; with render=False only a cached image is used, else the result is (key, None, None)."""
+        if self.cache:
+            cache_key = chart_cache_key(job)
+            encoded = self.cache.get(cache_key)
+            if encoded is not None:
+                logger.debug(f"Chart cache hit for {key}")
+                self.finished.append((key, encoded, None))
+                return
+            self.cache_keys[key] = cache_key
+        if not render:
+            self.cache_keys.pop(key, None)
+            self.finished.append((key, None, None))
+            return
+
+        if not self.busy:
+            self._store((key, *_timed_encode(job)))
+            return
+        self.backlog.append((key, job))
+        self._dispatch()
+
+    def _store(self, result):
+        """Record a rendered (key, encoded, error, wall, cpu, rss) result and add it to the cache."""
+        key, encoded, error, *timing = result
+        self.render_times[key] = timing
+        cache_key = self.cache_keys.pop(key, None)
+        if cache_key and encoded is not None:
+            self.cache.put(cache_key, encoded)
+        self.finished.append((key, encoded, error))
+
+    def _dispatch(self):
+        for conn, busy in self.busy.items():
+            if not self.backlog:
+                break
+            if not busy:
+                conn.send(self.backlog.popleft())
+                self.busy[conn] = True
+
+    def collect(self, timeout=None):
+        """
+        Return finished (key, encoded chart, error) results.
+
+        Waits up to `timeout` seconds (forever if None) for at least one result
+        when none is ready yet; timeout=0 only picks up what is already done.
+        """
+        running = [conn for conn, busy in self.busy.items() if busy]
+        if running:
+            for conn in wait(running, 0 if self.finished else timeout):
+                self._store(conn.recv())
+                self.busy[conn] = False
+            self._dispatch()
+        results, self.finished = self.finished, []
+        return results
+
+    def close(self, timeout=5):
+        """Stop the workers, dropping queued jobs; workers still busy after `timeout` seconds are killed."""
+        for conn in self.busy:
+            try:
+                conn.send(None)
+                conn.close()
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.backlog.clear()
+        self.busy = {}
+        self.processes = []
+
+def plot_and_encode(data_dict):
+    """Generate and encode enhanced plots for different timeframes (see encode_chart)."""
+    return {
+        f'stock_analysis_{period}': encode_chart(chart_job(period, data))
+        for period, data in data_dict.items()
+    }
+
+def format_value(value):
+    if isinstance(value, float) and math.isnan(value):
+        return '0'
+    elif isinstance(value, float):
+        return f'{value:.2f}'
+    return str(value)
+
+# Report fragments, compiled once per container by get_report_template
+REPORT_TEMPLATES = {
+    'graph_description.html': """
+    <h4>Graph Analysis ({{ insights.timeframe }}):</h4>
     <p>
-    Over this {insights['timeframe']} period, the stock showed a {insights['trend'].lower()} trend 
-    with a trend strength of {format_value(insights['trend_strength'])}. 
-    The closing price ranged from ${format_value(insights['lowest_close'])} to ${format_value(insights['highest_close'])}, 
-    with an average of ${format_value(insights['average_close'])}.
+    Over this {{ insights.timeframe }} period, the stock showed a {{ insights.trend | lower }} trend 
+    with a trend strength of {{ insights.trend_strength | fmt }}. 
+    The closing price ranged from ${{ insights.lowest_close | fmt }} to ${{ insights.highest_close | fmt }}, 
+    with an average of ${{ insights.average_close | fmt }}.
     </p>
     <p>
-    The 50-day moving average is at ${format_value(insights['ma50'])}, while the 200-day moving average is at ${format_value(insights['ma200'])}. 
-    {
-    "The 50-day MA is above the 200-day MA, potentially indicating a bullish trend." 
-    if insights['ma50'] > insights['ma200'] else 
-    "The 50-day MA is below the 200-day MA, potentially indicating a bearish trend."
-    }
+    The 50-day moving average is at ${{ insights.ma50 | fmt }}, while the 200-day moving average is at ${{ insights.ma200 | fmt }}. 
+    {% if insights.ma50 > insights.ma200 %}The 50-day MA is above the 200-day MA, potentially indicating a bullish trend.
+    {%- else %}The 50-day MA is below the 200-day MA, potentially indicating a bearish trend.{% endif %}
     </p>
     <p>
-    The stock's RSI is {format_value(insights['rsi'])}, suggesting it might be 
-    {"overbought" if insights['rsi'] > 70 else "oversold" if insights['rsi'] < 30 else "neither overbought nor oversold"}.
-    The Bollinger Bands show a width of ${format_value(insights['upper_bb'] - insights['lower_bb'])}, 
-    indicating {"high" if (insights['upper_bb'] - insights['lower_bb']) > (insights['average_close'] * 0.1) else "low"} volatility.
+    The stock's RSI is {{ insights.rsi | fmt }}, suggesting it might be 
+    {% if insights.rsi > 70 %}overbought{% elif insights.rsi < 30 %}oversold{% else %}neither overbought nor oversold{% endif %}.
+    The Bollinger Bands show a width of ${{ (insights.upper_bb - insights.lower_bb) | fmt }}, 
+    indicating {% if (insights.upper_bb - insights.lower_bb) > (insights.average_close * 0.1) %}high{% else %}low{% endif %} volatility.
     </p>
+    {% set has_macd = insights.macd_signal == insights.macd_signal %}
+    {%- set has_stoch = insights.stoch_k == insights.stoch_k %}
+    {%- set has_atr = insights.atr == insights.atr %}
+    {%- set has_obv = insights.obv_change == insights.obv_change %}
+    {%- if has_macd or has_stoch or has_atr or has_obv %}
     <p>
-    Trading volume ranged from {insights['range_volume']:,} to {insights['range_volume'] + insights['std_dev_volume']:,} shares, 
-    with a median of {insights['median_volume']:,} shares. 
-    The highest volume was observed on {insights['max_volume_date']}, 
-    while the lowest was on {insights['min_volume_date']}.
+    {% if has_macd %}The MACD is {% if insights.macd > insights.macd_signal %}above{% else %}below{% endif %} its signal line, 
+    pointing to {% if insights.macd > insights.macd_signal %}strengthening{% else %}weakening{% endif %} momentum. 
+    {% endif %}{% if has_stoch %}The stochastic %K of {{ insights.stoch_k | fmt }} is in the 
+    {% if insights.stoch_k > 80 %}overbought{% elif insights.stoch_k < 20 %}oversold{% else %}neutral{% endif %} zone. 
+    {% endif %}{% if has_atr %}The average true range is ${{ insights.atr | fmt }} a day. 
+    {% endif %}{% if has_obv %}On-balance volume {% if insights.obv_change > 0 %}rose{% else %}fell{% endif %} over the last 20 days.
+    {% endif %}</p>
+    {%- endif %}
+    <p>
+    Trading volume ranged from {{ insights.range_volume | thousands }} to {{ (insights.range_volume + insights.std_dev_volume) | thousands }} shares, 
+    with a median of {{ insights.median_volume | thousands }} shares. 
+    The highest volume was observed on {{ insights.max_volume_date }}, 
+    while the lowest was on {{ insights.min_volume_date }}.
     </p>
     <p>
-    Overall, the stock can be classified as <strong>{insights['classification']}</strong> for this period, 
-    with a price change of ${format_value(insights['price_change'])} ({format_value(insights['price_change_percent'])}%).
+    Overall, the stock can be classified as <strong>{{ insights.classification }}</strong> for this period, 
+    with a price change of ${{ insights.price_change | fmt }} ({{ insights.price_change_percent | fmt }}%).
     </p>
-    """
-
-def generate_html_content(ticker, description, images, insights_dict):
-    def generate_insights_html(insights):
-        def format_value(value):
-            if isinstance(value, float) and math.isnan(value):
-                return '0'
-            elif isinstance(value, float):
-                return f'{value:.2f}'
-            return str(value)
-
-        return f"""
+    """,
+    'insights.html': """
         <div class="insights-container">
-            <h4>Key Insights ({insights['timeframe']}):</h4>
-            <p><strong>Classification:</strong> <span class="classification {insights['classification'].lower()}">{insights['classification']}</span></p>
+            <h4>Key Insights ({{ insights.timeframe }}):</h4>
+            <p><strong>Classification:</strong> <span class="classification {{ insights.classification | lower }}">{{ insights.classification }}</span></p>
             <ul>
-                <li><strong>Period:</strong> {insights['start_date']} to {insights['end_date']}</li>
-                <li><strong>Price Change:</strong> ${format_value(insights['price_change'])} ({format_value(insights['price_change_percent'])}%)</li>
-                <li><strong>Trend:</strong> {insights['trend']} (Strength: {format_value(insights['trend_strength'])})</li>
-                <li><strong>50-day MA:</strong> ${format_value(insights['ma50'])}</li>
-                <li><strong>200-day MA:</strong> ${format_value(insights['ma200'])}</li>
-                <li><strong>RSI:</strong> {format_value(insights['rsi'])}</li>
-                <li><strong>Bollinger Bands:</strong> Upper: ${format_value(insights['upper_bb'])}, Middle: ${format_value(insights['middle_bb'])}, Lower: ${format_value(insights['lower_bb'])}</li>
-                <li><strong>Highest Close:</strong> ${format_value(insights['highest_close'])}</li>
-                <li><strong>Lowest Close:</strong> ${format_value(insights['lowest_close'])}</li>
-                <li><strong>Average Close:</strong> ${format_value(insights['average_close'])}</li>
-                <li><strong>Volatility:</strong> {format_value(insights['volatility'])}%</li>
-                <li><strong>Max Daily Gain:</strong> {format_value(insights['max_daily_gain'])}%</li>
-                <li><strong>Max Daily Loss:</strong> {format_value(insights['max_daily_loss'])}%</li>
-                <li><strong>Total Volume:</strong> {insights['total_volume']:,} shares</li>
-                <li><strong>Highest Volume Day:</strong> {insights['max_volume_date']}</li>
-                <li><strong>Lowest Volume Day:</strong> {insights['min_volume_date']}</li>
+                <li><strong>Period:</strong> {{ insights.start_date }} to {{ insights.end_date }}</li>
+                <li><strong>Price Change:</strong> ${{ insights.price_change | fmt }} ({{ insights.price_change_percent | fmt }}%)</li>
+                <li><strong>Trend:</strong> {{ insights.trend }} (Strength: {{ insights.trend_strength | fmt }})</li>
+                <li><strong>50-day MA:</strong> ${{ insights.ma50 | fmt }}</li>
+                <li><strong>200-day MA:</strong> ${{ insights.ma200 | fmt }}</li>
+                <li><strong>RSI:</strong> {{ insights.rsi | fmt }}</li>
+                <li><strong>Bollinger Bands:</strong> Upper: ${{ insights.upper_bb | fmt }}, Middle: ${{ insights.middle_bb | fmt }}, Lower: ${{ insights.lower_bb | fmt }}</li>
+                {% if insights.macd_signal == insights.macd_signal %}<li><strong>MACD (12, 26, 9):</strong> {{ insights.macd | fmt }}, Signal: {{ insights.macd_signal | fmt }}, Histogram: {{ insights.macd_hist | fmt }}</li>{% endif %}
+                {% if insights.stoch_k == insights.stoch_k %}<li><strong>Stochastic (14, 3):</strong> %K: {{ insights.stoch_k | fmt }}, %D: {{ insights.stoch_d | fmt }}</li>{% endif %}
+                {% if insights.atr == insights.atr %}<li><strong>Average True Range (14):</strong> ${{ insights.atr | fmt }}</li>{% endif %}
+                {% if insights.obv_change == insights.obv_change %}<li><strong>On-Balance Volume, 20-day change:</strong> {{ insights.obv_change | int | thousands }} shares</li>{% endif %}
+                <li><strong>Highest Close:</strong> ${{ insights.highest_close | fmt }}</li>
+                <li><strong>Lowest Close:</strong> ${{ insights.lowest_close | fmt }}</li>
+                <li><strong>Average Close:</strong> ${{ insights.average_close | fmt }}</li>
+                <li><strong>Volatility:</strong> {{ insights.volatility | fmt }}%</li>
+                <li><strong>Max Daily Gain:</strong> {{ insights.max_daily_gain | fmt }}%</li>
+                <li><strong>Max Daily Loss:</strong> {{ insights.max_daily_loss | fmt }}%</li>
+                <li><strong>Total Volume:</strong> {{ insights.total_volume | thousands }} shares</li>
+                <li><strong>Highest Volume Day:</strong> {{ insights.max_volume_date }}</li>
+                <li><strong>Lowest Volume Day:</strong> {{ insights.min_volume_date }}</li>
             </ul>
         </div>
-        """
-    graph_template = """
-    <div class="graph-container">
-        <h4>{title}</h4>
-        <img src="data:image/png;base64,{img_src}" alt="{alt_text}">
-        {insights}
-        {description}
-    </div>
-    """
-
-    graph_sections = ''.join([
-        graph_template.format(
-            title=f"Stock Analysis - {timeframe}",
-            img_src=images[f'stock_analysis_{key}'],
-            alt_text=f"Stock Analysis - {timeframe}",
-            insights=generate_insights_html(insights),
-            description=generate_graph_description(insights)
-        )
-        for key, (timeframe, insights) in insights_dict.items()
-    ])
-
-    return f"""
+        """,
+    'stock_section.html': """
     <section class="stock-section">
-        <h2>{ticker}</h2>
-        <p class="stock-description">{description}</p>
+        <h2>{{ ticker }}</h2>
+        <p class="stock-description">{{ description }}</p>
         <h3>Graphs and Insights:</h3>
         <div class="graphs-container">
-            {graph_sections}
+            {% for graph in graphs %}{% set insights = graph.insights %}
+    <div class="graph-container">
+        <h4>{{ graph.title }}</h4>
+        {{ graph.image }}
+        {% include 'insights.html' %}
+        {% include 'graph_description.html' %}
+    </div>
+    {% endfor %}
         </div>
         <p class="summary">
-            The performance of {ticker} varies across different timeframes. Please refer to the detailed insights and descriptions above for each specific period. Consider the trend, moving averages, RSI, Bollinger Bands, and volume patterns when making investment decisions.
+            The performance of {{ ticker }} varies across different timeframes. Please refer to the detailed insights and descriptions above for each specific period. Consider the trend, moving averages, RSI, Bollinger Bands, MACD, stochastics, average true range and volume patterns when making investment decisions.
         </p>
     </section>
+    """,
+    'screener.html': """
+    <section class="screener">
+        <h2>Screener</h2>
+        <p>{{ count }} tickers ranked by {{ ranked_by }} return. Click a column header to sort by it.</p>
+        {{ table }}
+        <script>
+        document.querySelectorAll('.screener th').forEach(function (header, column) {
+            header.style.cursor = 'pointer';
+            header.addEventListener('click', function () {
+                var body = header.closest('table').tBodies[0];
+                var descending = header.dataset.order !== 'desc';
+                header.dataset.order = descending ? 'desc' : 'asc';
+                var value = function (row) {
+                    var text = row.cells[column].textContent.trim();
+                    var number = parseFloat(text.replace(/[,%+]/g, ''));
+                    return isNaN(number) ? text : number;
+                };
+                Array.from(body.rows).sort(function (a, b) {
+                    var x = value(a), y = value(b);
+                    // Numbers before text such as n/a, whichever the direction
+                    if (typeof x !== typeof y) return typeof x === 'number' ? -1 : 1;
+                    return (x < y ? -1 : x > y ? 1 : 0) * (descending ? -1 : 1);
+                }).forEach(function (row) { body.appendChild(row); });
+            });
+        });
+        </script>
+    </section>
+    """,
+}
+
+_report_environment = None
+
+def get_report_template(name):
+    """Return a compiled report template; the environment and its templates are built once."""
+    global _report_environment
+    if _report_environment is None:
+        import jinja2
+
+        environment = jinja2.Environment(loader=jinja2.DictLoader(REPORT_TEMPLATES), cache_size=-1)
+        environment.filters['fmt'] = format_value
+        environment.filters['thousands'] = lambda value: f'{value:,}'
+        _report_environment = environment
+    return _report_environment.get_template(name)
+
+def generate_graph_description(insights):
+    return get_report_template('graph_description.html').render(insights=insight_record(insights))
+
+def generate_insights_html(insights):
+    return get_report_template('insights.html').render(insights=insight_record(insights))
+
+def stock_section_chunks(ticker, description, images, insights_dict):
     """
-    
-def format_table_as_html(df):
-    """Format the pandas DataFrame as an HTML table with equal column width, center-aligned values, and proper borders."""
-    return df.style.set_table_styles(
+    Render one ticker's report section as a stream of text chunks.
+
+    Timeframes missing from `images` (charts dropped to meet the deadline) are shown without a chart.
+    """
+    graphs = [
+        {
+            'title': f"Stock Analysis - {timeframe}",
+            'image': chart_image_html(images[f'stock_analysis_{key}'], f"Stock Analysis - {timeframe}")
+            if images.get(f'stock_analysis_{key}') else CHART_OMITTED_HTML,
+            'insights': insight_record(insights),
+        }
+        for key, (timeframe, insights) in insights_dict.items()
+    ]
+    return get_report_template('stock_section.html').generate(ticker=ticker, description=description, graphs=graphs)
+
+CHART_OMITTED_HTML = '<p class="chart-omitted">Chart omitted to deliver the report on time.</p>'
+
+def generate_html_content(ticker, description, images, insights_dict):
+    return ''.join(stock_section_chunks(ticker, description, images, insights_dict))
+
+def format_table_as_html(df, table_id='table'):
+    """
+    Format the pandas DataFrame as an HTML table with equal column width, center-aligned values, and proper borders.
+
+    :param table_id: Element id suffix; fixed so the same data always renders the same HTML
+    """
+    return df.style.set_uuid(table_id).set_table_styles(
         [
             {'selector': 'th', 'props': [('font-size', '12pt'), ('background-color', '#2C3E50'), ('color', 'white'), ('text-align', 'center'), ('border', '1px solid #ddd'), ('width', '100px')]},
+            # Equal column width; one rule for every cell keeps the CSS the same size for any number of rows
             {'selector': 'td', 'props': [('padding', '8px'), ('text-align', 'center'), ('border', '1px solid #ddd'), ('width', '100px')]},
+            {'selector': '', 'props': [('border-collapse', 'collapse')]},
             {'selector': 'tr:nth-child(even)', 'props': [('background-color', '#f2f2f2')]},
             {'selector': 'tr:nth-child(odd)', 'props': [('background-color', '#ffffff')]},
         ]
-    ).set_properties(**{
-        'text-align': 'center',
-        'border-collapse': 'collapse',
-        'border': '1px solid #ddd',
-        'width': '100px',  # Set equal column width
-        'padding': '8px'
-    }).hide(axis='index').to_html()  # hide the index column
+    ).hide(axis='index').to_html()  # hide the index column
+
+def _screener_value(value, spec):
+    return 'n/a' if math.isnan(value) else spec.format(value)
+
+def screener_table_html(rows):
+    """
+    Render screener rows (see screener_rows) as a ranked table, sortable in the browser.
+
+    Tickers are ranked by their SCREENER_RANK_BY return, tickers without one last.
+    """
+    import pandas as pd
+
+    labels = {key: label for key, label, _ in TIMEFRAMES}
+    rank_by = f'return_{SCREENER_RANK_BY}'
+    ranked = sorted(rows, key=lambda ticker: -rows[ticker][rank_by] if not math.isnan(rows[ticker][rank_by]) else math.inf)
+    records = []
+    for rank, ticker in enumerate(ranked, 1):
+        row = rows[ticker]
+        record = {'Rank': rank, 'Ticker': ticker, 'Close': _screener_value(row['close'], '${:,.2f}')}
+        for key, label in labels.items():
+            record[label] = _screener_value(row[f'return_{key}'], '{:+.2f}%')
+        record['Volatility (1 Year)'] = _screener_value(row['volatility_1_year'], '{:.2f}%')
+        record['RSI'] = _screener_value(row['rsi'], '{:.1f}')
+        record['MA50 vs MA200'] = (
+            'n/a' if math.isnan(row['ma50']) or math.isnan(row['ma200'])
+            else 'Above' if row['ma50'] > row['ma200'] else 'Below'
+        )
+        record['%B'] = _screener_value(row['percent_b'], '{:.2f}')
+        record['Volume z (30 Days)'] = _screener_value(row['volume_z_30_days'], '{:+.2f}')
+        records.append(record)
+    return get_report_template('screener.html').render(
+        table=format_table_as_html(pd.DataFrame(records), 'screener'),
+        count=len(records),
+        ranked_by=labels.get(SCREENER_RANK_BY, SCREENER_RANK_BY),
+    )
 
 html_start = """
 <!DOCTYPE html>
@@ -504,6 +2122,10 @@ html_start = """
             height: auto;
             border-radius: 5px;
         }
+        .chart-omitted {
+            color: #6c757d;
+            font-style: italic;
+        }
         .insights-container {
             background: #f0f0f0;
             padding: 15px;
@@ -568,20 +2190,137 @@ html_end = """
 </html>
 """
 
-def send_email_with_attachment(html_content, filename="stock_report.html"):
-    """Send the generated HTML content as an email attachment via SES."""
-    
-    # Fetch email addresses from DynamoDB
-    sender_email, recipient_email = get_email_credentials()
+class ReportWriter:
+    """
+    Streams the report into a binary file-like sink as ticker sections finish.
+
+    Sections are written in `order`. A section that finishes before the ones ahead
+    of it is held until they have been written or skipped. With compress=True the
+    sink receives a gzip stream. With spool=True the sections are kept in a temporary
+    file until finish(), so that a preamble computed from all tickers can go above them,
+    and assemble() can build reports of some of the sections without rendering them again.
+    """
+
+    def __init__(self, sink, order, compress=False, spool=False):
+        self.raw_sink = sink
+        self.compress = compress
+        self.sink = gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=6) if compress else sink
+        self.spool = tempfile.TemporaryFile() if spool else None
+        self.order = deque(order)
+        self.held = {}
+        # ticker -> (offset, length) of its section in the spool, in report order
+        self.sections = {}
+        self.bytes_written = 0
+
+    def _write(self, text, sink=None):
+        data = text.encode('utf-8')
+        (sink or self.spool or self.sink).write(data)
+        self.bytes_written += len(data)
+
+    def _write_section(self, ticker, chunks):
+        start = self.spool.tell() if self.spool else 0
+        for chunk in chunks:
+            self._write(chunk)
+        if self.spool:
+            self.sections[ticker] = (start, self.spool.tell() - start)
+
+    def start(self):
+        if not self.spool:
+            self._write(html_start)
+
+    def add(self, ticker, chunks):
+        """Write a ticker's section (an iterable of text chunks) or hold it until its turn."""
+        if self.order and self.order[0] == ticker:
+            self._write_section(ticker, chunks)
+            self.order.popleft()
+            self._release()
+        else:
+            self.held[ticker] = ''.join(chunks)
+
+    def skip(self, ticker):
+        """Record that a ticker will not have a section."""
+        self.held[ticker] = ''
+        self._release()
+
+    def _release(self):
+        while self.order and self.order[0] in self.held:
+            ticker = self.order.popleft()
+            self._write_section(ticker, [self.held.pop(ticker)])
+
+    def finish(self, preamble=''):
+        """
+        Write any sections still held and the closing HTML; returns the uncompressed size.
+
+        :param preamble: HTML put between the header and the first section (spool=True only)
+        """
+        if preamble and not self.spool:
+            raise ValueError("A preamble needs a spooled ReportWriter")
+        for ticker in self.order:
+            self._write_section(ticker, [self.held.pop(ticker, '')])
+        self.order.clear()
+        if self.spool:
+            self._write(html_start + preamble, self.sink)
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, self.sink)
+        self._write(html_end, self.sink)
+        if self.compress:
+            # Closing the GzipFile writes the trailer but leaves the underlying sink open
+            self.sink.close()
+        self.raw_sink.flush()
+        return self.bytes_written
+
+    def written(self):
+        """Tickers with a non-empty section so far, in report order (spool=True only)."""
+        return [ticker for ticker, (_, length) in self.sections.items() if length] + \
+            [ticker for ticker in self.order if self.held.get(ticker)]
+
+    def assemble(self, sink, tickers, preamble='', compress=False):
+        """
+        Write a report of only `tickers`' sections into another sink; returns its uncompressed size.
+
+        The sections are copied from the spool, so a report per watchlist costs a file copy
+        rather than rendering. Call after finish() and before close().
+        """
+        out = gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=6) if compress else sink
+        size = 0
+        for data in [(html_start + preamble).encode('utf-8'), *self._spooled(tickers), html_end.encode('utf-8')]:
+            out.write(data)
+            size += len(data)
+        if compress:
+            out.close()
+        sink.flush()
+        return size
 
-    # Create the MIME email object
-    msg = MIMEMultipart()
-    msg['Subject'] = 'Daily Stock Market Analysis Report'
-    msg['From'] = sender_email
-    msg['To'] = ', '.join(recipient_email)  # Join recipient list into a single string
+    def _spooled(self, tickers):
+        for ticker in tickers:
+            start, length = self.sections[ticker]
+            self.spool.seek(start)
+            yield self.spool.read(length)
 
-    # Add email body
-    body = """
+    def close(self):
+        """Drop the spooled sections."""
+        if self.spool:
+            self.spool.close()
+            self.spool = None
+
+# How the report reaches recipients:
+#   'attachment' - the HTML file attached as is
+#   'gzip', 'zip' - the HTML file compressed before attaching
+#   'link'       - the HTML file uploaded to an object store, the email carries a link
+REPORT_DELIVERY = os.environ.get('REPORT_DELIVERY', 'attachment')
+DELIVERY_MODES = ('attachment', 'gzip', 'zip', 'link')
+
+# Object store for 'link' delivery: an S3 bucket, or a local directory standing in for one
+REPORT_BUCKET = os.environ.get('REPORT_BUCKET', '')
+REPORT_STORE_DIR = os.environ.get('REPORT_STORE_DIR', '')
+# Public base URL (e.g. CloudFront) for stored reports; presigned S3 URLs are used without it.
+# Presigned URLs also stop working when the signing role's session expires.
+REPORT_BASE_URL = os.environ.get('REPORT_BASE_URL', '')
+REPORT_LINK_EXPIRY = int(os.environ.get('REPORT_LINK_EXPIRY', 7 * 24 * 60 * 60))
+
+email_subject = 'Daily Stock Market Analysis Report'
+
+email_body = """
     Dear User,
     
     Today's Daily Stock Market Analysis Report is now available, offering insights on key stocks across 7-day, 30-day, 6-month, 1-year, YTD, and 5-year timeframes.
@@ -594,31 +2333,899 @@ def send_email_with_attachment(html_content, filename="stock_report.html"):
     - Key Metrics (Closing prices, volatility, gains/losses, volume trends)
     - Performance Summaries
 
-    Please review the attached HTML file for the full, interactive report. 
+    {access}
     
     Best regards,
     Kaustubh Sunil Khedekar
     """
 
-    msg.attach(MIMEText(body, 'plain'))
+class S3ReportStore:
+    """Stores reports in an S3 bucket and links to them."""
 
-    # Attach the HTML content as a file
-    part = MIMEBase('application', 'octet-stream')
-    part.set_payload(html_content.encode('utf-8'))
-    encoders.encode_base64(part)
-    part.add_header('Content-Disposition', f'attachment; filename={filename}')
-    msg.attach(part)
+    def __init__(self, bucket=REPORT_BUCKET):
+        self.bucket = bucket
+        import boto3
 
-    # Send the email via AWS SES
-    try:
-        response = ses_client.send_raw_email(
-            Source=sender_email,
-            Destinations=recipient_email,  # Wrap the single email in a list
-            RawMessage={'Data': msg.as_string()}
+        self.client = boto3.client('s3', region_name=aws_region)
+
+    def put(self, key, data, content_type):
+        """Upload report bytes or a binary file and return a URL recipients can open."""
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+        if REPORT_BASE_URL:
+            return f"{REPORT_BASE_URL.rstrip('/')}/{key}"
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=REPORT_LINK_EXPIRY
         )
-        print(f"Email with attachment sent successfully: {response}")
+
+class LocalReportStore:
+    """Stores reports in a local directory; stands in for S3 in tests and local runs."""
+
+    def __init__(self, directory=REPORT_STORE_DIR):
+        self.directory = directory
+
+    def put(self, key, data, content_type):
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            if hasattr(data, 'read'):
+                shutil.copyfileobj(data, f)
+            else:
+                f.write(data)
+        if REPORT_BASE_URL:
+            return f"{REPORT_BASE_URL.rstrip('/')}/{key}"
+        return 'file://' + os.path.abspath(path)
+
+def get_report_store():
+    """Return the object store configured for 'link' delivery."""
+    if REPORT_STORE_DIR:
+        return LocalReportStore(REPORT_STORE_DIR)
+    if REPORT_BUCKET:
+        return S3ReportStore(REPORT_BUCKET)
+    raise ValueError("'link' delivery needs REPORT_BUCKET or REPORT_STORE_DIR to be set")
+
+# Per-ticker results of a run, so a retried invocation resumes instead of starting over:
+# 'local' (CHECKPOINT_DIR), 'dynamodb' (CHECKPOINT_TABLE) or empty (default) to disable.
+# Local checkpoints take about 1 MB per ticker and run date, next to the chart cache in /tmp
+CHECKPOINT_STORE = os.environ.get('CHECKPOINT_STORE', '')
+CHECKPOINT_DIR = os.environ.get('CHECKPOINT_DIR', '/tmp/checkpoints')
+CHECKPOINT_TABLE = os.environ.get('CHECKPOINT_TABLE', 'StockReportCheckpoints')
+# Run dates kept by the local store, and days before DynamoDB's TTL removes an item
+CHECKPOINT_KEEP_DAYS = int(os.environ.get('CHECKPOINT_KEEP_DAYS', 3))
+# DynamoDB items are limited to 400 KB, so larger checkpoints are split
+CHECKPOINT_ITEM_BYTES = 350 * 1024
+
+def encode_checkpoint(result):
+    """gzip-compressed JSON of a checkpoint: {'insights': insights_dict, 'html': section, 'chart_format': ...}."""
+    return gzip.compress(json.dumps(result).encode('utf-8'), compresslevel=6)
+
+def decode_checkpoint(data):
+    return json.loads(gzip.decompress(data))
+
+class LocalCheckpointStore:
+    """Keeps checkpoints as <directory>/<run date>/<ticker>.json.gz; also the stand-in for tests."""
+
+    def __init__(self, directory=CHECKPOINT_DIR):
+        self.directory = directory
+
+    def load(self, run_date):
+        """Return {ticker: checkpoint} saved for run_date."""
+        run_dir = os.path.join(self.directory, run_date)
+        if not os.path.isdir(run_dir):
+            return {}
+        results = {}
+        for name in os.listdir(run_dir):
+            if not name.endswith('.json.gz'):
+                continue
+            try:
+                with open(os.path.join(run_dir, name), 'rb') as f:
+                    results[name[:-len('.json.gz')]] = decode_checkpoint(f.read())
+            except (OSError, ValueError, EOFError) as e:
+                logger.warning(f"Ignoring unreadable checkpoint {name}: {e}")
+        return results
+
+    def save(self, run_date, ticker, result):
+        run_dir = os.path.join(self.directory, run_date)
+        os.makedirs(run_dir, exist_ok=True)
+        path = os.path.join(run_dir, f'{ticker}.json.gz')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_checkpoint(result))
+        os.replace(tmp_path, path)
+
+    def _shard_dir(self, run_date, run_id):
+        return os.path.join(self.directory, run_date, '_shards', run_id)
+
+    def mark_shard(self, run_date, run_id, shard):
+        """Record that a shard of a fanned-out run has finished."""
+        shard_dir = self._shard_dir(run_date, run_id)
+        os.makedirs(shard_dir, exist_ok=True)
+        open(os.path.join(shard_dir, str(shard)), 'w').close()
+
+    def count_shards(self, run_date, run_id):
+        shard_dir = self._shard_dir(run_date, run_id)
+        return len([name for name in os.listdir(shard_dir) if name.isdigit()]) if os.path.isdir(shard_dir) else 0
+
+    def claim(self, run_date, run_id):
+        """Atomically claim the aggregation of a run; True for exactly one caller."""
+        shard_dir = self._shard_dir(run_date, run_id)
+        os.makedirs(shard_dir, exist_ok=True)
+        try:
+            os.close(os.open(os.path.join(shard_dir, 'aggregate'), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def mark_sent(self, run_date, recipients):
+        """Record recipients whose message of run_date went out, one file per message."""
+        sent_dir = os.path.join(self.directory, run_date, '_sent')
+        os.makedirs(sent_dir, exist_ok=True)
+        path = os.path.join(sent_dir, uuid.uuid4().hex)
+        with open(f'{path}.tmp', 'w') as f:
+            f.write('\n'.join(recipients))
+        os.replace(f'{path}.tmp', path)
+
+    def load_sent(self, run_date):
+        """Return the set of recipients already sent run_date's report."""
+        sent_dir = os.path.join(self.directory, run_date, '_sent')
+        sent = set()
+        for name in os.listdir(sent_dir) if os.path.isdir(sent_dir) else ():
+            if not name.endswith('.tmp'):
+                with open(os.path.join(sent_dir, name)) as f:
+                    sent.update(line for line in f.read().split('\n') if line)
+        return sent
+
+    def prune(self, keep_days=None):
+        """Remove all but the newest keep_days run dates (default CHECKPOINT_KEEP_DAYS, 0 removes every one)."""
+        keep_days = CHECKPOINT_KEEP_DAYS if keep_days is None else keep_days
+        if keep_days < 0:
+            raise ValueError(f"keep_days must be 0 or more, not {keep_days}")
+        if not os.path.isdir(self.directory):
+            return
+        run_dates = sorted(os.listdir(self.directory))
+        for run_date in run_dates[:max(len(run_dates) - keep_days, 0)]:
+            shutil.rmtree(os.path.join(self.directory, run_date), ignore_errors=True)
+
+class DynamoCheckpointStore:
+    """
+    Keeps checkpoints in a DynamoDB table with partition key 'run_date' and sort key 'part'.
+
+    A checkpoint is stored as items '<ticker>#0', '<ticker>#1', ... of at most
+    CHECKPOINT_ITEM_BYTES each; the first one records how many parts there are.
+    Shard markers and aggregation claims of fanned-out runs, and the recipients already
+    sent the report, are items starting with '_'.
+    Items carry an 'expires_at' attribute for the table's TTL.
+    """
+
+    def __init__(self, table_name=CHECKPOINT_TABLE):
+        self.table = get_dynamodb().Table(table_name)
+
+    def load(self, run_date):
+        from boto3.dynamodb.conditions import Key
+
+        parts = {}
+        query = {'KeyConditionExpression': Key('run_date').eq(run_date)}
+        while True:
+            response = self.table.query(**query)
+            for item in response['Items']:
+                if item['part'].startswith('_'):
+                    continue
+                ticker, index = item['part'].rsplit('#', 1)
+                ticker_parts = parts.setdefault(ticker, {})
+                ticker_parts[int(index)] = item['data'].value
+                if 'parts' in item:
+                    ticker_parts['count'] = int(item['parts'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        results = {}
+        for ticker, ticker_parts in parts.items():
+            count = ticker_parts.get('count')
+            if count is None or any(index not in ticker_parts for index in range(count)):
+                continue
+            results[ticker] = decode_checkpoint(b''.join(ticker_parts[index] for index in range(count)))
+        return results
+
+    def save(self, run_date, ticker, result):
+        data = encode_checkpoint(result)
+        chunks = [data[start:start + CHECKPOINT_ITEM_BYTES] for start in range(0, len(data), CHECKPOINT_ITEM_BYTES)]
+        expires_at = int(time.time()) + CHECKPOINT_KEEP_DAYS * 24 * 60 * 60
+        # The first item, which carries the part count, is written last so a partial save is never loaded
+        for index in reversed(range(len(chunks))):
+            item = {'run_date': run_date, 'part': f'{ticker}#{index}', 'data': chunks[index], 'expires_at': expires_at}
+            if index == 0:
+                item['parts'] = len(chunks)
+            self.table.put_item(Item=item)
+
+    def _put_marker(self, run_date, part, attributes=None, **kwargs):
+        expires_at = int(time.time()) + CHECKPOINT_KEEP_DAYS * 24 * 60 * 60
+        item = {'run_date': run_date, 'part': part, 'expires_at': expires_at, **(attributes or {})}
+        self.table.put_item(Item=item, **kwargs)
+
+    def mark_shard(self, run_date, run_id, shard):
+        self._put_marker(run_date, f'_shard#{run_id}#{shard}')
+
+    def count_shards(self, run_date, run_id):
+        from boto3.dynamodb.conditions import Key
+
+        # Strongly consistent, so the last shard to finish sees every marker
+        query = {
+            'KeyConditionExpression': Key('run_date').eq(run_date) & Key('part').begins_with(f'_shard#{run_id}#'),
+            'ConsistentRead': True,
+            'Select': 'COUNT',
+        }
+        count = 0
+        while True:
+            response = self.table.query(**query)
+            count += response['Count']
+            if 'LastEvaluatedKey' not in response:
+                return count
+            query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def claim(self, run_date, run_id):
+        """Claim the aggregation of a run with a conditional put; True for exactly one caller."""
+        from botocore.exceptions import ClientError
+
+        try:
+            self._put_marker(run_date, f'_aggregate#{run_id}', ConditionExpression='attribute_not_exists(part)')
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def mark_sent(self, run_date, recipients):
+        self._put_marker(run_date, f'_sent#{uuid.uuid4().hex}', {'recipients': list(recipients)})
+
+    def load_sent(self, run_date):
+        from boto3.dynamodb.conditions import Key
+
+        query = {
+            'KeyConditionExpression': Key('run_date').eq(run_date) & Key('part').begins_with('_sent#'),
+            'ConsistentRead': True,
+        }
+        sent = set()
+        while True:
+            response = self.table.query(**query)
+            for item in response['Items']:
+                sent.update(item['recipients'])
+            if 'LastEvaluatedKey' not in response:
+                return sent
+            query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def prune(self, keep_days=None):
+        """Old items are removed by the table's TTL."""
+
+def get_checkpoint_store():
+    """Return the configured checkpoint store, or None when checkpoints are disabled."""
+    if CHECKPOINT_STORE == 'local':
+        return LocalCheckpointStore(CHECKPOINT_DIR)
+    if CHECKPOINT_STORE == 'dynamodb':
+        return DynamoCheckpointStore(CHECKPOINT_TABLE)
+    if CHECKPOINT_STORE:
+        raise ValueError(f"Invalid CHECKPOINT_STORE {CHECKPOINT_STORE!r}. Use 'local', 'dynamodb' or leave it empty.")
+    return None
+
+def _mime_part(out, boundary, headers, payload):
+    """Write one MIME part; payload bytes are base64-encoded in 76-character lines."""
+    out.write(f'--{boundary}\r\n'.encode())
+    for name, value in headers:
+        out.write(f'{name}: {value}\r\n'.encode())
+    out.write(b'Content-Transfer-Encoding: base64\r\n\r\n')
+    # Encode in slices of whole 57-byte lines so only one slice is ever held twice
+    payload = memoryview(payload)
+    for start in range(0, len(payload), 57 * 1024):
+        out.write(base64.encodebytes(payload[start:start + 57 * 1024]).replace(b'\n', b'\r\n'))
+
+def build_raw_email(sender, recipients, subject, body, attachment=None):
+    """
+    Assemble a multipart/mixed message directly as bytes for send_raw_email.
+
+    :param attachment: Optional (filename, content type, bytes)
+    :return: The raw message bytes
+    """
+    boundary, content = build_mime_body(body, attachment)
+    return build_mime_headers(sender, ', '.join(recipients), subject, boundary) + content
+
+def build_mime_headers(sender, to, subject, boundary):
+    """Top-level headers of a message whose body comes from build_mime_body."""
+    headers = [
+        ('Subject', subject),
+        ('From', sender),
+        ('To', to),
+        ('Date', formatdate(localtime=True)),
+        ('Message-ID', make_msgid()),
+        ('MIME-Version', '1.0'),
+        ('Content-Type', f'multipart/mixed; boundary="{boundary}"'),
+    ]
+    return ''.join(f'{name}: {value}\r\n' for name, value in headers).encode() + b'\r\n'
+
+def build_mime_body(body, attachment=None):
+    """
+    Encode the text and attachment parts once, to be sent under any number of headers.
+
+    :param attachment: Optional (filename, content type, bytes)
+    :return: (boundary, body bytes)
+    """
+    boundary = f'=_{uuid.uuid4().hex}'
+    out = BytesIO()
+    _mime_part(out, boundary, [('Content-Type', 'text/plain; charset="utf-8"')], body.encode('utf-8'))
+    if attachment:
+        filename, content_type, data = attachment
+        _mime_part(out, boundary, [
+            ('Content-Type', f'{content_type}; name="{filename}"'),
+            ('Content-Disposition', f'attachment; filename="{filename}"'),
+        ], data)
+    out.write(f'--{boundary}--\r\n'.encode())
+    return boundary, out.getvalue()
+
+def prepare_delivery(report, filename, delivery, precompressed=False):
+    """
+    Turn the report into the email's access text and optional attachment for a delivery mode.
+
+    :param report: Report bytes, or a binary file for 'link' delivery
+    :param precompressed: The report is already gzip-compressed (only valid for 'gzip')
+
+    :return: (access text for the body, attachment tuple or None)
+    """
+    if precompressed and delivery != 'gzip':
+        raise ValueError("Only 'gzip' delivery accepts a precompressed report")
+    if delivery == 'attachment':
+        return ("Please review the attached HTML file for the full, interactive report.",
+                (filename, 'application/octet-stream', report))
+    if delivery == 'gzip':
+        return ("Please review the attached compressed HTML file (.gz) for the full, interactive report.",
+                (f'{filename}.gz', 'application/gzip', report if precompressed else gzip.compress(report, compresslevel=6)))
+    if delivery == 'zip':
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(filename, report)
+        return ("Please review the HTML file in the attached zip archive for the full, interactive report.",
+                (f'{os.path.splitext(filename)[0]}.zip', 'application/zip', archive.getvalue()))
+    if delivery == 'link':
+        key = f"reports/{datetime.now().strftime('%Y-%m-%d')}/{filename}"
+        url = get_report_store().put(key, report, 'text/html; charset=utf-8')
+        return f"The full, interactive report is available at:\n    {url}", None
+    raise ValueError(f"Invalid delivery mode {delivery!r}. Use one of {', '.join(DELIVERY_MODES)}.")
+
+# SES sends: SES accepts at most 50 destinations per message. A message to several recipients
+# is addressed to "undisclosed-recipients" so they do not see each other.
+SES_MAX_DESTINATIONS = 50
+SES_SEND_WORKERS = int(os.environ.get('SES_SEND_WORKERS', 4))
+# Recipients per second; 0 reads the account's MaxSendRate from SES
+SES_MAX_SEND_RATE = float(os.environ.get('SES_MAX_SEND_RATE', 0))
+SES_SEND_RETRIES = int(os.environ.get('SES_SEND_RETRIES', 4))
+SES_THROTTLE_CODES = ('Throttling', 'ThrottlingException', 'TooManyRequestsException')
+
+def get_send_rate():
+    """Recipients per second SES accepts: SES_MAX_SEND_RATE, else the account quota."""
+    if SES_MAX_SEND_RATE:
+        return SES_MAX_SEND_RATE
+    try:
+        return float(get_ses_client().get_send_quota()['MaxSendRate'])
     except Exception as e:
-        print(f"Error sending email: {e}")
+        logger.warning(f"Could not read the SES send quota, sending 1 message per second: {e}")
+        return 1.0
+
+class SesSender:
+    """
+    Sends raw messages from a few threads, within the SES send rate.
+
+    Every destination of a message takes one token of a TokenBucket refilled at the send
+    rate. Throttled sends are retried with jittered exponential backoff. submit() blocks
+    while 2 * workers messages are in flight, so only those are held in memory.
+
+    :param on_sent: Called with the destinations of every message SES accepted
+    """
+
+    def __init__(self, workers=SES_SEND_WORKERS, rate=None, on_sent=None):
+        rate = rate or get_send_rate()
+        self.bucket = TokenBucket(max(rate, 1), 1)
+        # A message cannot take more tokens than the bucket holds
+        self.batch_size = int(min(SES_MAX_DESTINATIONS, max(rate, 1)))
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self.slots = threading.BoundedSemaphore(2 * max(workers, 1))
+        self.futures = []
+        self.sent = 0
+        self.errors = []
+        # Destinations of the messages that failed after every retry
+        self.failed = []
+        self.on_sent = on_sent
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=True)
+
+    def submit(self, source, destinations, raw_message):
+        self.slots.acquire()
+        future = self.executor.submit(self._send, source, destinations, raw_message)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append((future, destinations))
+
+    def _send(self, source, destinations, raw_message):
+        for attempt in range(SES_SEND_RETRIES + 1):
+            if attempt:
+                time.sleep(random.uniform(0, min(FETCH_BACKOFF_CAP, FETCH_BACKOFF_BASE * 2 ** attempt)))
+            self.bucket.acquire(count=len(destinations))
+            try:
+                response = get_ses_client().send_raw_email(
+                    Source=source, Destinations=destinations, RawMessage={'Data': raw_message}
+                )
+            except Exception as e:
+                code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+                if code in SES_THROTTLE_CODES and attempt < SES_SEND_RETRIES:
+                    logger.warning(f"SES throttled a send to {len(destinations)} recipients, retrying")
+                    continue
+                raise
+            metrics.count('EmailsSent')
+            metrics.count('EmailRecipients', len(destinations))
+            if self.on_sent:
+                self.on_sent(destinations)
+            return response
+
+    def wait(self):
+        """Wait for every message; returns the number sent, errors are kept in `errors` and `failed`."""
+        for future, destinations in self.futures:
+            try:
+                future.result()
+                self.sent += 1
+            except Exception as e:
+                self.errors.append(e)
+                self.failed.extend(destinations)
+        self.futures = []
+        return self.sent
+
+def send_email_with_attachment(html_content, filename="stock_report.html", delivery=None, precompressed=False,
+                               recipients=None, sender=None, ses_sender=None):
+    """
+    Send the generated HTML report via SES.
+
+    :param html_content: The report, as str, UTF-8 bytes or a binary file positioned at its start
+    :param delivery: One of DELIVERY_MODES, defaults to REPORT_DELIVERY
+    :param precompressed: html_content is already gzip-compressed (see ReportWriter)
+    :param recipients: Addresses to send to, defaults to every recipient in DynamoDB (with `sender`)
+    :param ses_sender: SesSender to queue the messages on; without one they are sent before returning
+    """
+    delivery = delivery or REPORT_DELIVERY
+
+    if recipients is None:
+        # Fetch email addresses from DynamoDB
+        sender, recipients = get_email_credentials()
+
+    if isinstance(html_content, str):
+        report = html_content.encode('utf-8')
+    elif hasattr(html_content, 'read') and delivery != 'link':
+        report = html_content.read()
+    else:
+        # Bytes, or a file that is uploaded straight from disk
+        report = html_content
+    access, attachment = prepare_delivery(report, filename, delivery, precompressed)
+    # The parts are encoded once; every batch of recipients only gets its own headers
+    boundary, content = build_mime_body(email_body.format(access=access), attachment)
+    del report, attachment
+
+    own_sender = ses_sender is None
+    ses_sender = ses_sender or SesSender()
+    batches = [recipients[start:start + ses_sender.batch_size] for start in range(0, len(recipients), ses_sender.batch_size)]
+    for batch in batches:
+        to = batch[0] if len(batch) == 1 else 'undisclosed-recipients:;'
+        raw_message = build_mime_headers(sender, to, email_subject, boundary) + content
+        metrics.count('EmailBytes', len(raw_message))
+        ses_sender.submit(sender, batch, raw_message)
+    logger.info(f"{delivery} email {len(content):,} bytes to {len(recipients):,} recipients in {len(batches)} messages")
+
+    if own_sender:
+        with ses_sender:
+            sent = ses_sender.wait()
+        raise_send_errors(ses_sender)
+        print(f"Email with attachment sent successfully: {sent} messages")
+
+def raise_send_errors(ses_sender):
+    """Log the recipients of failed sends and raise if any message failed; the first error if none went out."""
+    if not ses_sender.errors:
+        return
+    failed = len(ses_sender.errors)
+    metrics.count('EmailsFailed', failed)
+    metrics.count('EmailRecipientsFailed', len(ses_sender.failed))
+    logger.error(f"{failed} of {ses_sender.sent + failed} messages failed: {ses_sender.errors[0]}")
+    logger.error(f"Recipients without the report: {', '.join(ses_sender.failed)}")
+    if not ses_sender.sent:
+        raise ses_sender.errors[0]
+    raise RuntimeError(f"{failed} of {ses_sender.sent + failed} messages ({len(ses_sender.failed)} recipients) "
+                       f"failed: {ses_sender.errors[0]}")
+
+# Run metrics, emitted once per invocation as a CloudWatch Embedded Metric Format log line
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'StockMarketReport')
+# Empty writes the line to stdout (where Lambda picks EMF up); otherwise a file it is appended to
+METRICS_OUTPUT = os.environ.get('METRICS_OUTPUT', '')
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', 25))
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """Lifetime peak resident set size in bytes (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(who).ru_maxrss * 1024
+
+def _proc_status_bytes(field):
+    """A memory field of /proc/self/status (e.g. VmRSS, VmHWM) in bytes; None where there is no /proc."""
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) * 1024 for line in f if line.startswith(field + ':'))
+    except (OSError, StopIteration, ValueError):
+        return None
+
+def current_peak_rss():
+    """Peak RSS in bytes since the last mark_rss (VmHWM on Linux), or the lifetime peak elsewhere."""
+    return _proc_status_bytes('VmHWM') or peak_rss()
+
+def mark_rss():
+    """
+    Start measuring how far RSS rises, by resetting the peak to the current RSS
+    through /proc/self/clear_refs. ru_maxrss cannot be reset, so without /proc
+    only growth of the lifetime peak is seen.
+
+    :return: Baseline for rss_growth
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _proc_status_bytes('VmRSS') or current_peak_rss()
+    except OSError:
+        return current_peak_rss()
+
+def rss_growth(baseline):
+    """Bytes the peak RSS rose above a mark_rss baseline."""
+    return max(current_peak_rss() - baseline, 0)
+
+class RunMetrics:
+    """
+    Wall time, CPU time and peak RSS growth per stage and per ticker, plus byte counters, for one run.
+
+    Stages overlap in wall time because downloads, insights, rendering and HTML are
+    pipelined. CPU time is per thread, or per worker process for rendering.
+    Peak RSS growth is how far the peak RSS rose above the RSS at the start of a
+    call (see mark_rss); overlapping calls reset the same peak, so for them it is a
+    lower bound. Thread-safe, since downloads are recorded from the fetch threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # stage -> [calls, wall seconds, CPU seconds, largest peak RSS growth in bytes]
+        self.stages = {}
+        # ticker -> {stage: [wall seconds, CPU seconds, largest peak RSS growth in bytes]}
+        self.tickers = {}
+        self.counters = {}
+        # The per-call resets clear the run's peak, so it is kept as the largest one seen
+        self.peak = current_peak_rss()
+
+    def add(self, stage, wall, cpu=0.0, ticker=None, rss=0):
+        peak = current_peak_rss()
+        with self.lock:
+            self.peak = max(self.peak, peak)
+            totals = self.stages.setdefault(stage, [0, 0.0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+            totals[3] = max(totals[3], rss)
+            if ticker is not None:
+                per_ticker = self.tickers.setdefault(ticker, {}).setdefault(stage, [0.0, 0.0, 0])
+                per_ticker[0] += wall
+                per_ticker[1] += cpu
+                per_ticker[2] = max(per_ticker[2], rss)
+
+    @contextmanager
+    def stage(self, name, ticker=None):
+        """Time the body of a with-block as one call of `name`."""
+        wall, cpu, rss = time.perf_counter(), time.thread_time(), mark_rss()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu, ticker, rss_growth(rss))
+
+    def call(self, name, ticker, func, *args):
+        """Run func(*args) as one call of stage `name`; used for work submitted to threads."""
+        with self.stage(name, ticker):
+            return func(*args)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def emf(self, function_name):
+        """Build the Embedded Metric Format document for this run."""
+        values, definitions = {}, []
+
+        def metric(name, value, unit):
+            values[name] = value
+            definitions.append({'Name': name, 'Unit': unit})
+
+        for stage, (calls, wall, cpu, rss) in self.stages.items():
+            metric(f'{stage}.Calls', calls, 'Count')
+            metric(f'{stage}.WallTime', round(wall * 1000, 1), 'Milliseconds')
+            metric(f'{stage}.CPUTime', round(cpu * 1000, 1), 'Milliseconds')
+            metric(f'{stage}.PeakRSSGrowth', rss, 'Bytes')
+        for name, value in self.counters.items():
+            metric(name, value, 'Bytes' if name.endswith('Bytes') else 'Count')
+        metric('PeakRSS', max(self.peak, current_peak_rss()), 'Bytes')
+
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': definitions,
+                }],
+            },
+            'FunctionName': function_name,
+            **values,
+            # Not a metric: kept in the log line for CloudWatch Logs Insights queries
+            'Tickers': {
+                ticker: {
+                    stage: {'WallTime': round(wall * 1000, 1), 'CPUTime': round(cpu * 1000, 1), 'PeakRSSGrowth': rss}
+                    for stage, (wall, cpu, rss) in per_ticker.items()
+                }
+                for ticker, per_ticker in self.tickers.items()
+            },
+        }
+
+    def emit(self, function_name, output=None):
+        """Write the EMF document as one JSON line to stdout or append it to the file `output`."""
+        line = json.dumps(self.emf(function_name), separators=(',', ':'))
+        output = METRICS_OUTPUT if output is None else output
+        if output:
+            with open(output, 'a') as f:
+                f.write(line + '\n')
+        else:
+            print(line, flush=True)
+
+# Replaced at the start of every invocation
+metrics = RunMetrics()
+
+@contextmanager
+def profiling(mode):
+    """
+    Opt-in profiling of the block: 'cpu' (cProfile) or 'memory' (tracemalloc).
+
+    The top PROFILE_TOP entries are logged; cProfile stats are also saved to
+    /tmp/profile.pstats. Neither follows work into the render worker processes.
+    """
+    if mode == 'cpu':
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats('/tmp/profile.pstats')
+            report = StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_TOP)
+            logger.info(f"CPU profile:\n{report.getvalue()}")
+    elif mode == 'memory':
+        import tracemalloc
+
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            metrics.count('TracedPeakBytes', peak)
+            top = '\n'.join(str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_TOP])
+            logger.info(f"Memory profile (traced peak {peak:,} bytes):\n{top}")
+    else:
+        if mode:
+            logger.warning(f"Unknown profile mode {mode!r}; expected 'cpu' or 'memory'")
+        yield
+
+# Deadline-aware scheduling: time kept free at the end of the run for finishing and sending the report
+SEND_RESERVE_SECONDS = float(os.environ.get('SEND_RESERVE_SECONDS', 20))
+# Timeframes still charted in 'reduced' mode
+REDUCED_TIMEFRAMES = os.environ.get('REDUCED_TIMEFRAMES', '30_days,1_year').split(',')
+# Running per-ticker cost estimates kept between runs (unset: ticker_costs.json in PRICE_STORE_DIR); empty disables persisting them
+TICKER_COSTS_PATH = os.environ.get('TICKER_COSTS_PATH')
+
+class TickerCosts:
+    """
+    Exponential moving averages of each ticker's seconds per stage: 'fetch', 'insights',
+    'chart' (one rendered chart) and 'html'. Unknown tickers get the average of the known
+    ones, or DEFAULTS.
+    """
+
+    DEFAULTS = {'fetch': 2.0, 'insights': 0.02, 'chart': 0.5, 'html': 0.01}
+    ALPHA = 0.3
+
+    def __init__(self, path=None):
+        """:param path: JSON file of the estimates (default: TICKER_COSTS_PATH, read when called)"""
+        if path is None:
+            path = TICKER_COSTS_PATH
+        if path is None:
+            path = os.path.join(PRICE_STORE_DIR, 'ticker_costs.json') if PRICE_STORE_DIR else ''
+        self.path = path
+        self.costs = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.costs = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable ticker costs {path}: {e}")
+
+    def observe(self, ticker, stage, seconds):
+        ticker_costs = self.costs.setdefault(ticker, {})
+        previous = ticker_costs.get(stage)
+        ticker_costs[stage] = seconds if previous is None else previous + self.ALPHA * (seconds - previous)
+
+    def estimate(self, ticker, stage):
+        known = self.costs.get(ticker, {}).get(stage)
+        if known is not None:
+            return known
+        others = [ticker_costs[stage] for ticker_costs in self.costs.values() if stage in ticker_costs]
+        return sum(others) / len(others) if others else self.DEFAULTS[stage]
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.costs, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save ticker costs to {self.path}: {e}")
+
+class DeadlineScheduler:
+    """
+    Orders tickers by priority and picks how much work each one gets so the run ends
+    SEND_RESERVE_SECONDS before the Lambda deadline.
+
+    Levels, most to least work: 'full' (every chart), 'reduced' (REDUCED_TIMEFRAMES
+    charted, other charts only from the cache), 'cached' (charts only from the cache)
+    and 'text' (insights only). Tickers are decided in priority order: each gets the
+    first level at which it, plus every ticker after it in 'text' mode, is estimated
+    to finish in time, so the most important tickers keep their charts.
+    """
+
+    LEVELS = ('full', 'reduced', 'cached', 'text')
+
+    def __init__(self, deadline=None, costs=None, render_workers=None, fetch_workers=None, reserve=None):
+        """
+        :param deadline: time.monotonic() value the Lambda is stopped at, or None for no limit
+        :param render_workers: Defaults to RENDER_WORKERS, likewise fetch_workers (FETCH_WORKERS)
+                               and reserve (SEND_RESERVE_SECONDS), all read when called
+        """
+        reserve = SEND_RESERVE_SECONDS if reserve is None else reserve
+        self.stop_at = None if deadline is None else deadline - reserve
+        self.costs = costs or TickerCosts('')
+        self.render_workers = max(RENDER_WORKERS if render_workers is None else render_workers, 1)
+        self.fetch_workers = max(FETCH_WORKERS if fetch_workers is None else fetch_workers, 1)
+
+    @staticmethod
+    def order(ticker_names, priority=None):
+        """Tickers in `priority` order (most important first), then the rest in their configured order."""
+        priority = [ticker for ticker in (priority or []) if ticker in ticker_names]
+        return list(dict.fromkeys(priority + list(ticker_names)))
+
+    def time_left(self):
+        return math.inf if self.stop_at is None else self.stop_at - time.monotonic()
+
+    def expired(self):
+        return self.time_left() <= 0
+
+    def wait_timeout(self, timeout=None):
+        """`timeout` (None = forever) shortened so a wait wakes up when the time is up."""
+        left = max(self.time_left(), 0)
+        if left == math.inf:
+            return timeout
+        return left if timeout is None else min(timeout, left)
+
+    @staticmethod
+    def rendered_timeframes(level):
+        """Timeframe keys that are rendered (not only served from the cache) at a level."""
+        if level == 'full':
+            return [key for key, _, _ in TIMEFRAMES]
+        if level == 'reduced':
+            return [key for key, _, _ in TIMEFRAMES if key in REDUCED_TIMEFRAMES]
+        return []
+
+    def cost(self, ticker, level):
+        """Estimated seconds of analysis, rendering and HTML for a ticker at a level."""
+        charts = len(self.rendered_timeframes(level)) * self.costs.estimate(ticker, 'chart') / self.render_workers
+        return self.costs.estimate(ticker, 'insights') + self.costs.estimate(ticker, 'html') + charts
+
+    def choose_level(self, ticker, later_tickers, queued_charts=0):
+        """
+        Pick the level for a ticker whose data has arrived.
+
+        :param later_tickers: Tickers not yet downloaded or analyzed
+        :param queued_charts: Charts already waiting for or in the render pool
+        """
+        time_left = self.time_left()
+        if time_left == math.inf:
+            return 'full'
+        fixed = (
+            sum(self.costs.estimate(other, 'fetch') for other in later_tickers) / self.fetch_workers
+            + queued_charts * self.costs.estimate(ticker, 'chart') / self.render_workers
+        )
+        fixed += sum(self.cost(other, self.LEVELS[-1]) for other in later_tickers)
+        for level in self.LEVELS:
+            if fixed + self.cost(ticker, level) <= time_left:
+                return level
+        return self.LEVELS[-1]
+
+# Fan-out: 'coordinator' events split the tickers into shards of SHARD_SIZE and dispatch
+# one 'worker' event per shard; the last worker to finish stitches the report and sends it
+SHARD_SIZE = int(os.environ.get('SHARD_SIZE', 50))
+# 'lambda' (asynchronous invoke) or 'local' (a process per shard, for tests and local runs)
+DISPATCH_BACKEND = os.environ.get('DISPATCH_BACKEND', 'lambda' if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else 'local')
+# Function that runs the shards; defaults to the coordinator's own function
+WORKER_FUNCTION = os.environ.get('WORKER_FUNCTION', '')
+
+_lambda_client = None
+
+def get_lambda_client():
+    """Return the Lambda client, creating it on first use."""
+    global _lambda_client
+    if _lambda_client is None:
+        import boto3
+        _lambda_client = boto3.client('lambda', region_name=aws_region)
+    return _lambda_client
+
+class LambdaDispatcher:
+    """Sends each shard event to a Lambda function with an asynchronous (Event) invoke."""
+
+    def __init__(self, function_name=WORKER_FUNCTION):
+        self.function_name = function_name
+
+    def dispatch(self, events, context=None):
+        function_name = self.function_name or getattr(context, 'function_name', None)
+        if not function_name:
+            raise ValueError("Lambda dispatch needs WORKER_FUNCTION or a Lambda context")
+        client = get_lambda_client()
+        for event in events:
+            client.invoke(FunctionName=function_name, InvocationType='Event', Payload=json.dumps(event).encode('utf-8'))
+
+class LocalDispatcher:
+    """Runs each shard event through lambda_handler in its own process and waits for all of them."""
+
+    def __init__(self, processes=None):
+        self.processes = processes or os.cpu_count() or 1
+
+    def dispatch(self, events, context=None):
+        running = deque()
+        for event in events:
+            if len(running) >= self.processes:
+                running.popleft().join()
+            # Not a daemon: the shard starts its own chart render processes
+            process = multiprocessing.Process(target=lambda_handler, args=(event, {}))
+            process.start()
+            running.append(process)
+        for process in running:
+            process.join()
+
+def shard_store_problem(backend=None):
+    """Why shards run by `backend` could not hand their sections to the aggregation, or None if they can."""
+    backend = backend or DISPATCH_BACKEND
+    if not CHECKPOINT_STORE:
+        return "shard workers need CHECKPOINT_STORE to hand their sections to the aggregation"
+    directory = os.path.realpath(CHECKPOINT_DIR)
+    if backend == 'lambda' and CHECKPOINT_STORE == 'local' and os.path.commonpath([directory, '/tmp']) == '/tmp':
+        # Each worker would mark its shard done in its own container, so no worker ever sees them all
+        return (f"CHECKPOINT_DIR {CHECKPOINT_DIR} is in each Lambda container's own /tmp; "
+                "use CHECKPOINT_STORE=dynamodb or a CHECKPOINT_DIR on EFS")
+    return None
+
+def get_dispatcher(backend=None):
+    backend = backend or DISPATCH_BACKEND
+    if backend == 'lambda':
+        return LambdaDispatcher()
+    if backend == 'local':
+        return LocalDispatcher()
+    raise ValueError(f"Invalid dispatch backend {backend!r}. Use 'lambda' or 'local'.")
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -644,8 +3251,40 @@ def lambda_handler(event, context):
     logger.info(f"Function version: {function_version}")
     logger.info(f"Remaining time: {remaining_time}")
 
+    # Lambda stops the function at the deadline; locally event['time_budget'] (seconds) sets one
+    deadline = None
+    if isinstance(remaining_time, (int, float)):
+        deadline = time.monotonic() + remaining_time / 1000
+    elif event.get('time_budget'):
+        deadline = time.monotonic() + float(event['time_budget'])
+
+    global metrics
+    metrics = RunMetrics()
+    try:
+        # event['profile'] = 'cpu' or 'memory' turns on profiling for this run
+        with profiling(event.get('profile')), metrics.stage('Total'):
+            # event['mode']: 'coordinator', 'worker' or 'aggregate' for fanned-out runs, else one invocation
+            mode = event.get('mode')
+            if mode == 'coordinator':
+                return dispatch_shards(event, context)
+            if mode == 'aggregate':
+                return aggregate_report(event)
+            return generate_report(event, deadline)
+    finally:
+        metrics.emit(function_name)
+
+def generate_report(event, deadline=None):
+    """
+    Build the report for the event's tickers and email it; returns the handler response.
+
+    With event['mode'] == 'worker' the event is one shard of a fanned-out run: its
+    sections are only saved as checkpoints (see finish_shard).
+
+    :param deadline: time.monotonic() value the function is stopped at (see DeadlineScheduler)
+    """
+    worker = event.get('mode') == 'worker'
     # Check if the lock file exists, indicating that the report has already been generated.
-    if os.path.exists(LOCK_FILE_PATH):
+    if not worker and os.path.exists(LOCK_FILE_PATH):
         logger.info("Process has already run. Exiting.")
         return {
             'statusCode': 200,
@@ -655,53 +3294,234 @@ def lambda_handler(event, context):
     # Use event to potentially customize the report
     custom_tickers = event.get('tickers', tickers)
     
-    html_content = ""
-    for ticker, description in custom_tickers.items():
+    store = PriceStore(PRICE_STORE_DIR) if PRICE_STORE_DIR else None
+
+    delivery = event.get('delivery') or REPORT_DELIVERY
+    # The report is streamed to disk as tickers finish, compressed on the way for gzip delivery
+    report_file = tempfile.TemporaryFile()
+    # Sections are spooled: the screener table goes above them once it is ready, and
+    # watchlist reports are assembled from them
+    writer = ReportWriter(report_file, list(custom_tickers), compress=(delivery == 'gzip'), spool=not worker)
+    writer.start()
+
+    costs = TickerCosts()
+    scheduler = DeadlineScheduler(deadline, costs)
+    # Most important tickers are downloaded and analyzed first; the report keeps the configured order
+    unprocessed = scheduler.order(custom_tickers, event.get('priority'))
+
+    # Tickers finished by an earlier attempt of this run are taken from their checkpoints
+    run_date = event.get('run_date') or datetime.now().date().isoformat()
+    checkpoints = get_checkpoint_store() if event.get('resume', True) or worker else None
+    if worker and not checkpoints:
+        raise ValueError("Shard workers need CHECKPOINT_STORE to hand their sections to the aggregation")
+    # Screener rows of resumed tickers, and the series of the tickers screened in this invocation
+    screener_key = f"{SCREENER_CHECKPOINT}-{event['run_id']}-{event['shard']}" if worker else SCREENER_CHECKPOINT
+    screened, screener_series = {}, {}
+    if checkpoints:
         try:
-            # Fetch data for different timeframes
-            data_dict = {
-                '7_days': get_stock_data(ticker, 7),
-                '30_days': get_stock_data(ticker, 30),
-                '6_months': get_stock_data(ticker, 180),
-                '1_year': get_stock_data(ticker, 365),
-                'ytd': get_stock_data(ticker, 'ytd'),
-                '5_years': get_stock_data(ticker, '5y')
-            }
-
-            if data_dict['30_days']:
-                # Calculate insights for each timeframe
-                insights_dict = {
-                    key: (timeframe, get_insights(data, timeframe))
-                    for key, (timeframe, data) in [
-                        ('7_days', ('7 Days', data_dict['7_days'])),
-                        ('30_days', ('30 Days', data_dict['30_days'])),
-                        ('6_months', ('6 Months', data_dict['6_months'])),
-                        ('1_year', ('1 Year', data_dict['1_year'])),
-                        ('ytd', ('Year-to-Date', data_dict['ytd'])),
-                        ('5_years', ('5 Years', data_dict['5_years']))
-                    ]
-                }
+            checkpoints.prune()
+            resumed = checkpoints.load(run_date)
+        except Exception as e:
+            logger.warning(f"Could not load checkpoints for {run_date}, starting over: {e}")
+            resumed = {}
+        previous_rows = resumed.get(screener_key, {})
+        for ticker, result in resumed.items():
+            if ticker in unprocessed and result.get('complete', True) and result.get('chart_format') == CHART_FORMAT:
+                unprocessed.remove(ticker)
+                writer.add(ticker, [result['html']])
+                metrics.count('TickersResumed')
+                if not SCREENER:
+                    continue
+                bars = store.load(ticker) if store and ticker not in previous_rows else None
+                if ticker in previous_rows:
+                    screened[ticker] = previous_rows[ticker]
+                elif bars is not None:
+                    # The attempt that checkpointed the section stopped before screening it
+                    screener_series[ticker] = panel_series(bars)
+        if len(unprocessed) < len(custom_tickers):
+            logger.info(f"Resuming {run_date}: {len(custom_tickers) - len(unprocessed)} tickers from checkpoints")
 
-                # Plot graphs and encode as base64
-                images = plot_and_encode(data_dict)
+    # ticker -> [description, insights_dict, images, charts still to come, level] while its charts are rendering
+    rendering = {}
 
-                # Generate the HTML content for this stock
-                stock_html = generate_html_content(ticker, description, images, insights_dict)
+    def write_section(ticker):
+        description, insights_dict, images, _, level = rendering.pop(ticker)
+        complete = level == 'full' and len(images) == len(TIMEFRAMES)
+        # Generate the HTML content for this stock straight into the report
+        with metrics.stage('Html', ticker):
+            if not checkpoints or not (complete or worker):
+                writer.add(ticker, stock_section_chunks(ticker, description, images, insights_dict))
+            else:
+                # Degraded sections are only checkpointed for the aggregation; a retry redoes them
+                section = ''.join(stock_section_chunks(ticker, description, images, insights_dict))
+                writer.add(ticker, [section])
+                insights = {key: (timeframe, insights_to_dict(record)) for key, (timeframe, record) in insights_dict.items()}
+                result = {'insights': insights, 'html': section, 'chart_format': CHART_FORMAT, 'complete': complete}
+                try:
+                    checkpoints.save(run_date, ticker, result)
+                except Exception as e:
+                    if worker:
+                        raise
+                    logger.warning(f"Could not checkpoint {ticker}: {e}")
+        costs.observe(ticker, 'html', metrics.tickers[ticker]['Html'][0])
+
+    def collect_charts(timeout):
+        for (ticker, period), encoded, error in render_pool.collect(timeout):
+            if ticker not in rendering:
+                continue
+            if error:
+                logger.error(f"Error processing data for {ticker}: {error}")
+                del rendering[ticker]
+                writer.skip(ticker)
+                continue
+            entry = rendering[ticker]
+            entry[3] -= 1
+            if encoded is not None:
+                entry[2][f'stock_analysis_{period}'] = encoded
+                logger.info(f"Chart {ticker} {period}: {len(encoded):,} bytes ({CHART_FORMAT})")
+                metrics.count('Charts')
+                metrics.count('ImageBytes', len(encoded))
+            if (ticker, period) in render_pool.render_times:
+                wall, cpu, rss = render_pool.render_times.pop((ticker, period))
+                metrics.add('Render', wall, cpu, ticker, rss)
+                costs.observe(ticker, 'chart', wall)
+            if not entry[3]:
+                write_section(ticker)
+
+    def analyze(ticker, future):
+        """Analyze a downloaded ticker and queue its charts at the level the deadline allows."""
+        unprocessed.remove(ticker)
+        description = custom_tickers[ticker]
+        try:
+            # The full history is fetched once and every timeframe is sliced out of it
+            history = future.result()
+            costs.observe(ticker, 'fetch', metrics.tickers[ticker]['Fetch'][0])
+            data_dict = history.windows()
 
-                # Append this stock's report to the full HTML content
-                html_content += stock_html
+            if len(data_dict['30_days']):
+                if SCREENER:
+                    screener_series[ticker] = panel_series(history.bars)
+
+                # Calculate insights for every timeframe of this ticker in one batch
+                with metrics.stage('Insights', ticker):
+                    records = compute_insights_batch(
+                        [data_dict[key] for key, _, _ in TIMEFRAMES], [timeframe for _, timeframe, _ in TIMEFRAMES]
+                    )
+                    # The records are rows of one array; the templates read their fields directly
+                    insights_dict = {key: (timeframe, record) for (key, timeframe, _), record in zip(TIMEFRAMES, records)}
+                costs.observe(ticker, 'insights', metrics.tickers[ticker]['Insights'][0])
+
+                # Cut back on charts if the deadline would not hold otherwise
+                level = scheduler.choose_level(ticker, unprocessed, len(render_pool))
+                metrics.count(f'Tickers.{level}')
+                if level != 'full':
+                    logger.warning(f"{ticker}: '{level}' mode, {scheduler.time_left():.1f}s left before the send reserve")
+
+                # Queue the charts; the HTML is generated once all of them are back
+                rendered = scheduler.rendered_timeframes(level)
+                charted = data_dict if level != 'text' else {}
+                rendering[ticker] = [description, insights_dict, {}, len(charted), level]
+                for key, data in charted.items():
+                    render_pool.submit((ticker, key), chart_job(key, data), render=key in rendered)
+                if not charted:
+                    write_section(ticker)
             else:
                 logger.warning(f"No data available for {ticker}. Skipping this stock.")
+                writer.skip(ticker)
         except Exception as e:
             logger.error(f"Error processing data for {ticker}: {str(e)}")
-            continue
+            rendering.pop(ticker, None)
+            writer.skip(ticker)
 
-    # Finalize the complete HTML content
-    complete_html = html_start + html_content + html_end
+    chart_cache = ChartCache(CHART_CACHE_DIR) if CHART_CACHE_DIR else None
+
+    # The render pool forks its workers, so it is started before the download threads
+    with ChartRenderPool(RENDER_WORKERS, chart_cache) as render_pool:
+        executor = ThreadPoolExecutor(max_workers=max(FETCH_WORKERS, 1))
+        try:
+            # Download every ticker concurrently and analyze each one as soon as it arrives
+            futures = {executor.submit(metrics.call, 'Fetch', ticker, StockHistory.fetch, ticker, store): ticker for ticker in unprocessed}
+            remaining = set(futures)
+            while remaining and not scheduler.expired():
+                # Poll briefly while charts are rendering so finished workers get new jobs
+                timeout = scheduler.wait_timeout(0.05 if len(render_pool) else None)
+                done, remaining = wait_futures(remaining, timeout=timeout, return_when=FIRST_COMPLETED)
+                # Handle arrivals in priority order
+                for future in sorted(done, key=lambda future: unprocessed.index(futures[future])):
+                    analyze(futures[future], future)
+                collect_charts(timeout=0)
+
+            while len(render_pool) and not scheduler.expired():
+                collect_charts(timeout=scheduler.wait_timeout(None))
+        finally:
+            # Downloads that have not started are cancelled; running ones are not waited for after the deadline
+            executor.shutdown(wait=not scheduler.expired(), cancel_futures=True)
+
+        if scheduler.expired():
+            # Out of time: send what is finished, with the charts that are back so far.
+            # Tickers already downloaded are still added without charts, which takes milliseconds.
+            collect_charts(timeout=0)
+            render_pool.close(timeout=0.5)
+            for future in [future for future in remaining if future.done() and not future.cancelled()]:
+                analyze(futures[future], future)
+            for ticker in list(rendering):
+                write_section(ticker)
+            for ticker in unprocessed:
+                writer.skip(ticker)
+            if unprocessed:
+                logger.warning(f"Deadline reached, {len(unprocessed)} tickers left out: {', '.join(unprocessed)}")
+            metrics.count('TickersSkipped', len(unprocessed))
+
+    costs.save()
+
+    if chart_cache:
+        logger.info(f"Chart cache: {chart_cache.hits} hits, {chart_cache.misses} misses")
+        metrics.count('ChartCacheHits', chart_cache.hits)
+        metrics.count('ChartCacheMisses', chart_cache.misses)
+
+    if SCREENER:
+        # One panel of every ticker analyzed, screened in single array operations
+        with metrics.stage('Screener'):
+            screened.update(screener_rows(screener_series))
+            screener_series.clear()
+            if checkpoints and screened:
+                try:
+                    checkpoints.save(run_date, screener_key, screened)
+                except Exception as e:
+                    if worker:
+                        raise
+                    logger.warning(f"Could not checkpoint the screener: {e}")
+
+    if worker:
+        report_file.close()
+        return finish_shard(event, checkpoints, run_date)
+    return deliver_report(writer, report_file, delivery, screened, checkpoints, run_date)
+
+def screener_preamble(screened, tickers):
+    """The screener table of `tickers` that have screener rows, or '' if none has."""
+    rows = {ticker: screened[ticker] for ticker in tickers if ticker in screened}
+    return screener_table_html(rows) if rows else ''
+
+def deliver_report(writer, report_file, delivery, screened=None, checkpoints=None, run_date=None):
+    """
+    Finish the report in `writer`, email it and write the lock file; returns the handler response.
+
+    :param writer: Spooled ReportWriter, so watchlist reports can be assembled from it
+    :param screened: Screener rows of the report's tickers, shown above their sections
+    :param checkpoints: Store recording who was sent run_date's report, so a retry skips them
+    """
+    screened = screened or {}
+    with metrics.stage('Html'):
+        report_size = writer.finish(screener_preamble(screened, writer.written()))
+    logger.info(f"Report {report_size:,} bytes")
+    metrics.count('ReportBytes', report_size)
+    metrics.count('ReportFileBytes', report_file.tell())
 
     try:
-        # Send the HTML content as an email attachment
-        send_email_with_attachment(complete_html)
+        # Send the report as an email attachment
+        with report_file, metrics.stage('Send'):
+            report_file.seek(0)
+            send_reports(writer, report_file, delivery, screened, checkpoints, run_date)
         logger.info("Email with attachment sent successfully.")
 
         # Create the lock file to indicate the process has been completed
@@ -717,6 +3537,173 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': f'Failed to send Stock Market Report: {str(e)}'
         }
+    finally:
+        writer.close()
+
+def group_watchlists(subscriptions, available):
+    """
+    Group recipients by the report they get.
+
+    :param subscriptions: {recipient: watchlist or None}, see get_subscriptions
+    :param available: Tickers with a section, in report order
+    :return: {tuple of tickers in report order, or None for the full report: [recipients]}
+    """
+    position = {ticker: index for index, ticker in enumerate(available)}
+    groups = {}
+    for recipient, watchlist in subscriptions.items():
+        tickers = tuple(sorted({ticker for ticker in watchlist or () if ticker in position}, key=position.get))
+        # No watchlist, or none of its tickers made it into today's report: the full report
+        if not tickers or len(tickers) == len(available):
+            tickers = None
+        groups.setdefault(tickers, []).append(recipient)
+    return groups
+
+def send_reports(writer, report_file, delivery, screened=None, checkpoints=None, run_date=None):
+    """
+    Email every recipient the report for their watchlist.
+
+    Recipients are grouped by watchlist, so the messages grow with unique watchlists and
+    recipients rather than recipients times tickers. Each watchlist's report is assembled
+    from the sections already in `writer`, and its screener table is cut down to its tickers.
+    With `checkpoints`, every message that goes out is recorded under run_date, and
+    recipients recorded by an earlier attempt of the run are skipped.
+
+    :param report_file: The finished full report, positioned at its start
+    """
+    sender, subscriptions = get_subscriptions()
+    on_sent = None
+    if checkpoints:
+        try:
+            sent = checkpoints.load_sent(run_date)
+        except Exception as e:
+            logger.warning(f"Could not read who was already sent the {run_date} report, sending to everyone: {e}")
+            sent = set()
+        if sent:
+            subscriptions = {recipient: watchlist for recipient, watchlist in subscriptions.items() if recipient not in sent}
+            logger.info(f"{len(sent):,} recipients already have the {run_date} report, "
+                        f"sending to the other {len(subscriptions):,}")
+            metrics.count('EmailRecipientsSkipped', len(sent))
+
+        def on_sent(destinations):
+            try:
+                checkpoints.mark_sent(run_date, destinations)
+            except Exception as e:
+                logger.warning(f"Could not record {len(destinations)} recipients as sent, a retry would resend to them: {e}")
+    groups = group_watchlists(subscriptions, writer.written())
+    if len(groups) > 1:
+        logger.info(f"{len(subscriptions):,} recipients, {len(groups)} different reports")
+    with SesSender(on_sent=on_sent) as ses_sender:
+        for tickers, recipients in groups.items():
+            if tickers is None:
+                send_email_with_attachment(report_file, delivery=delivery, precompressed=writer.compress,
+                                           recipients=recipients, sender=sender, ses_sender=ses_sender)
+                continue
+            digest = hashlib.sha256(','.join(tickers).encode()).hexdigest()[:12]
+            with tempfile.TemporaryFile() as watchlist_file:
+                size = writer.assemble(watchlist_file, tickers, screener_preamble(screened or {}, tickers),
+                                       compress=writer.compress)
+                metrics.count('WatchlistReports')
+                metrics.count('WatchlistReportBytes', size)
+                watchlist_file.seek(0)
+                send_email_with_attachment(watchlist_file, f'stock_report_{digest}.html', delivery, writer.compress,
+                                           recipients=recipients, sender=sender, ses_sender=ses_sender)
+        ses_sender.wait()
+    raise_send_errors(ses_sender)
+
+def dispatch_shards(event, context):
+    """Coordinator: split the tickers into shards and dispatch one worker event per shard."""
+    if os.path.exists(LOCK_FILE_PATH):
+        logger.info("Process has already run. Exiting.")
+        return {
+            'statusCode': 200,
+            'body': 'Stock Market Report already generated and sent!'
+        }
+
+    custom_tickers = event.get('tickers', tickers)
+    names = list(custom_tickers)
+    shard_size = max(int(event.get('shard_size', SHARD_SIZE)), 1)
+    shards = [names[start:start + shard_size] for start in range(0, len(names), shard_size)]
+    run_id = event.get('run_id') or uuid.uuid4().hex
+    problem = shard_store_problem(event.get('dispatch'))
+    if problem:
+        logger.error(f"Run {run_id}: not dispatching any shards: {problem}")
+        return {
+            'statusCode': 500,
+            'body': f'Cannot fan out the Stock Market Report: {problem}'
+        }
+    shared = {key: value for key, value in event.items() if key not in ('mode', 'tickers', 'dispatch', 'shard_size')}
+    events = [
+        dict(
+            shared,
+            mode='worker',
+            run_id=run_id,
+            run_date=event.get('run_date') or datetime.now().date().isoformat(),
+            shard=index,
+            shards=len(shards),
+            tickers={ticker: custom_tickers[ticker] for ticker in shard},
+            # The aggregation puts the sections in this order
+            report_tickers=names,
+        )
+        for index, shard in enumerate(shards)
+    ]
+    logger.info(f"Run {run_id}: dispatching {len(names)} tickers in {len(shards)} shards")
+    get_dispatcher(event.get('dispatch')).dispatch(events, context)
+    metrics.count('ShardsDispatched', len(shards))
+    return {
+        'statusCode': 202,
+        'body': f'Dispatched {len(shards)} shards for run {run_id}'
+    }
+
+def finish_shard(event, checkpoints, run_date):
+    """Worker: mark the shard done; the last shard to finish claims the aggregation and runs it."""
+    run_id, shard, shards = event['run_id'], event['shard'], event['shards']
+    checkpoints.mark_shard(run_date, run_id, shard)
+    finished = checkpoints.count_shards(run_date, run_id)
+    logger.info(f"Run {run_id}: shard {shard + 1} done, {finished}/{shards} finished")
+    if finished >= shards and checkpoints.claim(run_date, run_id):
+        return aggregate_report(event)
+    return {
+        'statusCode': 200,
+        'body': f'Shard {shard + 1}/{shards} of run {run_id} done'
+    }
+
+def aggregate_report(event):
+    """
+    Stitch the checkpointed sections of a run into the report, in order, and email it.
+
+    Run by the last shard to finish, or directly with {'mode': 'aggregate', 'run_date': ...,
+    'report_tickers': [...]} (or 'tickers') to send whatever the shards have finished.
+    """
+    run_date = event.get('run_date') or datetime.now().date().isoformat()
+    names = event.get('report_tickers') or list(event.get('tickers', tickers))
+    checkpoints = get_checkpoint_store()
+    if not checkpoints:
+        raise ValueError("Aggregation needs CHECKPOINT_STORE to read the shards' sections")
+    results = checkpoints.load(run_date)
+
+    delivery = event.get('delivery') or REPORT_DELIVERY
+    report_file = tempfile.TemporaryFile()
+    writer = ReportWriter(report_file, names, compress=(delivery == 'gzip'), spool=True)
+    writer.start()
+    missing = []
+    for ticker in names:
+        if ticker in results:
+            writer.add(ticker, [results[ticker]['html']])
+        else:
+            missing.append(ticker)
+            writer.skip(ticker)
+    if missing:
+        logger.warning(f"No section for {len(missing)} tickers: {', '.join(missing)}")
+    metrics.count('TickersAggregated', len(names) - len(missing))
+
+    rows = {}
+    if SCREENER:
+        # Every shard saved the screener rows of its tickers
+        prefix = f"{SCREENER_CHECKPOINT}-{event['run_id']}-" if event.get('run_id') else SCREENER_CHECKPOINT
+        for name, result in results.items():
+            if name.startswith(prefix):
+                rows.update(result)
+    return deliver_report(writer, report_file, delivery, rows, checkpoints, run_date)
 
 # For local testing
 if __name__ == "__main__":
@@ -0,0 +1,535 @@
+"""
+Offline benchmarks for stockMarketAnalysis.py.
+
+Everything runs on synthetic Alpha Vantage data, so no API key or AWS account is needed.
+
+    python stockMarketBenchmark.py charts
+    python stockMarketBenchmark.py formats
+    python stockMarketBenchmark.py importtime
+    python stockMarketBenchmark.py handler --tickers 20 100 500 --output bench.json
+    python stockMarketBenchmark.py ingest
+    python stockMarketBenchmark.py memory
+    python stockMarketBenchmark.py indicators
+"""
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import stockMarketAnalysis as sma
+
+# Libraries the module must not load at import time (they are imported on first use)
+LAZY_MODULES = ('matplotlib', 'pandas', 'PIL', 'jinja2', 'boto3', 'botocore', 'seaborn', 'scipy')
+
+def synthetic_time_series(symbol, years=20, seed=None):
+    """
+    Generate a 'Time Series (Daily)' dict shaped like Alpha Vantage's, newest day first.
+
+    Prices follow a geometric random walk seeded from the symbol, so the same
+    symbol always produces the same data.
+    """
+    if seed is None:
+        seed = sum(symbol.encode())
+    rng = np.random.default_rng(seed)
+
+    end = np.datetime64(date.today() - timedelta(days=1), 'D')
+    days = np.arange(end - years * 365, end + 1)
+    days = days[np.is_busday(days)][::-1]
+
+    closes = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, len(days))))
+    opens = closes * (1 + rng.normal(0, 0.005, len(days)))
+    highs = np.maximum(opens, closes) * (1 + rng.uniform(0, 0.01, len(days)))
+    lows = np.minimum(opens, closes) * (1 - rng.uniform(0, 0.01, len(days)))
+    volumes = rng.integers(1_000_000, 50_000_000, len(days))
+
+    return {
+        str(day): {
+            '1. open': f'{o:.4f}',
+            '2. high': f'{h:.4f}',
+            '3. low': f'{l:.4f}',
+            '4. close': f'{c:.4f}',
+            '5. volume': str(v),
+        }
+        for day, o, h, l, c, v in zip(days, opens, highs, lows, closes, volumes)
+    }
+
+def synthetic_csv(time_series):
+    """Render a 'Time Series (Daily)' dict as the datatype=csv body Alpha Vantage sends for it."""
+    rows = ['timestamp,open,high,low,close,volume']
+    rows += [f"{day},{','.join(values[field] for field in sma.BAR_FIELDS)}" for day, values in time_series.items()]
+    return ('\r\n'.join(rows) + '\r\n').encode()
+
+def synthetic_history(symbol, years=20):
+    return sma.StockHistory(symbol, sma.parse_time_series(synthetic_time_series(symbol, years)))
+
+def best_of(repeat, func, *args):
+    """Minimum wall time of `repeat` calls, and the last result."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def bench_charts(args):
+    """Render time and PNG size of every timeframe's chart, full resolution vs downsampled."""
+    history = synthetic_history('BENCH', args.years)
+    print(f"{'timeframe':<10} {'bars':>6} {'full s':>8} {'thin s':>8} {'speedup':>8} {'full KB':>8} {'thin KB':>8}")
+    totals = [0.0, 0.0]
+    for key, data in history.windows().items():
+        full_time, full_png = best_of(args.repeat, sma.render_chart, sma.chart_job(key, data, 0))
+        thin_time, thin_png = best_of(args.repeat, sma.render_chart, sma.chart_job(key, data, args.max_points))
+        totals[0] += full_time
+        totals[1] += thin_time
+        print(f"{key:<10} {len(data):>6} {full_time:>8.3f} {thin_time:>8.3f} {full_time / thin_time:>7.2f}x "
+              f"{len(full_png) / 1024:>8.1f} {len(thin_png) / 1024:>8.1f}")
+    print(f"{'total':<10} {'':>6} {totals[0]:>8.3f} {totals[1]:>8.3f} {totals[0] / totals[1]:>7.2f}x")
+
+def bench_formats(args):
+    """Encode time and report payload per ticker (all six timeframes) for every chart format."""
+    windows = synthetic_history('BENCH', args.years).windows()
+    print(f"{'format':<8} {'seconds':>8} {'KB/ticker':>10}")
+    for chart_format in sma.CHART_FORMATS:
+        start = time.perf_counter()
+        size = sum(len(sma.encode_chart(sma.chart_job(key, data, args.max_points, chart_format))) for key, data in windows.items())
+        print(f"{chart_format:<8} {time.perf_counter() - start:>8.3f} {size / 1024:>10.1f}")
+
+def bench_importtime(args):
+    """Cold import time of stockMarketAnalysis from `python -X importtime`; exits 1 when over budget."""
+    check = f"import stockMarketAnalysis, sys; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    # No AWS settings in the environment: importing must not need credentials or a region
+    env = {key: value for key, value in os.environ.items() if not key.startswith('AWS_')}
+    results = []
+    for _ in range(args.repeat):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', check],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True, check=True,
+        )
+        # Lines look like "import time:  self [us] | cumulative | imported package"
+        rows = []
+        for line in proc.stderr.splitlines():
+            if line.startswith('import time:') and not line.endswith('imported package'):
+                _, cumulative, name = line[len('import time:'):].split('|')
+                rows.append((int(cumulative), name.rstrip()))
+        results.append((dict((name.strip(), us) for us, name in rows)['stockMarketAnalysis'], rows, proc.stdout.strip()))
+
+    total, rows, loaded = min(results, key=lambda result: result[0])
+    top_level = sorted((row for row in rows if row[1].startswith('  ') and not row[1].startswith('    ')), reverse=True)
+    print(f"{'module':<28} {'ms':>8}")
+    for us, name in top_level[:args.top]:
+        print(f"{name.strip():<28} {us / 1000:>8.1f}")
+    print(f"{'stockMarketAnalysis':<28} {total / 1000:>8.1f}  (budget {args.budget_ms:.0f} ms)")
+
+    failures = []
+    if loaded:
+        failures.append(f"loaded at import time: {loaded}")
+    if total / 1000 > args.budget_ms:
+        failures.append(f"import took {total / 1000:.1f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+class SyntheticResponse:
+    """The parts of requests.Response that call_api and its readers use."""
+
+    def __init__(self, content):
+        self.status_code = 200
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_lines(self, chunk_size=512):
+        """Yield the lines of the body, taking `chunk_size` bytes at a time like a streamed response."""
+        pending = b''
+        for start in range(0, len(self.content), chunk_size):
+            lines = (pending + self.content[start:start + chunk_size]).splitlines(keepends=True)
+            pending = lines.pop() if lines and not lines[-1].endswith((b'\n', b'\r')) else b''
+            for line in lines:
+                yield line.rstrip(b'\r\n')
+        if pending:
+            yield pending
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+class SyntheticSession:
+    """
+    Stands in for the pooled HTTP session and serves synthetic TIME_SERIES_DAILY JSON or CSV.
+
+    Payloads are generated up front and kept gzip-compressed, as they would arrive
+    over the wire, so timed runs only pay for decompressing and parsing them.
+    """
+
+    def __init__(self, symbols, years, payloads=None):
+        self.payloads = payloads or {}
+        for symbol in symbols:
+            if symbol in self.payloads:
+                continue
+            time_series = synthetic_time_series(symbol, years)
+            document = {
+                'Meta Data': {'1. Information': 'Daily Prices (open, high, low, close) and Volumes', '2. Symbol': symbol},
+                'Time Series (Daily)': time_series,
+            }
+            self.payloads[symbol] = (
+                gzip.compress(json.dumps(document, indent=4).encode(), compresslevel=1),
+                gzip.compress(synthetic_csv(time_series), compresslevel=1),
+            )
+        self.requests = 0
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        self.requests += 1
+        document, csv = self.payloads[params['symbol']]
+        if params.get('datatype') == 'csv':
+            content = gzip.decompress(csv)
+            if params.get('outputsize') == 'compact':
+                content = b''.join(content.splitlines(keepends=True)[:101])
+            return SyntheticResponse(content)
+        content = gzip.decompress(document)
+        if params.get('outputsize') == 'compact':
+            document = json.loads(content)
+            series = document['Time Series (Daily)']
+            document['Time Series (Daily)'] = dict(list(series.items())[:100])
+            content = json.dumps(document).encode()
+        return SyntheticResponse(content)
+
+class StubDynamoDBClient:
+    """The GetItem and paginated scan calls get_email_credentials makes."""
+
+    def get_item(self, **kwargs):
+        return {'Item': {'emailAddress': {'S': 'reports@example.com'}}}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, **kwargs):
+        yield {'Items': [{'emailID': {'S': 'recipient1'}, 'emailAddress': {'S': 'reader@example.com'}}]}
+
+class StubSES:
+    def __init__(self):
+        self.sent = []
+
+    def get_send_quota(self):
+        return {'Max24HourSend': 1_000_000.0, 'MaxSendRate': 1_000.0, 'SentLast24Hours': 0.0}
+
+    def send_raw_email(self, **kwargs):
+        self.sent.append(len(kwargs['RawMessage']['Data']))
+        return {'MessageId': f'bench-{len(self.sent)}'}
+
+def synthetic_tickers(count):
+    return {f'T{i:04d}': f'Synthetic company {i}' for i in range(count)}
+
+def bench_handler_run(count, years, work_dir):
+    """
+    Run lambda_handler once for `count` synthetic tickers with a cold price store, chart cache and checkpoints.
+
+    :return: dict of handler wall seconds, the run's metrics (see RunMetrics.emf) and email bytes
+    """
+    symbols = synthetic_tickers(count)
+    session = SyntheticSession(symbols, years)
+    ses = StubSES()
+    metrics_file = os.path.join(work_dir, 'metrics.jsonl')
+    for name in ('price_store', 'chart_cache', 'reports', 'checkpoints'):
+        shutil.rmtree(os.path.join(work_dir, name), ignore_errors=True)
+
+    sma._http_session = session
+    sma._dynamodb_client = StubDynamoDBClient()
+    sma._email_credentials_cache = None
+    sma._ses_client = ses
+    sma.minute_quota = sma.TokenBucket(1_000_000, 60)
+    sma.day_quota = sma.TokenBucket(1_000_000, 24 * 60 * 60)
+    sma.PRICE_STORE_DIR = os.path.join(work_dir, 'price_store')
+    sma.CHART_CACHE_DIR = os.path.join(work_dir, 'chart_cache')
+    sma.REPORT_STORE_DIR = os.path.join(work_dir, 'reports')
+    sma.CHECKPOINT_STORE = 'local'
+    sma.CHECKPOINT_DIR = os.path.join(work_dir, 'checkpoints')
+    sma.LOCK_FILE_PATH = os.path.join(work_dir, 'stock_report.lock')
+    sma.METRICS_OUTPUT = metrics_file
+    if os.path.exists(sma.LOCK_FILE_PATH):
+        os.remove(sma.LOCK_FILE_PATH)
+    if os.path.exists(metrics_file):
+        os.remove(metrics_file)
+
+    start = time.perf_counter()
+    response = sma.lambda_handler({'tickers': symbols}, {})
+    elapsed = time.perf_counter() - start
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"Handler failed: {response['body']}")
+
+    with open(metrics_file) as f:
+        emf = json.loads(f.readlines()[-1])
+    metrics = {name: value for name, value in emf.items() if isinstance(value, (int, float))}
+    return {'handler_seconds': round(elapsed, 3), 'requests': session.requests, 'email_bytes': sum(ses.sent), 'metrics': metrics}
+
+def bench_stages(years, repeat):
+    """Best-of-`repeat` seconds of each pipeline stage on its own, for one synthetic ticker."""
+    raw = synthetic_time_series('STAGE', years)
+    document = json.dumps({'Time Series (Daily)': raw}).encode()
+    csv = synthetic_csv(raw)
+    history = sma.StockHistory('STAGE', sma.parse_time_series(raw))
+    windows = history.windows()
+    labels = [timeframe for _, timeframe, _ in sma.TIMEFRAMES]
+    records = sma.compute_insights_batch([windows[key] for key, _, _ in sma.TIMEFRAMES], labels)
+    insights_dict = {key: (timeframe, record) for (key, timeframe, _), record in zip(sma.TIMEFRAMES, records)}
+    images = {f'stock_analysis_{key}': sma.encode_chart(sma.chart_job(key, data)) for key, data in windows.items()}
+    section = sma.generate_html_content('STAGE', 'Synthetic company', images, insights_dict)
+
+    stages = {
+        'json_decode': (json.loads, document),
+        'parse_time_series': (sma.parse_time_series, raw),
+        'read_csv_bars': (lambda: sma.read_csv_bars(SyntheticResponse(csv), sma.history_start()),),
+        'windows': (history.windows,),
+        'compute_insights_batch': (sma.compute_insights_batch, list(windows.values()), labels),
+        'encode_charts': (lambda: [sma.encode_chart(sma.chart_job(key, data)) for key, data in windows.items()],),
+        'generate_html_content': (sma.generate_html_content, 'STAGE', 'Synthetic company', images, insights_dict),
+        'build_raw_email': (sma.build_raw_email, 'a@example.com', ['b@example.com'], sma.email_subject, 'body',
+                            ('stock_report.html', 'text/html', section.encode())),
+    }
+    return {name: round(best_of(repeat, *call)[0], 5) for name, call in stages.items()}
+
+def compare_results(current, baseline):
+    """Print current vs baseline for every number both result files have; returns the worst handler ratio."""
+    print(f"\n{'measurement':<42} {'baseline':>15} {'current':>15} {'change':>8}")
+    worst = 0.0
+    pairs = [(f'stage {name}', baseline['stages'].get(name), value) for name, value in current['stages'].items()]
+    for count, run in current['runs'].items():
+        base = baseline['runs'].get(count)
+        if not base:
+            continue
+        pairs.append((f'{count} tickers handler_seconds', base['handler_seconds'], run['handler_seconds']))
+        if base['handler_seconds']:
+            worst = max(worst, run['handler_seconds'] / base['handler_seconds'])
+        for name, value in run['metrics'].items():
+            if not name.endswith('.Calls'):
+                    pairs.append((f'{count} tickers {name}', base['metrics'].get(name), value))
+    for name, before, after in pairs:
+        if before is None:
+            continue
+        change = f'{(after - before) / before * 100:+.1f}%' if before else ''
+        print(f"{name:<42} {before:>15,.3f} {after:>15,.3f} {change:>8}")
+    return worst
+
+def bench_handler(args):
+    """Time lambda_handler end to end on synthetic data (and each stage alone); optionally compare to a baseline."""
+    if args.format:
+        sma.CHART_FORMAT = args.format
+    if args.render_workers is not None:
+        sma.RENDER_WORKERS = args.render_workers
+    results = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'years': args.years,
+            'chart_format': sma.CHART_FORMAT,
+            'render_workers': sma.RENDER_WORKERS,
+        },
+        'stages': bench_stages(args.years, args.repeat),
+        'runs': {},
+    }
+    print(f"{'stage':<24} {'ms':>10}")
+    for name, seconds in results['stages'].items():
+        print(f"{name:<24} {seconds * 1000:>10.2f}")
+
+    work_dir = tempfile.mkdtemp(prefix='stock_bench_')
+    try:
+        print(f"\n{'tickers':>8} {'handler s':>10} {'fetch s':>9} {'insights s':>11} {'render s':>9} {'html s':>8} {'report MB':>10}")
+        for count in args.tickers:
+            run = bench_handler_run(count, args.years, work_dir)
+            results['runs'][str(count)] = run
+            metrics = run['metrics']
+            stage = lambda name: metrics.get(f'{name}.WallTime', 0) / 1000
+            print(f"{count:>8} {run['handler_seconds']:>10.2f} {stage('Fetch'):>9.2f} {stage('Insights'):>11.2f} "
+                  f"{stage('Render'):>9.2f} {stage('Html'):>8.2f} {metrics.get('ReportBytes', 0) / 1e6:>10.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            worst = compare_results(results, json.load(f))
+        if args.max_slowdown and worst > args.max_slowdown:
+            print(f"FAIL: handler is {worst:.2f}x the baseline (limit {args.max_slowdown:.2f}x)")
+            sys.exit(1)
+
+def ingest_peak_rss(fetch_format, payloads):
+    """Growth of peak RSS over one fetch_bars call; run in a fresh process so earlier work does not hide it."""
+    sma._http_session = SyntheticSession(payloads, 0, payloads)
+    sma.minute_quota = sma.TokenBucket(1_000_000, 60)
+    sma.day_quota = sma.TokenBucket(1_000_000, 24 * 60 * 60)
+    sma.FETCH_FORMAT = fetch_format
+    # Reset the peak to the current RSS, otherwise the peak left by the imports usually hides the fetch
+    baseline = sma.mark_rss()
+    sma.fetch_bars('BENCH')
+    return sma.rss_growth(baseline)
+
+def bench_ingest(args):
+    """Bytes read, parse time and peak memory of one full download, streamed CSV vs JSON."""
+    session = SyntheticSession(['BENCH'], args.years)
+    sma._http_session = session
+    sma.minute_quota = sma.TokenBucket(1_000_000, 60)
+    sma.day_quota = sma.TokenBucket(1_000_000, 24 * 60 * 60)
+    spawn = multiprocessing.get_context('spawn')
+    print(f"{'format':<8} {'bars':>6} {'KB read':>9} {'parse ms':>9} {'alloc MB':>9} {'RSS MB':>8}")
+    for fetch_format in ('json', 'csv'):
+        sma.FETCH_FORMAT = fetch_format
+        sma.metrics = sma.RunMetrics()
+        seconds, bars = best_of(args.repeat, sma.fetch_bars, 'BENCH')
+        read = sma.metrics.counters['BytesDownloaded'] / args.repeat
+
+        # Peak of the Python and NumPy allocations made while fetching
+        tracemalloc.start()
+        sma.fetch_bars('BENCH')
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        with spawn.Pool(1) as pool:
+            rss = pool.apply(ingest_peak_rss, (fetch_format, session.payloads))
+
+        print(f"{fetch_format:<8} {len(bars):>6} {read / 1024:>9.1f} {seconds * 1000:>9.2f} {allocated / 1e6:>9.1f} {rss / 1e6:>8.1f}")
+
+def traced_bytes(build):
+    """Bytes still allocated (per tracemalloc) once build() has returned, with its result kept alive."""
+    tracemalloc.start()
+    try:
+        result = build()
+        return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+def bench_memory(args):
+    """Bytes per ticker held by bars and insights, boxed Python values vs typed arrays and records (tracemalloc)."""
+    histories = [synthetic_history(symbol, args.years) for symbol in synthetic_tickers(args.tickers)]
+    labels = [timeframe for _, timeframe, _ in sma.TIMEFRAMES]
+    all_windows = [history.windows() for history in histories]
+
+    cases = {
+        # One list of per-bar Python lists per timeframe, as the DataFrame-era code kept them
+        'bars: Python lists per timeframe': lambda: [
+            {key: [list(bar) for bar in window.tolist()] for key, window in windows.items()} for windows in all_windows
+        ],
+        'bars: BAR_DTYPE windows (views)': lambda: [
+            sma.StockHistory(history.symbol, history.bars.copy()).windows() for history in histories
+        ],
+        'insights: dicts': lambda: [
+            {key: (timeframe, sma.insights_to_dict(record, timeframe))
+             for (key, timeframe, _), record in zip(sma.TIMEFRAMES, sma.compute_insights_batch(list(windows.values())))}
+            for windows in all_windows
+        ],
+        'insights: INSIGHT_DTYPE records': lambda: [
+            {key: (timeframe, record)
+             for (key, timeframe, _), record in zip(sma.TIMEFRAMES, sma.compute_insights_batch(list(windows.values()), labels))}
+            for windows in all_windows
+        ],
+    }
+    print(f"{'representation':<34} {'bytes/ticker':>13}")
+    for name, build in cases.items():
+        size, _ = traced_bytes(build)
+        print(f"{name:<34} {size / args.tickers:>13,.0f}")
+
+    # Rendering from records must not cost more than rendering from dicts
+    windows = all_windows[0]
+    records = sma.compute_insights_batch(list(windows.values()), labels)
+    for name, insights_dict in (
+        ('dicts', {key: (label, sma.insights_to_dict(record, label)) for key, label, record in zip(windows, labels, records)}),
+        ('records', {key: (label, record) for key, label, record in zip(windows, labels, records)}),
+    ):
+        seconds, _ = best_of(args.repeat, sma.generate_html_content, 'BENCH', 'Synthetic company', {}, insights_dict)
+        print(f"{'generate_html_content, ' + name:<34} {seconds * 1000:>10.2f} ms")
+
+def bench_indicators(args):
+    """Time of every registered indicator from one shared IndicatorFrame vs a fresh frame per indicator."""
+    history = synthetic_history('INDICATORS', args.years)
+    windows = [history.window(time_range) for _, _, time_range in sma.TIMEFRAMES]
+    lengths = np.array([len(window) for window in windows], dtype=np.intp)
+    rows = {}
+    for field, name in (('Close', 'close'), ('High', 'high'), ('Low', 'low'), ('Volume', 'volume')):
+        rows[name] = np.full((len(windows), lengths.max()), np.nan)
+        for row, window in enumerate(windows):
+            rows[name][row, :len(window)] = window[field]
+    lookback = max(indicator.lookback for indicator in sma.INDICATORS.values())
+    chart = {name: values[-1:, :lengths[-1]] for name, values in rows.items()}
+
+    cases = {
+        'latest, all timeframes': lambda: sma.IndicatorFrame.from_rows(rows, lengths, lookback),
+        f'full series, {lengths[-1]} bars': lambda: sma.IndicatorFrame(chart),
+    }
+    print(f"{'frame':<28} {'indicators':>10} {'fused ms':>9} {'separate ms':>12} {'intermediates':>14}")
+    for name, make_frame in cases.items():
+        fused_frame = make_frame()
+        sma.compute_indicators(fused_frame)
+        fused, _ = best_of(args.repeat, lambda: sma.compute_indicators(make_frame()))
+        separate, _ = best_of(args.repeat, lambda: [sma.compute_indicators(make_frame(), [indicator]) for indicator in sma.INDICATORS])
+        print(f"{name:<28} {len(sma.INDICATORS):>10} {fused * 1000:>9.2f} {separate * 1000:>12.2f} {len(fused_frame._cache):>14}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    charts = subparsers.add_parser('charts', help=bench_charts.__doc__)
+    charts.add_argument('--years', type=int, default=20)
+    charts.add_argument('--repeat', type=int, default=3)
+    charts.add_argument('--max-points', type=int, default=sma.CHART_MAX_POINTS or 600)
+    charts.set_defaults(func=bench_charts)
+
+    formats = subparsers.add_parser('formats', help=bench_formats.__doc__)
+    formats.add_argument('--years', type=int, default=20)
+    formats.add_argument('--max-points', type=int, default=sma.CHART_MAX_POINTS or 600)
+    formats.set_defaults(func=bench_formats)
+
+    importtime = subparsers.add_parser('importtime', help=bench_importtime.__doc__)
+    importtime.add_argument('--budget-ms', type=float, default=400)
+    importtime.add_argument('--repeat', type=int, default=5)
+    importtime.add_argument('--top', type=int, default=8)
+    importtime.set_defaults(func=bench_importtime)
+
+    handler = subparsers.add_parser('handler', help=bench_handler.__doc__)
+    handler.add_argument('--tickers', type=int, nargs='+', default=[20, 100, 500])
+    handler.add_argument('--years', type=int, default=20)
+    handler.add_argument('--repeat', type=int, default=3)
+    handler.add_argument('--format', choices=sma.CHART_FORMATS)
+    handler.add_argument('--render-workers', type=int)
+    handler.add_argument('--output', help='write results to this JSON file')
+    handler.add_argument('--baseline', help='compare against a JSON file written by an earlier run')
+    handler.add_argument('--max-slowdown', type=float, help='exit 1 if the handler is more than this many times slower than the baseline')
+    handler.set_defaults(func=bench_handler)
+
+    ingest = subparsers.add_parser('ingest', help=bench_ingest.__doc__)
+    ingest.add_argument('--years', type=int, default=20)
+    ingest.add_argument('--repeat', type=int, default=5)
+    ingest.set_defaults(func=bench_ingest)
+
+    memory = subparsers.add_parser('memory', help=bench_memory.__doc__)
+    memory.add_argument('--tickers', type=int, default=100)
+    memory.add_argument('--years', type=int, default=5)
+    memory.add_argument('--repeat', type=int, default=20)
+    memory.set_defaults(func=bench_memory)
+
+    indicators = subparsers.add_parser('indicators', help=bench_indicators.__doc__)
+    indicators.add_argument('--years', type=int, default=5)
+    indicators.add_argument('--repeat', type=int, default=20)
+    indicators.set_defaults(func=bench_indicators)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
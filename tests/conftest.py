@@ -0,0 +1,5 @@
+import os
+import sys
+
+# stockMarketAnalysis.py is a top-level module, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,31 @@
+"""ChartCache size accounting and least-recently-used eviction."""
+import os
+
+import stockMarketAnalysis as sma
+
+
+def cached_keys(cache):
+    return sorted(name[:-len('.b64')] for name in os.listdir(cache.directory))
+
+def test_overwriting_an_entry_keeps_the_size_exact(tmp_path):
+    cache = sma.ChartCache(str(tmp_path), max_bytes=1000)
+    for _ in range(20):
+        cache.put('a', 'x' * 100)
+    cache.put('b', 'x' * 50)
+    cache.put('b', 'x' * 30)
+    assert cache.size == 130
+    assert cached_keys(cache) == ['a', 'b']
+    assert sma.ChartCache(str(tmp_path)).size == cache.size
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = sma.ChartCache(str(tmp_path), max_bytes=300)
+    for age, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, 'x' * 100)
+        os.utime(cache.path(key), (age, age))
+    # Reading 'a' makes it the most recently used, so 'b' goes first
+    assert cache.get('a') == 'x' * 100
+    cache.put('d', 'x' * 100)
+    assert cached_keys(cache) == ['a', 'c', 'd']
+    assert cache.size == 300
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
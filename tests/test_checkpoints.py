@@ -0,0 +1,132 @@
+"""LocalCheckpointStore on a temporary directory and DynamoCheckpointStore on an in-memory table."""
+import os
+
+import pytest
+
+import stockMarketAnalysis as sma
+
+pytest.importorskip('boto3')
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+
+
+class FakeTable:
+    """The put_item/query subset of a DynamoDB Table the checkpoint store uses, `page_size` items a page."""
+
+    def __init__(self, page_size=2):
+        self.items = {}
+        self.page_size = page_size
+
+    def put_item(self, Item, ConditionExpression=None):
+        key = (Item['run_date'], Item['part'])
+        if ConditionExpression == 'attribute_not_exists(part)' and key in self.items:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.items[key] = {name: Binary(value) if isinstance(value, bytes) else value for name, value in Item.items()}
+
+    def query(self, KeyConditionExpression, ExclusiveStartKey=None, Select=None, ConsistentRead=False):
+        matches = [item for key, item in sorted(self.items.items()) if self._matches(KeyConditionExpression, item)]
+        start = ExclusiveStartKey or 0
+        page = matches[start:start + self.page_size]
+        response = {'Items': page, 'Count': len(page)}
+        if start + self.page_size < len(matches):
+            response['LastEvaluatedKey'] = start + self.page_size
+        return response
+
+    def _matches(self, condition, item):
+        expression = condition.get_expression()
+        operator, values = expression['operator'], expression['values']
+        if operator == 'AND':
+            return all(self._matches(value, item) for value in values)
+        value = item[values[0].name]
+        if operator == '=':
+            return value == values[1]
+        if operator == 'begins_with':
+            return value.startswith(values[1])
+        raise NotImplementedError(operator)
+
+class FakeDynamoDB:
+    def __init__(self, table):
+        self.table = table
+
+    def Table(self, name):
+        return self.table
+
+@pytest.fixture
+def dynamo_store(monkeypatch):
+    table = FakeTable()
+    monkeypatch.setattr(sma, '_dynamodb', FakeDynamoDB(table))
+    return sma.DynamoCheckpointStore('checkpoints')
+
+@pytest.fixture
+def local_store(tmp_path):
+    return sma.LocalCheckpointStore(str(tmp_path / 'checkpoints'))
+
+@pytest.fixture(params=['local', 'dynamodb'])
+def store(request, local_store, dynamo_store):
+    return local_store if request.param == 'local' else dynamo_store
+
+def checkpoint(ticker, size=10):
+    return {'insights': {'ticker': ticker}, 'html': f'<section>{ticker}</section>' + 'x' * size, 'chart_format': 'png'}
+
+def test_save_and_load_by_run_date(store):
+    store.save('2024-09-30', 'AAPL', checkpoint('AAPL'))
+    store.save('2024-09-30', 'MSFT', checkpoint('MSFT'))
+    store.save('2024-10-01', 'KO', checkpoint('KO'))
+    store.save('2024-09-30', 'AAPL', checkpoint('AAPL', 20))
+    assert store.load('2024-09-30') == {'AAPL': checkpoint('AAPL', 20), 'MSFT': checkpoint('MSFT')}
+    assert store.load('2024-10-01') == {'KO': checkpoint('KO')}
+    assert store.load('2024-10-02') == {}
+
+def test_shard_markers_claim_and_sent_recipients_are_not_checkpoints(store):
+    store.save('2024-09-30', 'AAPL', checkpoint('AAPL'))
+    for shard in range(3):
+        store.mark_shard('2024-09-30', 'run1', shard)
+    store.mark_shard('2024-09-30', 'run2', 0)
+    assert store.count_shards('2024-09-30', 'run1') == 3
+    assert store.claim('2024-09-30', 'run1')
+    assert not store.claim('2024-09-30', 'run1')
+    store.mark_sent('2024-09-30', ['a@x.com', 'b@x.com'])
+    store.mark_sent('2024-09-30', ['c@x.com'])
+    assert store.load_sent('2024-09-30') == {'a@x.com', 'b@x.com', 'c@x.com'}
+    assert store.load_sent('2024-10-01') == set()
+    assert store.load('2024-09-30') == {'AAPL': checkpoint('AAPL')}
+
+def test_dynamo_splits_large_checkpoints_and_skips_partial_saves(dynamo_store, monkeypatch):
+    monkeypatch.setattr(sma, 'CHECKPOINT_ITEM_BYTES', 64)
+    large = checkpoint('AAPL', 5000)
+    dynamo_store.save('2024-09-30', 'AAPL', large)
+    dynamo_store.save('2024-09-30', 'MSFT', checkpoint('MSFT', 5000))
+    parts = [part for _, part in dynamo_store.table.items if part.startswith('AAPL#')]
+    assert len(parts) > 1
+    del dynamo_store.table.items[('2024-09-30', 'MSFT#0')]
+    assert dynamo_store.load('2024-09-30') == {'AAPL': large}
+
+def test_local_load_ignores_unreadable_checkpoints(local_store):
+    local_store.save('2024-09-30', 'AAPL', checkpoint('AAPL'))
+    with open(os.path.join(local_store.directory, '2024-09-30', 'MSFT.json.gz'), 'wb') as f:
+        f.write(b'not gzip')
+    assert local_store.load('2024-09-30') == {'AAPL': checkpoint('AAPL')}
+
+@pytest.mark.parametrize('keep_days, kept', [
+    (None, ['2024-09-28', '2024-09-29', '2024-09-30']),
+    (1, ['2024-09-30']),
+    (0, []),
+    (10, ['2024-09-26', '2024-09-27', '2024-09-28', '2024-09-29', '2024-09-30']),
+])
+def test_local_prune_keeps_newest_run_dates(local_store, keep_days, kept, monkeypatch):
+    monkeypatch.setattr(sma, 'CHECKPOINT_KEEP_DAYS', 3)
+    for day in range(26, 31):
+        local_store.save(f'2024-09-{day}', 'AAPL', checkpoint('AAPL'))
+    local_store.prune(keep_days)
+    assert sorted(os.listdir(local_store.directory)) == kept
+
+def test_local_prune_rejects_negative_keep_days(local_store):
+    with pytest.raises(ValueError):
+        local_store.prune(-1)
+
+def test_checkpoints_are_off_unless_configured(monkeypatch):
+    monkeypatch.setattr(sma, 'CHECKPOINT_STORE', '')
+    assert sma.get_checkpoint_store() is None
+    monkeypatch.setattr(sma, 'CHECKPOINT_STORE', 'redis')
+    with pytest.raises(ValueError):
+        sma.get_checkpoint_store()
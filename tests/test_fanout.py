@@ -0,0 +1,83 @@
+"""The coordinator, worker and aggregation path of a fanned-out run, on synthetic data."""
+import multiprocessing
+import os
+
+import pytest
+
+import stockMarketAnalysis as sma
+import stockMarketBenchmark as bench
+
+pytest.importorskip('jinja2')
+
+TICKERS = {f'T{i}': f'Synthetic company {i}' for i in range(5)}
+
+
+@pytest.fixture
+def offline_run(tmp_path, monkeypatch):
+    """Serve synthetic prices, keep every store under tmp_path and write sent reports to tmp_path/sent."""
+    sent_dir = tmp_path / 'sent'
+    sent_dir.mkdir()
+
+    def send_email_with_attachment(html_content, filename='stock_report.html', delivery=None, precompressed=False,
+                                   **kwargs):
+        with open(sent_dir / f'{os.getpid()}_{filename}', 'wb') as f:
+            f.write(html_content.read())
+
+    monkeypatch.setattr(sma, '_http_session', bench.SyntheticSession(TICKERS, years=3))
+    monkeypatch.setattr(sma, 'minute_quota', sma.TokenBucket(1_000_000, 60))
+    monkeypatch.setattr(sma, 'day_quota', sma.TokenBucket(1_000_000, 24 * 60 * 60))
+    monkeypatch.setattr(sma, 'send_email_with_attachment', send_email_with_attachment)
+    monkeypatch.setattr(sma, 'get_subscriptions', lambda refresh=False: ('reports@example.com', {'reader@example.com': None}))
+    monkeypatch.setattr(sma, 'PRICE_STORE_DIR', str(tmp_path / 'price_store'))
+    monkeypatch.setattr(sma, 'CHART_CACHE_DIR', '')
+    monkeypatch.setattr(sma, 'CHART_FORMAT', 'svg')
+    monkeypatch.setattr(sma, 'RENDER_WORKERS', 0)
+    monkeypatch.setattr(sma, 'CHECKPOINT_STORE', 'local')
+    monkeypatch.setattr(sma, 'CHECKPOINT_DIR', str(tmp_path / 'checkpoints'))
+    monkeypatch.setattr(sma, 'LOCK_FILE_PATH', str(tmp_path / 'stock_report.lock'))
+    monkeypatch.setattr(sma, 'TICKER_COSTS_PATH', str(tmp_path / 'ticker_costs.json'))
+    monkeypatch.setattr(sma, 'METRICS_OUTPUT', str(tmp_path / 'metrics.jsonl'))
+    return sent_dir
+
+def sent_reports(sent_dir):
+    reports = []
+    for name in sorted(os.listdir(sent_dir)):
+        with open(sent_dir / name, 'rb') as f:
+            reports.append(f.read())
+        os.remove(sent_dir / name)
+    return reports
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='the shard processes must inherit the offline stand-ins')
+def test_local_fan_out_sends_the_single_run_report(offline_run, tmp_path):
+    response = sma.lambda_handler({'tickers': TICKERS, 'resume': False}, {})
+    assert response['statusCode'] == 200
+    [single] = sent_reports(offline_run)
+    os.remove(sma.LOCK_FILE_PATH)
+
+    response = sma.lambda_handler({'tickers': TICKERS, 'mode': 'coordinator', 'shard_size': 2, 'dispatch': 'local'}, {})
+    assert response['statusCode'] == 202
+    assert 'Dispatched 3 shards' in response['body']
+    # Exactly one shard, the last to finish, aggregated and sent the report
+    [fanned_out] = sent_reports(offline_run)
+    assert fanned_out == single
+    assert os.path.exists(sma.LOCK_FILE_PATH)
+    [run_date] = os.listdir(tmp_path / 'checkpoints')
+    [run_id] = os.listdir(tmp_path / 'checkpoints' / run_date / '_shards')
+    assert sorted(os.listdir(tmp_path / 'checkpoints' / run_date / '_shards' / run_id)) == ['0', '1', '2', 'aggregate']
+
+def test_fan_out_refused_without_a_checkpoint_store(offline_run, monkeypatch):
+    monkeypatch.setattr(sma, 'CHECKPOINT_STORE', '')
+    response = sma.lambda_handler({'tickers': TICKERS, 'mode': 'coordinator', 'dispatch': 'local'}, {})
+    assert response['statusCode'] == 500
+    assert 'CHECKPOINT_STORE' in response['body']
+    assert sent_reports(offline_run) == []
+
+def test_fan_out_refused_for_lambda_workers_with_checkpoints_in_tmp(offline_run, monkeypatch):
+    monkeypatch.setattr(sma, 'CHECKPOINT_DIR', '/tmp/checkpoints')
+    dispatched = []
+    monkeypatch.setattr(sma.LambdaDispatcher, 'dispatch', lambda self, events, context=None: dispatched.extend(events))
+    response = sma.lambda_handler({'tickers': TICKERS, 'mode': 'coordinator', 'dispatch': 'lambda'}, {})
+    assert response['statusCode'] == 500
+    assert 'CHECKPOINT_DIR' in response['body']
+    assert dispatched == []
@@ -0,0 +1,33 @@
+"""Importing stockMarketAnalysis stays cheap: heavy libraries load on first use, not at import."""
+import os
+import subprocess
+import sys
+
+import stockMarketBenchmark as bench
+
+# Same budget as `python stockMarketBenchmark.py importtime`
+IMPORT_BUDGET_MS = 400
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cold_import():
+    """(cumulative import microseconds, lazy modules loaded) of one fresh interpreter."""
+    check = f"import stockMarketAnalysis, sys; print(','.join(m for m in {bench.LAZY_MODULES!r} if m in sys.modules))"
+    # No AWS settings in the environment: importing must not need credentials or a region
+    env = {key: value for key, value in os.environ.items() if not key.startswith('AWS_')}
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', check],
+                          cwd=REPO, env=env, capture_output=True, text=True, check=True)
+    for line in proc.stderr.splitlines():
+        # Lines look like "import time:  self [us] | cumulative | imported package"
+        if line.startswith('import time:') and line.endswith('| stockMarketAnalysis'):
+            return int(line.split('|')[1]), proc.stdout.strip()
+    raise AssertionError(f"no import time for stockMarketAnalysis in:\n{proc.stderr[-2000:]}")
+
+def test_lazy_modules_are_not_imported():
+    _, loaded = cold_import()
+    assert loaded == ''
+
+def test_import_within_budget():
+    # Best of three, so one slow start on a busy machine does not fail the run
+    best = min(cold_import()[0] for _ in range(3))
+    assert best / 1000 <= IMPORT_BUDGET_MS
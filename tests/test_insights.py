@@ -0,0 +1,241 @@
+"""compute_insights_batch and the indicator engine against pandas, and the per-window implementation it replaced."""
+import math
+
+import numpy as np
+import pytest
+
+import stockMarketAnalysis as sma
+
+pd = pytest.importorskip('pandas')
+stats = pytest.importorskip('scipy.stats')
+
+
+# The pre-batch get_insights and its helpers, unchanged apart from taking BAR_DTYPE rows
+def baseline_trend(closes):
+    closes = [0 if math.isnan(x) else x for x in closes]
+    if len(closes) < 2:
+        # linregress rejects a single point; the batch reports no trend for it
+        return 'Downward', 0.0
+    if min(closes) == max(closes):
+        # Newer scipy returns NaN r for a flat series; the baseline this replaced reported 0
+        return 'Downward', 0.0
+    x = np.arange(len(closes))
+    slope, intercept, r_value, p_value, std_err = stats.linregress(x, closes)
+    return ('Upward' if slope > 0 else 'Downward'), abs(r_value)
+
+def baseline_moving_averages(closes):
+    df = pd.Series(closes)
+    return df.rolling(window=50).mean().iloc[-1] or 0, df.rolling(window=200).mean().iloc[-1] or 0
+
+def baseline_rsi(closes, period=14):
+    delta = pd.Series(closes).diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
+    rs = gain / loss
+    return 100 - (100 / (1 + rs.iloc[-1])) if rs.iloc[-1] != np.inf else 50
+
+def baseline_bollinger_bands(closes, period=20):
+    df = pd.Series(closes)
+    ma = df.rolling(window=period).mean().iloc[-1] or 0
+    std = df.rolling(window=period).std().iloc[-1] or 0
+    return ma + (std * 2), ma, ma - (std * 2)
+
+def baseline_insights(rows, timeframe):
+    df = pd.DataFrame(rows, columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
+    df['Date'] = pd.to_datetime(df['Date'])
+    df.set_index('Date', inplace=True)
+    df.sort_index(inplace=True)
+    df = df.fillna(0)
+
+    first_close = df['Close'].iloc[0]
+    last_close = df['Close'].iloc[-1]
+    price_change = last_close - first_close
+    price_change_percent = (price_change / first_close) * 100
+    closes = df['Close'].values
+    trend, trend_strength = baseline_trend(closes)
+    ma50, ma200 = baseline_moving_averages(closes)
+    upper_bb, middle_bb, lower_bb = baseline_bollinger_bands(closes)
+    returns = df['Close'].pct_change()
+
+    def or_zero(value):
+        return value if not math.isnan(value) else 0
+
+    return {
+        'highest_close': or_zero(df['Close'].max()),
+        'lowest_close': or_zero(df['Close'].min()),
+        'average_close': or_zero(df['Close'].mean()),
+        'median_close': or_zero(df['Close'].median()),
+        'std_dev_close': or_zero(df['Close'].std()),
+        'range_close': or_zero(df['Close'].max() - df['Close'].min()),
+        'total_volume': or_zero(df['Volume'].sum()),
+        'median_volume': or_zero(df['Volume'].median()),
+        'std_dev_volume': or_zero(df['Volume'].std()),
+        'range_volume': or_zero(df['Volume'].max() - df['Volume'].min()),
+        'max_volume_date': df['Volume'].idxmax().strftime('%Y-%m-%d'),
+        'min_volume_date': df['Volume'].idxmin().strftime('%Y-%m-%d'),
+        'classification': 'Bullish' if price_change_percent > 5 else 'Bearish' if price_change_percent < -5 else 'Stable',
+        'start_date': df.index.min().strftime('%Y-%m-%d'),
+        'end_date': df.index.max().strftime('%Y-%m-%d'),
+        'start_price': first_close,
+        'end_price': last_close,
+        'price_change': price_change,
+        'price_change_percent': price_change_percent,
+        'max_daily_gain': returns.max() * 100,
+        'max_daily_loss': returns.min() * 100,
+        'volatility': returns.std() * 100,
+        'trend': trend,
+        'trend_strength': trend_strength,
+        'ma50': ma50,
+        'ma200': ma200,
+        'rsi': baseline_rsi(closes),
+        'upper_bb': upper_bb,
+        'middle_bb': middle_bb,
+        'lower_bb': lower_bb,
+        'timeframe': timeframe,
+    }
+
+
+def make_bars(closes, volumes=None, start='2023-01-02'):
+    closes = np.asarray(closes, dtype=np.float64)
+    bars = np.zeros(len(closes), dtype=sma.BAR_DTYPE)
+    bars['Date'] = np.datetime64(start) + np.arange(len(closes))
+    bars['Open'] = bars['Close'] = closes
+    bars['High'] = np.nan_to_num(closes) * 1.01
+    bars['Low'] = np.nan_to_num(closes) * 0.99
+    rng = np.random.default_rng(len(closes))
+    bars['Volume'] = rng.integers(1_000_000, 50_000_000, len(closes)) if volumes is None else volumes
+    return bars
+
+def random_walk(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return 100 * np.exp(np.cumsum(rng.normal(0, 0.015, n)))
+
+def baseline_rows(bars, volumes=None):
+    """BAR_DTYPE bars as the row lists the baseline read; `volumes` overrides the stored volume."""
+    volumes = bars['Volume'] if volumes is None else volumes
+    return [[str(bar['Date']), bar['Open'], bar['High'], bar['Low'], bar['Close'], volume]
+            for bar, volume in zip(bars, volumes)]
+
+def with_nan_closes(closes, positions):
+    closes = np.array(closes, dtype=np.float64)
+    closes[positions] = np.nan
+    return closes
+
+def zero_at(volumes, positions):
+    volumes = np.array(volumes)
+    volumes[positions] = 0
+    return volumes
+
+CASES = {
+    'random walk, 5 years': make_bars(random_walk(1260)),
+    'random walk, 250 bars': make_bars(random_walk(250, seed=1)),
+    'constant prices': make_bars(np.full(120, 42.0)),
+    'constant prices, 1 bar short of MA200': make_bars(np.full(199, 10.0)),
+    'NaN closes': make_bars(with_nan_closes(random_walk(80, seed=2), [0, 17, 79])),
+    'zero volume': make_bars(random_walk(60, seed=3), np.zeros(60, dtype=np.int64)),
+    'some zero volume': make_bars(random_walk(60, seed=4), zero_at(np.arange(1, 61) * 1000, [5, 30])),
+    '1 bar': make_bars([101.5]),
+    '2 bars': make_bars([101.5, 99.0]),
+    '2 constant bars': make_bars([50.0, 50.0]),
+    '14 bars': make_bars(random_walk(14, seed=5)),
+}
+
+def assert_matches_baseline(record, expected):
+    for name, value in expected.items():
+        actual = record[name]
+        if isinstance(value, str):
+            assert str(actual) == value, name
+        else:
+            np.testing.assert_allclose(float(actual), float(value), rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=name)
+
+@pytest.mark.parametrize('case', CASES)
+def test_get_insights_matches_baseline(case):
+    bars = CASES[case]
+    assert_matches_baseline(sma.get_insights(bars, '1 Year'), baseline_insights(baseline_rows(bars), '1 Year'))
+
+def test_missing_volume_stored_as_zero_matches_baseline_nan():
+    # BAR_DTYPE volumes are integers, so a missing volume is kept as 0; the baseline filled NaN with 0
+    bars = make_bars(random_walk(40, seed=6), zero_at(np.arange(1, 41) * 1000, [3, 20]))
+    volumes = bars['Volume'].astype(np.float64)
+    volumes[[3, 20]] = np.nan
+    assert_matches_baseline(sma.get_insights(bars, '30 Days'), baseline_insights(baseline_rows(bars, volumes), '30 Days'))
+
+def test_batch_rows_match_single_windows():
+    # One padded batch of every case must give the same rows as each window on its own
+    names = list(CASES)
+    batch = sma.compute_insights_batch([CASES[name] for name in names], names)
+    for name, record in zip(names, batch):
+        single = sma.get_insights(CASES[name], name)
+        for field in sma.INSIGHT_DTYPE.names:
+            if np.issubdtype(batch.dtype[field], np.floating):
+                np.testing.assert_allclose(record[field], single[field], rtol=1e-12, equal_nan=True, err_msg=f'{name}: {field}')
+            else:
+                assert record[field] == single[field], f'{name}: {field}'
+
+@pytest.mark.parametrize('bars, missing', [
+    (13, ('macd', 'macd_signal', 'macd_hist', 'atr', 'stoch_k', 'stoch_d', 'obv_change')),
+    (25, ('macd', 'macd_signal', 'macd_hist')),
+    (33, ('macd_signal', 'macd_hist')),
+    (34, ()),
+])
+def test_indicators_missing_until_warmed_up(bars, missing):
+    record = sma.get_insights(make_bars(random_walk(bars, seed=7)), '30 Days')
+    for name in ('macd', 'macd_signal', 'macd_hist', 'atr', 'stoch_k', 'stoch_d', 'obv_change'):
+        assert math.isnan(record[name]) == (name in missing), name
+
+def test_reports_leave_out_missing_indicators():
+    record = sma.get_insights(make_bars(random_walk(5, seed=8)), '5 Days')
+    text = sma.generate_graph_description(record) + sma.generate_insights_html(record)
+    for phrase in ('MACD', 'stochastic', 'Stochastic', 'true range', 'True Range', 'n-balance volume', 'n-Balance Volume'):
+        assert phrase not in text, phrase
+
+def pandas_indicators(closes, highs, lows, volumes):
+    """MACD, ATR, OBV and stochastic from pandas, NaN until each has enough bars."""
+    close, high, low = pd.Series(closes), pd.Series(highs), pd.Series(lows)
+    macd = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    signal = macd.ewm(span=9, adjust=False).mean()
+    previous = close.shift()
+    true_range = pd.concat([high - low, (high - previous).abs(), (low - previous).abs()], axis=1).max(axis=1)
+    obv = (np.sign(close.diff()).fillna(0) * pd.Series(volumes, dtype=np.float64)).cumsum()
+    lowest = low.rolling(14).min()
+    stoch_k = (close - lowest) / (high.rolling(14).max() - lowest) * 100
+    bars = pd.Series(np.arange(len(closes)))
+    return {
+        'macd': macd.where(bars >= 25),
+        'macd_signal': signal.where(bars >= 33),
+        'macd_hist': (macd - signal).where(bars >= 33),
+        'atr': true_range.ewm(alpha=1 / 14, adjust=False).mean().where(bars >= 13),
+        'obv_change': obv - obv.shift(20),
+        'stoch_k': stoch_k,
+        'stoch_d': stoch_k.rolling(3).mean(),
+    }
+
+def test_padded_indicator_rows_match_pandas():
+    # Rows of different lengths share one frame, padded across several _ema blocks
+    lengths = np.array([700, 300, 129, 40, 5])
+    closes = np.full((len(lengths), lengths.max()), np.nan)
+    for row, length in enumerate(lengths):
+        closes[row, :length] = random_walk(length, seed=row)
+    rng = np.random.default_rng(9)
+    highs = closes * rng.uniform(1, 1.03, closes.shape)
+    lows = closes * rng.uniform(0.97, 1, closes.shape)
+    volumes = rng.integers(1_000_000, 50_000_000, closes.shape).astype(np.float64)
+    frame = sma.IndicatorFrame.from_rows({'close': closes, 'high': highs, 'low': lows, 'volume': volumes},
+                                         lengths, lengths.max())
+    series = sma.compute_indicators(frame)
+    for row, length in enumerate(lengths):
+        expected = pandas_indicators(closes[row, :length], highs[row, :length], lows[row, :length], volumes[row, :length])
+        for name, values in expected.items():
+            np.testing.assert_allclose(series[name][row, -length:], values.to_numpy(), rtol=1e-9, atol=1e-9,
+                                       equal_nan=True, err_msg=f'{length} bars: {name}')
+            assert np.isnan(series[name][row, :-length]).all(), f'{length} bars: {name} padding'
+
+@pytest.mark.parametrize('bars', [40, 250, 900])
+def test_latest_indicators_match_pandas_over_lookback(bars):
+    # The insights read the last INDICATOR_LOOKBACK bars of each window
+    window = make_bars(random_walk(bars, seed=bars))
+    tail = window[-sma.INDICATOR_LOOKBACK:]
+    expected = pandas_indicators(tail['Close'], tail['High'], tail['Low'], tail['Volume'])
+    record = sma.get_insights(window, '1 Year')
+    for name, values in expected.items():
+        np.testing.assert_allclose(record[name], values.iloc[-1], rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=name)
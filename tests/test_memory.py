@@ -0,0 +1,38 @@
+"""Memory held and touched by compute_insights_batch, per tracemalloc."""
+import tracemalloc
+
+import numpy as np
+
+import stockMarketAnalysis as sma
+import stockMarketBenchmark as bench
+
+# The padded matrices take 8 bytes per cell per column; the peak stays within this many bytes per cell
+PEAK_BYTES_PER_CELL = 160
+
+
+def traced_insights(windows):
+    """(peak bytes, bytes still held, result) of one compute_insights_batch call."""
+    tracemalloc.start()
+    try:
+        result = sma.compute_insights_batch(windows)
+        current, peak = tracemalloc.get_traced_memory()
+        return peak, current, result
+    finally:
+        tracemalloc.stop()
+
+def test_peak_memory_grows_with_the_padded_batch_only():
+    windows = [window for index in range(10) for window in bench.synthetic_history(f'MEM{index}', 6).windows().values()]
+    # Warm the caches (EMA weights, lazily built constants) so they are not counted
+    sma.compute_insights_batch(windows[:6])
+    peak, current, records = traced_insights(windows)
+    cells = len(windows) * max(len(window) for window in windows)
+    assert peak <= PEAK_BYTES_PER_CELL * cells, f'{peak / cells:.0f} bytes per cell'
+    # Only the records outlive the call
+    assert records.dtype == sma.INSIGHT_DTYPE
+    assert current <= records.nbytes + 16 * 1024
+
+def test_insight_record_is_fixed_size():
+    windows = list(bench.synthetic_history('MEM', 2).windows().values())
+    records = sma.compute_insights_batch(windows)
+    assert records.nbytes == len(windows) * sma.INSIGHT_DTYPE.itemsize
+    assert not any(np.dtype(field).hasobject for field, _ in sma.INSIGHT_DTYPE.fields.values())
@@ -0,0 +1,97 @@
+"""Recipient lookup: pagination, watchlists, the index query and the per-container cache."""
+import pytest
+
+import stockMarketAnalysis as sma
+
+pytest.importorskip('botocore')
+
+PAGES = [
+    {'Items': [
+        {'emailID': {'S': 'recipient1'}, 'emailAddress': {'S': 'all@example.com'}},
+        {'emailID': {'S': 'recipient2'}, 'emailAddress': {'S': 'list@example.com'},
+         'watchlist': {'L': [{'S': 'aapl'}, {'S': ' MSFT '}, {'S': 'AAPL'}]}},
+    ]},
+    {'Items': []},
+    {'Items': [
+        {'emailID': {'S': 'recipient3'}, 'emailAddress': {'S': 'set@example.com'}, 'watchlist': {'SS': ['KO']}},
+        {'emailID': {'S': 'recipient4'}, 'emailAddress': {'S': 'text@example.com'}, 'watchlist': {'S': 'nvda, ,tsla'}},
+        {'emailID': {'S': 'recipient5'}, 'emailAddress': {'S': 'blank@example.com'}, 'watchlist': {'S': ' , '}},
+        {'emailID': {'S': 'recipient6'}},
+    ]},
+]
+
+
+class StubPaginator:
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        self.client.calls.append((self.operation, kwargs))
+        yield from self.client.pages
+
+class StubDynamoDBClient:
+    def __init__(self, pages=PAGES, sender='reports@example.com'):
+        self.pages = pages
+        self.sender = sender
+        self.calls = []
+
+    def get_item(self, **kwargs):
+        self.calls.append(('get_item', kwargs))
+        return {'Item': {'emailAddress': {'S': self.sender}}} if self.sender else {}
+
+    def get_paginator(self, operation):
+        return StubPaginator(self, operation)
+
+@pytest.fixture
+def client(monkeypatch):
+    client = StubDynamoDBClient()
+    monkeypatch.setattr(sma, '_dynamodb_client', client)
+    monkeypatch.setattr(sma, '_email_credentials_cache', None)
+    return client
+
+def test_every_page_is_read_and_watchlists_parsed(client):
+    sender, subscriptions = sma.get_subscriptions()
+    assert sender == 'reports@example.com'
+    assert subscriptions == {
+        'all@example.com': None,
+        'list@example.com': ('AAPL', 'MSFT'),
+        'set@example.com': ('KO',),
+        'text@example.com': ('NVDA', 'TSLA'),
+        'blank@example.com': None,
+    }
+    [(operation, kwargs)] = [call for call in client.calls if call[0] != 'get_item']
+    assert operation == 'scan'
+    assert kwargs['ProjectionExpression'] == 'emailID, emailAddress, watchlist'
+    assert kwargs['ExpressionAttributeValues'] == {':prefix': {'S': 'recipient'}}
+
+def test_index_is_queried_when_configured(client, monkeypatch):
+    monkeypatch.setattr(sma, 'RECIPIENT_INDEX', 'byType')
+    assert len(dict(sma.iter_recipients(client))) == 5
+    [(operation, kwargs)] = client.calls
+    assert operation == 'query'
+    assert kwargs['IndexName'] == 'byType'
+    assert kwargs['ExpressionAttributeNames'] == {'#type': 'emailType'}
+
+def test_lookup_is_cached_for_the_ttl(client, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sma.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(sma, 'RECIPIENT_CACHE_TTL', 300)
+    _, first = sma.get_subscriptions()
+    first['intruder@example.com'] = None
+    now[0] += 299
+    _, cached = sma.get_subscriptions()
+    assert 'intruder@example.com' not in cached
+    assert len(client.calls) == 2
+    sma.get_subscriptions(refresh=True)
+    assert len(client.calls) == 4
+    now[0] += 301
+    assert sma.get_email_credentials()[1] == list(cached)
+    assert len(client.calls) == 6
+
+@pytest.mark.parametrize('stub', [StubDynamoDBClient(sender=None), StubDynamoDBClient(pages=[{'Items': []}])])
+def test_missing_sender_or_recipients_raise(stub, monkeypatch):
+    monkeypatch.setattr(sma, '_dynamodb_client', stub)
+    monkeypatch.setattr(sma, '_email_credentials_cache', None)
+    with pytest.raises(ValueError):
+        sma.get_subscriptions()
@@ -0,0 +1,70 @@
+"""StreamingIndicators against the calculate_* functions run over every close seen so far."""
+import numpy as np
+import pytest
+
+import stockMarketAnalysis as sma
+
+
+def random_walk(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return 100 * np.exp(np.cumsum(rng.normal(0, 0.015, n)))
+
+def batch_latest(closes):
+    ma50, ma200 = sma.calculate_moving_averages(closes)
+    upper_bb, middle_bb, lower_bb = sma.calculate_bollinger_bands(closes)
+    trend, trend_strength = sma.calculate_trend(closes)
+    return {
+        'ma50': ma50, 'ma200': ma200, 'rsi': sma.calculate_rsi(closes),
+        'upper_bb': upper_bb, 'middle_bb': middle_bb, 'lower_bb': lower_bb,
+        'trend': trend, 'trend_strength': trend_strength,
+    }
+
+def assert_matches_batch(state, closes):
+    latest = state.latest()
+    for name, expected in batch_latest(closes).items():
+        if name == 'trend':
+            # A slope within rounding of 0 may land on either side
+            if abs(latest['trend_strength']) > 1e-9:
+                assert latest[name] == expected, (len(closes), name)
+            continue
+        np.testing.assert_allclose(latest[name], expected, rtol=1e-8, atol=1e-8, equal_nan=True,
+                                   err_msg=f'{len(closes)} bars: {name}')
+
+def test_bar_by_bar_matches_batch_with_round_trip():
+    closes = random_walk(1500, seed=3)
+    closes[[0, 40, 700]] = np.nan
+    volumes = np.random.default_rng(4).integers(0, 50_000_000, len(closes))
+    dates = np.datetime64('2019-01-01') + np.arange(len(closes))
+    state = sma.StreamingIndicators()
+    for n, (close, volume, date) in enumerate(zip(closes, volumes, dates), 1):
+        state.update(close, volume, date)
+        if n == 777:
+            data = state.to_bytes()
+            state = sma.StreamingIndicators.from_bytes(data)
+            assert state.to_bytes() == data
+        assert_matches_batch(state, closes[:n])
+    latest = state.latest()
+    assert latest['total_volume'] == volumes.sum()
+    assert latest['range_volume'] == volumes.max() - volumes.min()
+    assert latest['highest_close'] == np.nanmax(closes)
+    assert latest['end_date'] == str(dates[-1])
+
+def test_flat_prices_have_no_trend():
+    state = sma.StreamingIndicators()
+    for _ in range(30):
+        state.update(10.0, 100)
+    assert state.latest()['trend_strength'] == 0
+    assert_matches_batch(state, np.full(30, 10.0))
+
+def test_old_and_repeated_dates_are_ignored():
+    state = sma.StreamingIndicators()
+    state.update(10.0, 100, '2024-01-02')
+    state.update(11.0, 100, '2024-01-02')
+    state.update(12.0, 100, '2024-01-01')
+    assert state.count == 1
+
+def test_from_bytes_rejects_other_versions():
+    data = bytearray(sma.StreamingIndicators().to_bytes())
+    data[0] = sma.StreamingIndicators.VERSION + 1
+    with pytest.raises(ValueError):
+        sma.StreamingIndicators.from_bytes(bytes(data))